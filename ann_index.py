@@ -0,0 +1,196 @@
+import argparse
+import logging
+import math
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from vector_index import VectorIndex, normalize_rows, top_k_positions
+
+logger = logging.getLogger(__name__)
+
+ASSIGN_CHUNK = 65536
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row, computed in chunks."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _inverted_lists(assignments: np.ndarray, n_lists: int) -> List[np.ndarray]:
+    """Row numbers grouped by assigned list, ascending within each list."""
+    order = np.argsort(assignments, kind="stable")
+    bounds = np.searchsorted(assignments[order], np.arange(n_lists + 1))
+    return [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(n_lists)]
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0, max_train: int = 256) -> np.ndarray:
+    """k-means on the unit sphere; trains on at most `max_train` points per cluster."""
+    rng = np.random.default_rng(seed)
+    n_train = min(len(vectors), n_clusters * max_train)
+    train_rows = np.sort(rng.choice(len(vectors), n_train, replace=False))
+    train = np.asarray(vectors[train_rows], dtype=np.float32)
+    centroids = train[rng.choice(n_train, n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = np.argmax(train @ centroids.T, axis=1)
+        for cluster in range(n_clusters):
+            members = train[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+            else:
+                # Re-seed empty clusters so every list stays useful
+                centroids[cluster] = train[rng.integers(n_train)]
+        centroids = normalize_rows(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over a VectorIndex.
+
+    A coarse quantizer (spherical k-means centroids) partitions the base index's
+    rows into `n_lists` inverted lists; a query scores the centroids, then only the
+    rows in the `nprobe` closest lists. Vectors are not copied: the IVF index reads
+    them from the base VectorIndex (which may be a memory map), through its
+    quantized codes when it has them. The lock only guards swapping in a rebuilt
+    or extended state, so concurrent searches do not wait for each other.
+    """
+
+    def __init__(self, base: VectorIndex, n_lists: int = 0, nprobe: int = 8):
+        self.base = base
+        self.requested_lists = n_lists
+        self.n_lists = n_lists or max(1, int(math.sqrt(len(base))))
+        self.nprobe = nprobe
+        self.centroids = np.zeros((0, base.dim), dtype=np.float32)
+        self.lists: List[np.ndarray] = []
+        self.n_assigned = 0
+        self._lock = threading.Lock()
+
+    def _state(self):
+        with self._lock:
+            return self.base, self.centroids, self.lists, self.n_assigned
+
+    def _swap(self, base: VectorIndex, centroids: np.ndarray, lists: List[np.ndarray]):
+        with self._lock:
+            self.base, self.centroids, self.lists = base, centroids, lists
+            self.n_lists = len(lists)
+            self.n_assigned = sum(len(rows) for rows in lists)
+
+    def build(self, n_iter: int = 20, seed: int = 0):
+        base = self.base
+        n_rows = len(base)
+        if not n_rows:
+            self._swap(base, np.zeros((0, base.dim), dtype=np.float32), [])
+            return
+        n_lists = min(self.requested_lists or max(1, int(math.sqrt(n_rows))), n_rows)
+        started = time.perf_counter()
+        centroids = spherical_kmeans(base.vectors, n_lists, n_iter=n_iter, seed=seed)
+        self._swap(base, centroids, _inverted_lists(_assign(base.vectors, centroids), n_lists))
+        logger.info(f"Built IVF index with {n_lists} lists over {n_rows} vectors in {time.perf_counter() - started:.2f}s")
+
+    def rebase(self, base: VectorIndex):
+        """Switch to a grown base index and assign only its new rows to lists."""
+        _, centroids, lists, n_assigned = self._state()
+        if not len(centroids):
+            self.base = base
+            self.build()
+            return
+        new_rows = np.arange(n_assigned, len(base))
+        lists = list(lists)
+        if len(new_rows):
+            assignments = _assign(base.vectors[n_assigned:], centroids)
+            for cluster in np.unique(assignments):
+                lists[cluster] = np.concatenate([lists[cluster], new_rows[assignments == cluster]])
+        self._swap(base, centroids, lists)
+        logger.info(f"Added {len(new_rows)} vectors to IVF index")
+
+    def search(self, query_embedding, top_k: int = 5, similarity_threshold: float = 0.0, nprobe: int = None) -> List[Tuple[str, float]]:
+        """Same contract as VectorIndex.search, scanning only the closest `nprobe` lists."""
+        base, centroids, lists, n_assigned = self._state()
+        if not n_assigned or top_k <= 0:
+            return []
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        nprobe = min(nprobe or self.nprobe, len(lists))
+        probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([lists[cluster] for cluster in probe])
+        if not len(rows):
+            return []
+        return base.search_rows(query, rows, top_k, similarity_threshold)
+
+    def save(self, path: str):
+        base, centroids, lists, n_assigned = self._state()
+        assignments = np.empty(n_assigned, dtype=np.int32)
+        for cluster, rows in enumerate(lists):
+            assignments[rows] = cluster
+        with open(path, "wb") as f:
+            np.savez(f, centroids=centroids, assignments=assignments, ids=np.array(base.ids[:n_assigned]))
+        logger.info(f"Saved IVF index to {path}")
+
+    @classmethod
+    def load(cls, path: str, base: VectorIndex, nprobe: int = 8) -> "IVFIndex":
+        """Load centroids and list assignments saved for `base`; new base rows are assigned on load."""
+        with np.load(path) as data:
+            centroids, assignments, ids = data["centroids"], data["assignments"], data["ids"]
+        if list(ids) != base.ids[:len(ids)]:
+            raise ValueError(f"IVF index at {path} does not match the embedding store")
+        index = cls(base, n_lists=len(centroids), nprobe=nprobe)
+        index._swap(base, centroids.astype(np.float32), _inverted_lists(assignments, len(centroids)))
+        index.rebase(base)
+        logger.info(f"Loaded IVF index with {index.n_lists} lists from {path}")
+        return index
+
+
+def recall_report(base: VectorIndex, ivf: IVFIndex, queries: Iterable, top_k: int = 5, nprobes: Iterable[int] = (1, 2, 4, 8, 16, 32)) -> List[dict]:
+    """Recall@k and mean per-query latency of the IVF index against exact search."""
+    queries = list(queries)
+    started = time.perf_counter()
+    exact = [{ticket_id for ticket_id, _ in base.search(query, top_k)} for query in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / max(1, len(queries))
+    report = []
+    for nprobe in nprobes:
+        if nprobe > ivf.n_lists:
+            break
+        started = time.perf_counter()
+        approx = [{ticket_id for ticket_id, _ in ivf.search(query, top_k, nprobe=nprobe)} for query in queries]
+        ann_ms = (time.perf_counter() - started) * 1000 / max(1, len(queries))
+        hits = sum(len(a & e) for a, e in zip(approx, exact))
+        total = sum(len(e) for e in exact)
+        report.append({
+            "nprobe": nprobe,
+            "recall": hits / total if total else 1.0,
+            "exact_ms": exact_ms,
+            "ann_ms": ann_ms
+        })
+    return report
+
+
+if __name__ == "__main__":
+    from embedding_store import EmbeddingStore
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build an IVF index over the embedding store and report recall vs latency.")
+    parser.add_argument("--vectors", default="ticket_embeddings.npy")
+    parser.add_argument("--metadata", default="ticket_embeddings.meta.json")
+    parser.add_argument("--lists", type=int, default=0, help="number of inverted lists (default sqrt(N))")
+    parser.add_argument("--queries", type=int, default=200, help="number of perturbed stored vectors used as queries")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--save", default="", help="write the built index to this path")
+    args = parser.parse_args()
+
+    _, ids, vectors = EmbeddingStore(args.vectors, args.metadata).load()
+    base = VectorIndex(ids, vectors, normalized=True)
+    ivf = IVFIndex(base, n_lists=args.lists)
+    ivf.build()
+    if args.save:
+        ivf.save(args.save)
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(base), min(args.queries, len(base)), replace=False)
+    queries = np.asarray(base.vectors[rows]) + rng.normal(0, 0.02, (len(rows), base.dim)).astype(np.float32)
+    print(f"{'nprobe':>6} {'recall@' + str(args.top_k):>10} {'exact ms':>10} {'ivf ms':>10}")
+    for row in recall_report(base, ivf, queries, top_k=args.top_k):
+        print(f"{row['nprobe']:>6} {row['recall']:>10.3f} {row['exact_ms']:>10.3f} {row['ann_ms']:>10.3f}")
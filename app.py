@@ -1,9 +1,10 @@
 import tracemalloc
 tracemalloc.start()
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
-from pymongo import MongoClient
+from flask import Flask, request, jsonify, render_template_string, redirect, url_for, Response, stream_with_context
 from chatbot import TicketingChatbot
+import metrics
 import uuid
+import json
 import logging
 
 # Set up logging
@@ -12,12 +13,6 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# MongoDB setup
-client = MongoClient("localhost", 27017)
-db = client["Ticketing_Platform"]
-customers_collection = db["Customers"]
-tickets_collection = db["tickets"]
-
 # Initialize chatbot
 try:
     chatbot = TicketingChatbot()
@@ -1259,20 +1254,53 @@ HTML_TEMPLATE = """
                     chatMessages.scrollTop = chatMessages.scrollHeight;
                     
                     try {
-                        const response = await fetch(`/chat?username={{ username }}`, {
+                        const response = await fetch(`/chat/stream?username={{ username }}`, {
                             method: 'POST',
                             headers: { 'Content-Type': 'application/json' },
                             body: JSON.stringify({ message })
                         });
-                        const result = await response.json();
-                        
-                        chatMessages.removeChild(loadingMessage);
-                        const botMessage = document.createElement('div');
-                        botMessage.className = 'chat-message bot-message';
-                        botMessage.innerHTML = `<div class="icon"><i class="fas fa-robot"></i></div><div class="message-content">${result.response}</div>`;
-                        chatMessages.appendChild(botMessage);
+                        if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+
+                        let botContent = null;
+                        let text = '';
+                        const render = (html) => {
+                            if (!botContent) {
+                                chatMessages.removeChild(loadingMessage);
+                                const botMessage = document.createElement('div');
+                                botMessage.className = 'chat-message bot-message';
+                                botMessage.innerHTML = `<div class="icon"><i class="fas fa-robot"></i></div><div class="message-content"></div>`;
+                                chatMessages.appendChild(botMessage);
+                                botContent = botMessage.querySelector('.message-content');
+                            }
+                            botContent.innerHTML = html;
+                            chatMessages.scrollTop = chatMessages.scrollHeight;
+                        };
+
+                        // Server-Sent Events: "data: {json}" records separated by blank lines
+                        const reader = response.body.getReader();
+                        const decoder = new TextDecoder();
+                        let buffer = '';
+                        while (true) {
+                            const { value, done } = await reader.read();
+                            if (done) break;
+                            buffer += decoder.decode(value, { stream: true });
+                            const records = buffer.split('\\n\\n');
+                            buffer = records.pop();
+                            for (const record of records) {
+                                const data = record.split('\\n').filter(line => line.startsWith('data: ')).map(line => line.slice(6)).join('\\n');
+                                if (!data) continue;
+                                const event = JSON.parse(data);
+                                if (event.type === 'chunk') {
+                                    text += event.text;
+                                    render(text);
+                                } else if (event.type === 'done') {
+                                    render(event.response);
+                                }
+                            }
+                        }
+                        if (!botContent) throw new Error('Empty response');
                     } catch (error) {
-                        chatMessages.removeChild(loadingMessage);
+                        if (loadingMessage.parentNode) chatMessages.removeChild(loadingMessage);
                         const errorMessage = document.createElement('div');
                         errorMessage.className = 'chat-message bot-message';
                         errorMessage.innerHTML = `<div class="icon"><i class="fas fa-exclamation-triangle"></i></div><div class="message-content">An error occurred. Please try again.</div>`;
@@ -1296,7 +1324,7 @@ HTML_TEMPLATE = """
 @app.route('/')
 def index():
     username = request.args.get('username')
-    if username and customers_collection.find_one({"username": username}):
+    if username and chatbot.find_customer(username):
         logger.info(f"User {username} accessed chat interface")
         return render_template_string(HTML_TEMPLATE, username=username)
     logger.info("No username provided, showing login page")
@@ -1311,13 +1339,13 @@ def login():
             logger.warning("Login attempted with empty username")
             return jsonify({"success": False, "message": "Username is required"})
         username = username.strip()
-        user = customers_collection.find_one({"username": username})
+        user = chatbot.find_customer(username)
         if user:
             logger.info(f"User {username} logged in successfully")
             return jsonify({"success": True, "username": username, "message": f"Welcome back, {username}!"})
         new_username = f"user_{uuid.uuid4().hex[:8]}"
         customer_id = f"CUST{str(uuid.uuid4())[:6]}"
-        customers_collection.insert_one({
+        chatbot.customers_collection.insert_one({
             "username": new_username,
             "customer_id": customer_id,
             "name": username,
@@ -1352,6 +1380,39 @@ def chat():
         logger.error(f"Error processing chat message: {e}")
         return jsonify({"response": "An error occurred. Please try again."})
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    data = request.get_json(silent=True) or {}
+    message = (data.get('message') or '').strip()
+    username = request.args.get('username', 'unknown')
+
+    def sse(payload):
+        return f"data: {json.dumps(payload)}\n\n"
+
+    def events():
+        if not message:
+            logger.warning(f"Empty message from user {username}")
+            yield sse({"type": "chunk", "text": "Please enter a message"})
+            yield sse({"type": "done", "response": "Please enter a message"})
+            return
+        logger.info(f"Streaming response for {username}: {message}")
+        for event in chatbot.handle_message_stream(username, message):
+            if event.kind == "chunk":
+                yield sse({"type": "chunk", "text": event.data})
+            else:
+                logger.info(f"Streamed response to {username}: {event.data}")
+                yield sse({"type": "done", "response": event.data})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     logger.info("Starting Flask application")
     app.run(debug=True)
\ No newline at end of file
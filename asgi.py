@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, chatbot
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Pages, login and anything else not handled natively below keep running on Flask
+wsgi_app = WsgiToAsgi(flask_app)
+
+
+async def read_json(receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+        return data if isinstance(data, dict) else {}
+    except ValueError:
+        return {}
+
+
+def request_username(scope) -> str:
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("username", ["unknown"])[0]
+
+
+async def send_json(send, payload: dict, status: int = 200):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def chat(scope, receive, send):
+    try:
+        data = await read_json(receive)
+        message = (data.get("message") or "").strip()
+        username = request_username(scope)
+        if not message:
+            logger.warning(f"Empty message from user {username}")
+            await send_json(send, {"response": "Please enter a message"})
+            return
+        logger.info(f"Processing message from {username}: {message}")
+        response = await chatbot.ahandle_message(username, message)
+        logger.info(f"Response to {username}: {response}")
+        await send_json(send, {"response": response})
+    except Exception as e:
+        logger.error(f"Error processing chat message: {e}")
+        await send_json(send, {"response": "An error occurred. Please try again."})
+
+
+async def chat_stream(scope, receive, send):
+    data = await read_json(receive)
+    message = (data.get("message") or "").strip()
+    username = request_username(scope)
+
+    async def sse(payload):
+        await send({"type": "http.response.body", "body": f"data: {json.dumps(payload)}\n\n".encode(), "more_body": True})
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]
+    })
+    if not message:
+        logger.warning(f"Empty message from user {username}")
+        await sse({"type": "chunk", "text": "Please enter a message"})
+        await sse({"type": "done", "response": "Please enter a message"})
+    else:
+        logger.info(f"Streaming response for {username}: {message}")
+        async for event in chatbot.ahandle_message_stream(username, message):
+            if event.kind == "chunk":
+                await sse({"type": "chunk", "text": event.data})
+            else:
+                logger.info(f"Streamed response to {username}: {event.data}")
+                await sse({"type": "done", "response": event.data})
+    await send({"type": "http.response.body", "body": b""})
+
+
+ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/chat/stream"): chat_stream
+}
+
+
+async def application(scope, receive, send):
+    """ASGI entry point: chat requests run on the event loop, everything else is delegated to Flask."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # Write queued chat history before the process goes away
+                await asyncio.to_thread(chatbot.history.writer.close)
+                await chatbot.mongo.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    handler = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if handler is None:
+        await wsgi_app(scope, receive, send)
+        return
+    await handler(scope, receive, send)
@@ -0,0 +1,335 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Dict, Iterator, List, Union
+
+import numpy as np
+
+from metrics import LLM_CALLS, LLM_EMBEDDED_TEXTS, LLM_ERRORS, LLM_PROMPT_TOKENS, LLM_RESPONSE_TOKENS, LLM_SECONDS
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHAT_MODEL = "gemini-2.5-flash-lite-preview-06-17"
+DEFAULT_EMBEDDING_MODEL = "models/embedding-001"
+# Output dimension of known embedding models, used to reject an embedding store built with another one
+EMBEDDING_DIMS = {"models/embedding-001": 768, "models/text-embedding-004": 768}
+
+
+class LLMBackend:
+    """Text generation and embedding calls used by the chatbot and RAG system.
+
+    `embed` accepts one text (returning one vector) or a list of texts
+    (returning a list of vectors), like `genai.embed_content`. The async and
+    streaming methods default to the blocking ones so a backend only has to
+    implement `generate` and `embed`.
+    """
+
+    name = ""
+    model_name = ""
+    embedding_model = ""
+    # 0 when the backend does not know its embedding dimension
+    embedding_dim = 0
+
+    def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        yield self.generate(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        yield await self.agenerate(prompt)
+
+    def embed(self, content: Union[str, List[str]], task_type: str = "retrieval_document"):
+        raise NotImplementedError
+
+    async def aembed(self, content: Union[str, List[str]], task_type: str = "retrieval_document"):
+        return await asyncio.to_thread(self.embed, content, task_type)
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name: str = DEFAULT_CHAT_MODEL, embedding_model: str = DEFAULT_EMBEDDING_MODEL, api_key: str = None):
+        import google.generativeai as genai
+
+        self.genai = genai
+        genai.configure(api_key=api_key if api_key is not None else os.getenv("GEMINI_API_KEY", ""))
+        self.model = genai.GenerativeModel(model_name)
+        self.model_name = model_name
+        self.embedding_model = embedding_model
+        self.embedding_dim = EMBEDDING_DIMS.get(embedding_model, 0)
+
+    def generate(self, prompt: str) -> str:
+        response = self.model.generate_content(prompt)
+        return response.text if hasattr(response, "text") else str(response)
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True):
+            text = getattr(chunk, "text", "")
+            if text:
+                yield text
+
+    async def agenerate(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text if hasattr(response, "text") else str(response)
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        async for chunk in await self.model.generate_content_async(prompt, stream=True):
+            text = getattr(chunk, "text", "")
+            if text:
+                yield text
+
+    def embed(self, content, task_type: str = "retrieval_document"):
+        return self.genai.embed_content(model=self.embedding_model, content=content, task_type=task_type)["embedding"]
+
+    async def aembed(self, content, task_type: str = "retrieval_document"):
+        result = await self.genai.embed_content_async(model=self.embedding_model, content=content, task_type=task_type)
+        return result["embedding"]
+
+
+FAKE_INTENT_RULES = [
+    ("chat_history", ("past chat", "chat history", "past conversation", "previous")),
+    ("list_devices", ("device", "machines", "list my")),
+    ("identity", ("my name", "who are you", "why you are", "llm")),
+    ("greeting", ("hi", "hii", "hello", "hey", "bye", "thanks", "thank you")),
+    ("selection", ("select", "yes that", "that one")),
+    ("unknown", ("cow", "car", "gift", "baby", "weather"))
+]
+
+FAKE_REPLY = (
+    "<ol><li>Restart the laptop and check for updates.</li><li>Update the device drivers.</li>"
+    "<li>Run the built-in hardware diagnostics.</li></ol>Start with the simple steps and work down the list."
+)
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic offline backend for benchmarks and local runs without a Gemini key.
+
+    Replies come from `responses` (first prompt substring that matches, checked
+    in order) and otherwise from built-in rules: intent-classification and
+    keyword-extraction prompts get plausible answers, everything else a canned
+    troubleshooting list. Embeddings are hashed bag-of-words vectors, so texts
+    sharing words are similar. Each call sleeps `latency` (or `embed_latency`)
+    seconds, scaled by up to +/-`jitter` using a hash of its input so runs repeat.
+    """
+
+    name = "fake"
+    model_name = "fake-chat"
+    embedding_model = "fake-embedding"
+
+    def __init__(self, latency: float = 0.0, embed_latency: float = 0.0, jitter: float = 0.0,
+                 responses: Dict[str, str] = None, dim: int = 768):
+        self.latency = latency
+        self.embed_latency = embed_latency
+        self.jitter = jitter
+        self.responses = dict(responses or {})
+        self.dim = dim
+        self.embedding_dim = dim
+        self.calls = {"generate": 0, "embed": 0}
+        self._lock = threading.Lock()
+
+    def _delay(self, base: float, key: str) -> float:
+        if base <= 0:
+            return 0.0
+        fraction = int.from_bytes(hashlib.sha256(key.encode()).digest()[:4], "big") / 0xFFFFFFFF
+        return base * (1 + self.jitter * (2 * fraction - 1))
+
+    def _count(self, kind: str, n: int = 1):
+        with self._lock:
+            self.calls[kind] += n
+
+    def respond(self, prompt: str) -> str:
+        for pattern, response in self.responses.items():
+            if pattern in prompt:
+                return response
+        if "Classify the intent" in prompt:
+            message = re.search(r"Given the user message: '(.*?)'\n", prompt, re.DOTALL)
+            text = message.group(1).lower() if message else ""
+            words = set(re.findall(r"[a-z]+", text))
+            for intent, markers in FAKE_INTENT_RULES:
+                if any((marker in words) if " " not in marker else (marker in text) for marker in markers):
+                    return intent
+            return "query"
+        if "Extract key technical terms" in prompt:
+            query = re.search(r"Given the query: '(.*?)'\n", prompt, re.DOTALL)
+            text = query.group(1).lower() if query else ""
+            return json.dumps({"processed_query": text, "brand": "Unknown", "keywords": re.findall(r"[a-z0-9]+", text)[:8]})
+        return FAKE_REPLY
+
+    def generate(self, prompt: str) -> str:
+        self._count("generate")
+        time.sleep(self._delay(self.latency, prompt))
+        return self.respond(prompt)
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        self._count("generate")
+        words = self.respond(prompt).split(" ")
+        delay = self._delay(self.latency, prompt) / len(words)
+        for i, word in enumerate(words):
+            time.sleep(delay)
+            yield word if i == len(words) - 1 else word + " "
+
+    async def agenerate(self, prompt: str) -> str:
+        self._count("generate")
+        await asyncio.sleep(self._delay(self.latency, prompt))
+        return self.respond(prompt)
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        self._count("generate")
+        words = self.respond(prompt).split(" ")
+        delay = self._delay(self.latency, prompt) / len(words)
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay)
+            yield word if i == len(words) - 1 else word + " "
+
+    def _vector(self, text: str) -> list:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"[a-z0-9]+", text.lower()):
+            digest = hashlib.md5(token.encode()).digest()
+            vector[int.from_bytes(digest[:4], "big") % self.dim] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if not norm:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed(self, content, task_type: str = "retrieval_document"):
+        texts = content if isinstance(content, list) else [content]
+        self._count("embed", len(texts))
+        time.sleep(self._delay(self.embed_latency, texts[0] if texts else ""))
+        vectors = [self._vector(text) for text in texts]
+        return vectors if isinstance(content, list) else vectors[0]
+
+    async def aembed(self, content, task_type: str = "retrieval_document"):
+        texts = content if isinstance(content, list) else [content]
+        self._count("embed", len(texts))
+        await asyncio.sleep(self._delay(self.embed_latency, texts[0] if texts else ""))
+        vectors = [self._vector(text) for text in texts]
+        return vectors if isinstance(content, list) else vectors[0]
+
+
+class InstrumentedBackend(LLMBackend):
+    """Wraps a backend to record llm_* request counts, errors, latency and prompt/response sizes."""
+
+    def __init__(self, backend: LLMBackend):
+        self.backend = backend
+        self.name = backend.name or type(backend).__name__
+        self.model_name = backend.model_name
+        self.embedding_model = backend.embedding_model
+        self.embedding_dim = backend.embedding_dim
+
+    def _record(self, operation: str, started: float, error: bool = False):
+        LLM_CALLS.inc(backend=self.name, operation=operation)
+        LLM_SECONDS.observe(time.perf_counter() - started, backend=self.name, operation=operation)
+        if error:
+            LLM_ERRORS.inc(backend=self.name, operation=operation)
+
+    def _sizes(self, prompt: str, response: str):
+        LLM_PROMPT_TOKENS.observe(estimate_tokens(prompt), backend=self.name)
+        LLM_RESPONSE_TOKENS.observe(estimate_tokens(response), backend=self.name)
+
+    def generate(self, prompt: str) -> str:
+        started = time.perf_counter()
+        try:
+            text = self.backend.generate(prompt)
+        except Exception:
+            self._record("generate", started, error=True)
+            raise
+        self._record("generate", started)
+        self._sizes(prompt, text)
+        return text
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        started, parts = time.perf_counter(), []
+        try:
+            for text in self.backend.generate_stream(prompt):
+                parts.append(text)
+                yield text
+        except Exception:
+            self._record("generate_stream", started, error=True)
+            raise
+        self._record("generate_stream", started)
+        self._sizes(prompt, "".join(parts))
+
+    async def agenerate(self, prompt: str) -> str:
+        started = time.perf_counter()
+        try:
+            text = await self.backend.agenerate(prompt)
+        except Exception:
+            self._record("generate", started, error=True)
+            raise
+        self._record("generate", started)
+        self._sizes(prompt, text)
+        return text
+
+    async def agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        started, parts = time.perf_counter(), []
+        try:
+            async for text in self.backend.agenerate_stream(prompt):
+                parts.append(text)
+                yield text
+        except Exception:
+            self._record("generate_stream", started, error=True)
+            raise
+        self._record("generate_stream", started)
+        self._sizes(prompt, "".join(parts))
+
+    def embed(self, content, task_type: str = "retrieval_document"):
+        started = time.perf_counter()
+        LLM_EMBEDDED_TEXTS.inc(len(content) if isinstance(content, list) else 1, backend=self.name)
+        try:
+            vectors = self.backend.embed(content, task_type)
+        except Exception:
+            self._record("embed", started, error=True)
+            raise
+        self._record("embed", started)
+        return vectors
+
+    async def aembed(self, content, task_type: str = "retrieval_document"):
+        started = time.perf_counter()
+        LLM_EMBEDDED_TEXTS.inc(len(content) if isinstance(content, list) else 1, backend=self.name)
+        try:
+            vectors = await self.backend.aembed(content, task_type)
+        except Exception:
+            self._record("embed", started, error=True)
+            raise
+        self._record("embed", started)
+        return vectors
+
+
+def instrumented(backend: LLMBackend) -> LLMBackend:
+    return backend if isinstance(backend, InstrumentedBackend) else InstrumentedBackend(backend)
+
+
+_default_backend = None
+_default_lock = threading.Lock()
+
+
+def get_backend() -> LLMBackend:
+    """Process-wide backend selected by LLM_BACKEND (`gemini`, the default, or `fake`)."""
+    global _default_backend
+    with _default_lock:
+        if _default_backend is None:
+            name = os.getenv("LLM_BACKEND", "gemini").lower()
+            if name == "fake":
+                _default_backend = FakeBackend(
+                    latency=float(os.getenv("FAKE_LLM_LATENCY", "0")),
+                    embed_latency=float(os.getenv("FAKE_EMBED_LATENCY", "0")),
+                    jitter=float(os.getenv("FAKE_LLM_JITTER", "0"))
+                )
+            else:
+                if name != "gemini":
+                    logger.warning(f"Unknown LLM backend '{name}', using gemini")
+                _default_backend = GeminiBackend()
+            _default_backend = instrumented(_default_backend)
+            logger.info(f"Using {_default_backend.name} LLM backend ({_default_backend.model_name})")
+        return _default_backend
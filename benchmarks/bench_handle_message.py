@@ -0,0 +1,112 @@
+"""End-to-end latency benchmark for TicketingChatbot.handle_message.
+
+Replays the user messages from database_json_file/Ticketing_Platform.chat_history.json
+against an in-memory MongoDB (mongomock) loaded with the demo database and the
+deterministic FakeBackend, then reports p50/p95/p99 per graph node and overall.
+
+    python benchmarks/bench_handle_message.py --latency 0.3 --embed-latency 0.05 --jitter 0.5
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "database_json_file")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("EMBEDDING_SYNC_INTERVAL", "0")
+
+import mongomock
+from bson import json_util
+
+from backends import FakeBackend
+from chatbot import TicketingChatbot
+
+
+def load_database(client):
+    db = client["Ticketing_Platform"]
+    for collection in ("Customers", "tickets", "chat_history"):
+        with open(os.path.join(DATA_DIR, f"Ticketing_Platform.{collection}.json")) as f:
+            documents = json_util.loads(f.read())
+        if documents:
+            db[collection].insert_many(documents)
+
+
+def load_messages():
+    """(username, message) pairs for every user turn in the demo chat history, in order."""
+    with open(os.path.join(DATA_DIR, "Ticketing_Platform.chat_history.json")) as f:
+        documents = json.load(f)
+    messages = []
+    for document in documents:
+        entry = json.loads(document["History"])
+        if entry["type"] == "human" and entry["data"]["content"].strip():
+            messages.append((document["SessionId"], entry["data"]["content"].strip()))
+    return messages
+
+
+def report(timings: dict):
+    print(f"{'stage':<26}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in sorted(timings, key=lambda name: (name == "overall", name)):
+        values = np.array(timings[name]) * 1000
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        print(f"{name:<26}{len(values):>7}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{values.max():>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TicketingChatbot.handle_message offline.")
+    parser.add_argument("--limit", type=int, default=0, help="number of messages to replay (default all)")
+    parser.add_argument("--warmup", type=int, default=10, help="messages replayed before timing starts")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake LLM latency per call, seconds")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="fake embedding latency per call, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="relative latency spread, e.g. 0.5 for +/-50%%")
+    parser.add_argument("--verbose", action="store_true", help="keep the application's INFO logging")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    # RAGSystem writes its embedding store to the working directory
+    workdir = tempfile.mkdtemp(prefix="bench-handle-message-")
+    os.chdir(workdir)
+
+    client = mongomock.MongoClient()
+    load_database(client)
+    backend = FakeBackend(latency=args.latency, embed_latency=args.embed_latency, jitter=args.jitter)
+    started = time.perf_counter()
+    chatbot = TicketingChatbot(client=client, backend=backend)
+    chatbot.response_pool.ready.wait()
+    print(f"Chatbot ready in {time.perf_counter() - started:.1f}s (working directory {workdir})")
+
+    timings = defaultdict(list)
+    chatbot.node_observers.append(lambda name, seconds: timings[name].append(seconds))
+
+    messages = load_messages()
+    warmup, messages = messages[:args.warmup], messages[args.warmup:]
+    if args.limit:
+        messages = messages[:args.limit]
+    for username, message in warmup:
+        chatbot.handle_message(username, message)
+    timings.clear()
+    calls_before = dict(backend.calls)
+
+    started = time.perf_counter()
+    for username, message in messages:
+        request_started = time.perf_counter()
+        chatbot.handle_message(username, message)
+        timings["overall"].append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+
+    calls = {kind: count - calls_before.get(kind, 0) for kind, count in backend.calls.items()}
+    print(f"Replayed {len(messages)} messages in {elapsed:.1f}s; backend calls: {calls}")
+    report(timings)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import logging
+import math
+import threading
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from keyword_extractor import content_terms
+
+logger = logging.getLogger(__name__)
+
+
+class BM25Index:
+    """Okapi BM25 index over ticket text (query and answers).
+
+    Tokens keep model strings such as "14-dw1036tu" or "m2" intact, which dense
+    embeddings tend to blur. Besides the BM25 score, `search` reports the share of
+    the query's IDF weight a ticket matches, which callers use as a relevance bar.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def add(self, ticket_id: str, text: str):
+        terms = Counter(content_terms(text))
+        with self._lock:
+            if ticket_id in self._doc_lengths:
+                return
+            for term, count in terms.items():
+                self._postings.setdefault(term, {})[ticket_id] = count
+            length = sum(terms.values())
+            self._doc_lengths[ticket_id] = length
+            self._total_length += length
+
+    def _idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self._doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 5, min_coverage: float = 0.0) -> List[Tuple[str, float, float]]:
+        """Return up to `top_k` (ticket_id, bm25_score, coverage) tuples, best first."""
+        terms = list(dict.fromkeys(content_terms(query)))
+        with self._lock:
+            if not terms or not self._doc_lengths:
+                return []
+            avg_length = self._total_length / len(self._doc_lengths)
+            idf = {term: self._idf(term) for term in terms}
+            total_idf = sum(idf.values()) or 1.0
+            scores: Dict[str, float] = {}
+            matched: Dict[str, float] = {}
+            for term in terms:
+                for ticket_id, tf in self._postings.get(term, {}).items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[ticket_id] / avg_length)
+                    scores[ticket_id] = scores.get(ticket_id, 0.0) + idf[term] * tf * (self.k1 + 1) / (tf + norm)
+                    matched[ticket_id] = matched.get(ticket_id, 0.0) + idf[term]
+        results = [
+            (ticket_id, score, matched[ticket_id] / total_idf)
+            for ticket_id, score in scores.items()
+            if matched[ticket_id] / total_idf >= min_coverage
+        ]
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:top_k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists: score(id) = sum over lists of 1 / (k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, ticket_id in enumerate(ranking, start=1):
+            scores[ticket_id] = scores.get(ticket_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
@@ -0,0 +1,279 @@
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
+
+from metrics import PROFILE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Lower-case, trim punctuation and collapse whitespace so trivial variants share a key."""
+    query = re.sub(r"[^\w\s.+-]", " ", query.lower())
+    return " ".join(query.split()).strip(" .")
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query embeddings keyed on (model, normalized query).
+
+    When `persist_path` is set the cache is loaded from disk on start and written
+    back on `save()` and at interpreter exit, so repeated questions skip the
+    embedding round trip across restarts too.
+    """
+
+    def __init__(self, max_size: int = 10000, persist_path: Optional[str] = None):
+        self.max_size = max_size
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    def get(self, query: str, model: str) -> Optional[list]:
+        key = (model, normalize_query(query))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query: str, model: str, embedding: list):
+        if not embedding:
+            return
+        key = (model, normalize_query(query))
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+    def load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r") as f:
+                entries = json.load(f)
+            with self._lock:
+                for model, query, embedding in entries[-self.max_size:]:
+                    self._entries[(model, query)] = embedding
+            logger.info(f"Loaded {len(self._entries)} cached query embeddings from {self.persist_path}")
+        except Exception as e:
+            logger.warning(f"Failed to load query embedding cache from {self.persist_path}: {e}")
+
+    def save(self):
+        if not self.persist_path:
+            return
+        try:
+            with self._lock:
+                entries = [[model, query, embedding] for (model, query), embedding in self._entries.items()]
+            tmp_path = f"{self.persist_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f, separators=(",", ":"))
+            os.replace(tmp_path, self.persist_path)
+            logger.info(f"Saved {len(entries)} cached query embeddings to {self.persist_path}")
+        except Exception as e:
+            logger.warning(f"Failed to save query embedding cache to {self.persist_path}: {e}")
+
+
+class SemanticResponseCache:
+    """Cache of generated solutions looked up by query meaning rather than exact text.
+
+    Entries are grouped by (brand, matched ticket ids); within a group a cached
+    response is reused when the cosine similarity between the new query embedding
+    and the cached one reaches `similarity_threshold`. Entries expire after `ttl`
+    seconds and the least recently used entry is evicted beyond `max_size`.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, ttl: float = 3600, max_size: int = 1000):
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _group_key(brand: str, ticket_ids) -> tuple:
+        return brand or "Unknown", frozenset(ticket_ids or ())
+
+    @staticmethod
+    def _unit(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        group = self._groups[entry["group"]]
+        group.remove(entry_id)
+        if not group:
+            del self._groups[entry["group"]]
+
+    def lookup(self, query_embedding, brand: str, ticket_ids) -> Optional[str]:
+        group_key = self._group_key(brand, ticket_ids)
+        query = self._unit(query_embedding)
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, self.similarity_threshold
+            for entry_id in list(self._groups.get(group_key, ())):
+                entry = self._entries[entry_id]
+                if now - entry["created"] > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                if entry["embedding"].shape != query.shape:
+                    continue
+                similarity = float(entry["embedding"] @ query)
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            entry = self._entries[best_id]
+            entry["hits"] += 1
+            entry["last_hit"] = now
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return entry["response"]
+
+    def store(self, query: str, query_embedding, brand: str, ticket_ids, response: str):
+        group_key = self._group_key(brand, ticket_ids)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "group": group_key,
+                "query": query,
+                "embedding": self._unit(query_embedding),
+                "response": response,
+                "created": time.time(),
+                "last_hit": None,
+                "hits": 0
+            }
+            self._groups.setdefault(group_key, []).append(entry_id)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": [
+                    {
+                        "query": entry["query"],
+                        "brand": entry["group"][0],
+                        "tickets": len(entry["group"][1]),
+                        "hits": entry["hits"],
+                        "age_seconds": round(now - entry["created"], 1)
+                    }
+                    for entry in self._entries.values()
+                ]
+            }
+
+
+class ProfileCache:
+    """Read-through cache of customer profiles by username.
+
+    `get` returns the cached profile or calls `load(username)` and caches the
+    result; a missing profile (None) is cached for `negative_ttl` seconds so
+    unknown usernames do not reach MongoDB on every request either. Entries
+    expire after `ttl` seconds, the least recently used one is evicted beyond
+    `max_size`, and writers call `invalidate` after changing a profile. Callers
+    get a shallow copy: nested values (e.g. the laptops list) are shared with
+    the cache and must not be modified.
+    """
+
+    def __init__(self, ttl: float = 300, max_size: int = 10000, negative_ttl: float = 30):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, username: str):
+        """(found, profile) for a live entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and now < entry["expires"]:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                PROFILE_CACHE_LOOKUPS.inc(outcome="hit")
+                profile = entry["profile"]
+                return True, dict(profile) if profile is not None else None
+            if entry is not None:
+                del self._entries[username]
+            self.misses += 1
+            PROFILE_CACHE_LOOKUPS.inc(outcome="miss")
+            return False, None
+
+    def _store(self, username: str, profile: Optional[dict]):
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        with self._lock:
+            self._entries[username] = {"profile": dict(profile) if profile is not None else None, "expires": time.time() + ttl}
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, username: str, load: Callable[[str], Optional[dict]]) -> Optional[dict]:
+        found, profile = self._lookup(username)
+        if found:
+            return profile
+        profile = load(username)
+        self._store(username, profile)
+        return profile
+
+    async def aget(self, username: str, load: Callable[[str], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        found, profile = self._lookup(username)
+        if found:
+            return profile
+        profile = await load(username)
+        self._store(username, profile)
+        return profile
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0
+            }
@@ -1,19 +1,183 @@
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, List
+from typing import TypedDict, List, Optional
 from pymongo import MongoClient
 from rag import RAGSystem
-import google.generativeai as genai
-import os
+from prompt_builder import prompt_builder
+from backends import LLMBackend, get_backend, instrumented
+from cache import ProfileCache
+from conversation_state import ConversationStateStore
+from history_store import ChatHistoryStore
+from indexes import check_query_plans, ensure_indexes
+from intent_classifier import INTENTS, IntentClassifier
+from keyword_extractor import tokenize
+from metrics import (CHAT_MESSAGES, CHAT_MESSAGE_ERRORS, CHAT_MESSAGE_SECONDS, INTENT_DECISIONS, NODE_CALLS, NODE_ERRORS,
+                     NODE_SECONDS)
+from mongo import MongoConnections, connections
+from response_pool import ResponsePool
+from streaming import emit, generate_text, agenerate_text, complete_text, acomplete_text, stream_call, astream_call
+import asyncio
 import logging
-from langchain_mongodb import MongoDBChatMessageHistory
+import os
+import re
+import time
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY", ""))
-chat_model = genai.GenerativeModel('gemini-2.5-flash-lite-preview-06-17')
+AVAILABLE_BRANDS = ["Apple", "HP", "Dell", "Lenovo", "Asus", "Acer", "Microsoft", "Samsung", "MSI"]
+IRRELEVANT_KEYWORDS = ["cow", "car", "weather", "milk", "animal", "vehicle", "gift", "baby", "child"]
+
+# Query routing outcome -> (awaiting_laptop_selection, keep message as last_query)
+QUERY_ACTIONS = {
+    "irrelevant": (False, False),
+    "retrieve": (False, True),
+    "devices": (True, True),
+    "no_devices": (True, False),
+    "details": (False, False)
+}
+
+
+def classify_intent_prompt(message: str) -> str:
+    return (
+        f"""You are an AI assistant for a laptop support platform.
+        Given the user message: '{message}'
+        Classify the intent into one of:
+        - greeting: greetings like "hi", "hello", "hii", "bye", or asking about capabilities
+        - query: questions about laptop issues or troubleshooting
+        - list_devices: requests to list or show registered devices (e.g., "list my devices", "how many machines", "my device list is")
+        - selection: selecting a device from a list (e.g., "HP Pavilion", "yes that")
+        - chat_history: requests to see past conversation (e.g., "past conversation", "chat history", "past chat")
+        - identity: questions about the chatbot's or user's identity (e.g., "my name is", "you are llm model of", "why you are")
+        - unknown: anything unrelated to laptops (e.g., "cow", "car", "gift for my baby boy")
+        Return only the intent name.
+        Examples:
+        - "hi" -> greeting
+        - "hii" -> greeting
+        - "bye" -> greeting
+        - "my dell laptop screen is flickering" -> query
+        - "list my devices" -> list_devices
+        - "can you know how many machines was there" -> list_devices
+        - "my device list is" -> list_devices
+        - "select HP Pavilion" -> selection
+        - "can you send the past chat" -> chat_history
+        - "in previous we talk about which laptop" -> chat_history
+        - "my cow was not working" -> unknown
+        - "suggest a gift for my baby boy" -> unknown
+        - "my car was not working" -> unknown
+        - "my name is" -> identity
+        - "why you are" -> identity
+        - "you are llm model of" -> identity
+        """
+    )
+
+
+def greeting_prompt(message: str) -> str:
+    return (
+        f"""You are a friendly AI assistant here to support users with laptop-related issues on an AI ticketing platform.
+        ---
+        User input: '{message}'
+        ---
+        Your task is to respond appropriately to the user's message.
+        If the user sends a greeting like "hi", "hello", "hii", etc.:
+        - Greet them in a natural, friendly way.
+        - Ask how you can assist them today.
+        If the input is a farewell like "bye":
+        - Respond with a polite farewell and encourage returning for help.
+        If the input asks about capabilities or features:
+        - Briefly mention that you can help with laptop issues, device listing, or troubleshooting.
+        - Encourage the user to describe their issue or list devices.
+        ---
+        Guidelines:
+        - Keep the tone conversational, friendly, and concise (1–2 lines, max 20 words per line).
+        - Vary phrasing to avoid repetition across responses.
+        - Use clear, casual language that invites engagement.
+        """
+    )
+
+
+# Greetings answered from the response pool: kind -> (whole-message pattern, message the pool prompt is built from)
+GREETING_KINDS = {
+    "hello": (re.compile(r"^(h+i+|h+e+l+o+|hey+|hola|gm|good (morning|afternoon|evening))( there| bot)?[ .!,]*$"), "hi"),
+    "farewell": (re.compile(r"^(bye( bye)?|goodbye|see you|good night)[ .!,]*$"), "bye"),
+    "thanks": (re.compile(r"^(thanks?( you)?|thankyou|thx)( (so much|for (the|your) help|for helping me))?[ .!,]*$"), "thank you"),
+    "capabilities": (re.compile(r"^(what can you do|what is your task|how can you help( me)?|what can you help me with)[ ?.!]*$"),
+                     "what can you do")
+}
+
+
+def greeting_kind(message: str) -> Optional[str]:
+    message = " ".join(message.lower().split())
+    return next((kind for kind, (pattern, _) in GREETING_KINDS.items() if pattern.match(message)), None)
+
+
+NO_DEVICES_PROMPT = (
+    """You are a friendly AI assistant on an AI ticketing platform that supports users with laptop-related issues.
+    ---
+    Your task is to inform users that no devices are registered and suggest visiting the registration page.
+    Respond warmly in 1–2 lines, each under 20 words.
+    ---
+    Use simple, clear language without jargon.
+    Vary phrasing for a fresh, engaging response.
+    """
+)
+
+NO_DEVICES_QUERY_PROMPT = (
+    """You are a friendly AI assistant for an AI ticketing platform focused on supporting laptop-related issues.
+    ---
+    Your task is to let users know that no devices are registered and suggest visiting the registration page.
+    Respond in a warm, natural tone using 1–2 lines, each under 20 words.
+    ---
+    Vary phrasing to keep responses fresh and engaging.
+    Use simple, clear language without jargon.
+    """
+)
+
+MORE_DETAILS_PROMPT = (
+    """You are a friendly AI assistant for an AI ticketing platform that supports users with laptop-related issues.
+    ---
+    Your task is to ask users for more details about their request, encouraging them to specify the device or issue.
+    Respond in a warm, natural tone using 1–2 lines, each under 20 words.
+    ---
+    Vary phrasing to keep responses conversational and engaging.
+    Avoid jargon and ensure clarity.
+    """
+)
+
+IDENTITY_PROMPT = (
+    """You are a friendly AI assistant for an AI ticketing platform focused on laptop support.
+    ---
+    Your task is to respond to queries about the chatbot's or user's identity.
+    Explain you are an AI for laptop support and redirect to a laptop-related task.
+    Respond in 1–2 lines, each under 20 words.
+    ---
+    Vary phrasing to keep responses fresh and conversational.
+    Use simple, clear language without jargon.
+    """
+)
+
+# Fixed-purpose prompts whose replies are pre-generated into the response pool
+POOLED_PROMPTS = {
+    **{f"greeting:{kind}": greeting_prompt(message) for kind, (_, message) in GREETING_KINDS.items()},
+    "no_devices": NO_DEVICES_PROMPT,
+    "no_devices_query": NO_DEVICES_QUERY_PROMPT,
+    "more_details": MORE_DETAILS_PROMPT,
+    "identity": IDENTITY_PROMPT
+}
+
+
+def valid_laptops(laptops: List[dict]) -> List[dict]:
+    return [
+        laptop for laptop in laptops
+        if isinstance(laptop, dict) and "name" in laptop and "model" in laptop
+        and isinstance(laptop.get("name"), str) and isinstance(laptop.get("model"), str)
+    ]
+
+
+def device_list_html(laptops: List[dict], header: str, footer: str) -> str:
+    laptop_list = sorted(set(f"{laptop['name']} ({laptop['model']})" for laptop in laptops))
+    return header + "<ul>" + "".join(f"<li>{laptop}</li>" for laptop in laptop_list) + "</ul>" + footer
+
 
 class State(TypedDict):
     username: str
@@ -27,29 +191,126 @@ class State(TypedDict):
     intent: str
 
 class TicketingChatbot:
-    def __init__(self):
+    def __init__(self, client: MongoClient = None, backend: LLMBackend = None, async_client=None):
         try:
-            self.client = MongoClient("localhost", 27017)
-            self.db = self.client["Ticketing_Platform"]
-            self.customers_collection = self.db["Customers"]
-            self.tickets_collection = self.db["tickets"]
-            self.rag = RAGSystem()
+            self.backend = instrumented(backend or get_backend())
+            self.mongo = MongoConnections.wrap(client, async_client) if client is not None else connections
+            self.profiles = ProfileCache(
+                ttl=float(os.getenv("PROFILE_CACHE_TTL", "300")),
+                max_size=int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+            )
+            mongo_state = os.getenv("CONVERSATION_STATE_STORE", "memory") == "mongo"
+            self.conversations = ConversationStateStore(
+                collection=(lambda: self.db["conversation_state"]) if mongo_state else None,
+                async_collection=(lambda: self._async_db()["conversation_state"]) if mongo_state else None,
+                max_size=int(os.getenv("CONVERSATION_STATE_SIZE", "10000")),
+                ttl=float(os.getenv("CONVERSATION_STATE_TTL", "1800"))
+            )
+            self.history = ChatHistoryStore(lambda: self.db["chat_history"], lambda: self._async_db()["chat_history"])
+            try:
+                ensure_indexes(self.db)
+            except Exception as e:
+                logger.warning(f"Could not create indexes: {e}")
+            if os.getenv("INDEX_SELF_CHECK", "0") == "1":
+                # Fails startup if a hot query would scan a whole collection
+                check_query_plans(self.db)
+            # Callables invoked as observer(node_name, seconds) after every graph node
+            self.node_observers = []
+            self.rag = RAGSystem(backend=self.backend, mongo=self.mongo)
+            # Past ticket queries double as labelled examples for the local intent classifier
+            self.intent_classifier = IntentClassifier()
+            self.intent_classifier.add_examples("query", (ticket["query"] for ticket in self.rag.embeddings["by_id"].values()))
+            self.intent_threshold = float(os.getenv("INTENT_CONFIDENCE_THRESHOLD", "0.9"))
+            self.response_pool = ResponsePool(self.backend)
+            for key, prompt in POOLED_PROMPTS.items():
+                self.response_pool.register(key, prompt)
+            self.response_pool.start()
             self.graph = self._build_graph()
+            self.async_graph = self._build_graph(asynchronous=True)
             logger.info("TicketingChatbot initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize TicketingChatbot: {e}")
             raise
 
-    def _build_graph(self):
+    @property
+    def client(self) -> MongoClient:
+        return self.mongo.client()
+
+    @property
+    def db(self):
+        return self.mongo.database()
+
+    @property
+    def customers_collection(self):
+        return self.db["Customers"]
+
+    @property
+    def tickets_collection(self):
+        return self.db["tickets"]
+
+    def _async_db(self):
+        return self.mongo.async_database()
+
+    def find_customer(self, username: str) -> Optional[dict]:
+        """The customer profile for `username`, through the profile cache."""
+        return self.profiles.get(username, lambda name: self.customers_collection.find_one({"username": name}))
+
+    async def afind_customer(self, username: str) -> Optional[dict]:
+        return await self.profiles.aget(username, lambda name: self._async_db()["Customers"].find_one({"username": name}))
+
+    def _pooled_text(self, key: str, prompt: str) -> str:
+        """A pre-generated reply for `key`, or a live generation from `prompt` while its pool is empty."""
+        text = self.response_pool.get(key)
+        if text is None:
+            return generate_text(self.backend, prompt)
+        emit(text)
+        return text
+
+    async def _apooled_text(self, key: str, prompt: str) -> str:
+        text = self.response_pool.get(key)
+        if text is None:
+            return await agenerate_text(self.backend, prompt)
+        emit(text)
+        return text
+
+    def _greeting_text(self, message: str) -> str:
+        kind = greeting_kind(message)
+        if kind:
+            return self._pooled_text(f"greeting:{kind}", POOLED_PROMPTS[f"greeting:{kind}"])
+        return generate_text(self.backend, prompt_builder.fit("greeting", greeting_prompt, "message", message=message))
+
+    async def _agreeting_text(self, message: str) -> str:
+        kind = greeting_kind(message)
+        if kind:
+            return await self._apooled_text(f"greeting:{kind}", POOLED_PROMPTS[f"greeting:{kind}"])
+        return await agenerate_text(self.backend, prompt_builder.fit("greeting", greeting_prompt, "message", message=message))
+
+    def _build_graph(self, asynchronous: bool = False):
+        if asynchronous:
+            nodes = {
+                "fetch_user": self._afetch_user_data,
+                "classify_intent": self._aclassify_intent,
+                "process_greeting": self._aprocess_greeting,
+                "process_query": self._aprocess_query,
+                "handle_laptop_selection": self._ahandle_laptop_selection,
+                "list_devices": self._alist_devices,
+                "show_chat_history": self._ashow_chat_history,
+                "handle_identity": self._ahandle_identity
+            }
+        else:
+            nodes = {
+                "fetch_user": self._fetch_user_data,
+                "classify_intent": self._classify_intent,
+                "process_greeting": self._process_greeting,
+                "process_query": self._process_query,
+                "handle_laptop_selection": self._handle_laptop_selection,
+                "list_devices": self._list_devices,
+                "show_chat_history": self._show_chat_history,
+                "handle_identity": self._handle_identity
+            }
         workflow = StateGraph(State)
-        workflow.add_node("fetch_user", self._fetch_user_data)
-        workflow.add_node("classify_intent", self._classify_intent)
-        workflow.add_node("process_greeting", self._process_greeting)
-        workflow.add_node("process_query", self._process_query)
-        workflow.add_node("handle_laptop_selection", self._handle_laptop_selection)
-        workflow.add_node("list_devices", self._list_devices)
-        workflow.add_node("show_chat_history", self._show_chat_history)
-        workflow.add_node("handle_identity", self._handle_identity)
+        for name, node in nodes.items():
+            workflow.add_node(name, self._timed_node(name, node))
 
         workflow.set_entry_point("fetch_user")
         workflow.add_edge("fetch_user", "classify_intent")
@@ -74,43 +335,76 @@ class TicketingChatbot:
         workflow.add_edge("handle_identity", END)
         return workflow.compile()
 
+    def _timed_node(self, name: str, node):
+        """Wrap a graph node to record chatbot_node_* metrics and report its duration to `node_observers`."""
+        def observe(started: float, failed: bool):
+            elapsed = time.perf_counter() - started
+            NODE_CALLS.inc(node=name)
+            NODE_SECONDS.observe(elapsed, node=name)
+            if failed:
+                NODE_ERRORS.inc(node=name)
+            for observer in self.node_observers:
+                try:
+                    observer(name, elapsed)
+                except Exception as e:
+                    logger.warning(f"Node observer failed for {name}: {e}")
+
+        if asyncio.iscoroutinefunction(node):
+            async def timed_async(state: State) -> State:
+                started, failed = time.perf_counter(), True
+                try:
+                    state = await node(state)
+                    failed = False
+                    return state
+                finally:
+                    observe(started, failed)
+            return timed_async
+
+        def timed(state: State) -> State:
+            started, failed = time.perf_counter(), True
+            try:
+                state = node(state)
+                failed = False
+                return state
+            finally:
+                observe(started, failed)
+        return timed
+
+    def _local_intent(self, state: State) -> Optional[str]:
+        """Intent decided without the LLM, or None when the local classifier is not confident enough."""
+        if state.get("awaiting_laptop_selection") and self._names_laptop(state):
+            # The previous turn asked which laptop and this message names one
+            INTENT_DECISIONS.inc(source="bypass")
+            return "selection"
+        awaiting = bool(state.get("awaiting_laptop_selection"))
+        intent, confidence = self.intent_classifier.predict(state["message"], awaiting_selection=awaiting)
+        if intent == "selection" and not awaiting:
+            # Nothing to select from; "pick up where we left off" and the like go to the LLM
+            logger.info(f"Local intent selection without a pending device question ({confidence:.2f}), asking the LLM")
+            return None
+        if confidence >= self.intent_threshold:
+            INTENT_DECISIONS.inc(source="local")
+            logger.info(f"Intent classified locally as: {intent} ({confidence:.2f})")
+            return intent
+        logger.info(f"Local intent {intent} below threshold ({confidence:.2f}), asking the LLM")
+        return None
+
+    def _llm_intent(self, text: str) -> str:
+        INTENT_DECISIONS.inc(source="llm")
+        intent = text.strip().lower()
+        return intent if intent in INTENTS else "unknown"
+
     def _classify_intent(self, state: State) -> State:
         try:
+            intent = self._local_intent(state)
+            if intent:
+                state["intent"] = intent
+                return state
             message = state["message"].lower().strip()
             logger.info(f"Classifying intent for message: {message}")
-            prompt = (
-                f"""You are an AI assistant for a laptop support platform.
-                Given the user message: '{message}'
-                Classify the intent into one of:
-                - greeting: greetings like "hi", "hello", "hii", "bye", or asking about capabilities
-                - query: questions about laptop issues or troubleshooting
-                - list_devices: requests to list or show registered devices (e.g., "list my devices", "how many machines", "my device list is")
-                - selection: selecting a device from a list (e.g., "HP Pavilion", "yes that")
-                - chat_history: requests to see past conversation (e.g., "past conversation", "chat history", "past chat")
-                - identity: questions about the chatbot's or user's identity (e.g., "my name is", "you are llm model of", "why you are")
-                - unknown: anything unrelated to laptops (e.g., "cow", "car", "gift for my baby boy")
-                Return only the intent name.
-                Examples:
-                - "hi" -> greeting
-                - "hii" -> greeting
-                - "bye" -> greeting
-                - "my dell laptop screen is flickering" -> query
-                - "list my devices" -> list_devices
-                - "can you know how many machines was there" -> list_devices
-                - "my device list is" -> list_devices
-                - "select HP Pavilion" -> selection
-                - "can you send the past chat" -> chat_history
-                - "in previous we talk about which laptop" -> chat_history
-                - "my cow was not working" -> unknown
-                - "suggest a gift for my baby boy" -> unknown
-                - "my car was not working" -> unknown
-                - "my name is" -> identity
-                - "why you are" -> identity
-                - "you are llm model of" -> identity
-                """
-            )
-            response = chat_model.generate_content(prompt)
-            state["intent"] = response.text.strip()
+            prompt = prompt_builder.fit("classify_intent", classify_intent_prompt, "message", message=message)
+            text = complete_text(self.backend, prompt)
+            state["intent"] = self._llm_intent(text)
             logger.info(f"Intent classified as: {state['intent']}")
             return state
         except Exception as e:
@@ -118,26 +412,25 @@ class TicketingChatbot:
             state["intent"] = "unknown"
             return state
 
+    @staticmethod
+    def _set_user_data(state: State, user: Optional[dict]):
+        state["user_data"] = user or {}
+        state["laptops"] = user.get("laptops", []) if user else []
+        state["awaiting_laptop_selection"] = state.get("awaiting_laptop_selection", False)
+        state["last_query"] = state.get("last_query", "")
+        state["intent"] = state.get("intent", "unknown")
+
     def _fetch_user_data(self, state: State) -> State:
         try:
             logger.info(f"Fetching user data for {state['username']}")
-            user = self.customers_collection.find_one({"username": state["username"]})
-            state["user_data"] = user or {}
-            state["laptops"] = user.get("laptops", []) if user else []
-            state["awaiting_laptop_selection"] = state.get("awaiting_laptop_selection", False)
-            state["last_query"] = state.get("last_query", "")
-            state["intent"] = state.get("intent", "unknown")
-            try:
-                history = MongoDBChatMessageHistory(
-                    connection_string="mongodb://localhost:27017",
-                    database_name="Ticketing_Platform",
-                    collection_name="chat_history",
-                    session_id=state["username"]
-                )
-                state["chat_history"] = [{"role": msg.type, "content": msg.content} for msg in history.messages[-10:]]
-            except Exception as e:
-                logger.warning(f"Failed to load chat history for {state['username']}: {e}")
-                state["chat_history"] = []
+            self._set_user_data(state, self.find_customer(state["username"]))
+            if not state["chat_history"]:
+                # Not carried over from the previous turn
+                try:
+                    state["chat_history"] = self.history.recent(state["username"])
+                except Exception as e:
+                    logger.warning(f"Failed to load chat history for {state['username']}: {e}")
+                    state["chat_history"] = []
             logger.info(f"User data and history fetched for {state['username']}")
             return state
         except Exception as e:
@@ -149,29 +442,7 @@ class TicketingChatbot:
         try:
             message = state["message"].lower().strip()
             logger.info(f"Processing greeting: {message}")
-            prompt = (
-                f"""You are a friendly AI assistant here to support users with laptop-related issues on an AI ticketing platform.
-                ---
-                User input: '{state['message']}'
-                ---
-                Your task is to respond appropriately to the user's message.
-                If the user sends a greeting like "hi", "hello", "hii", etc.:
-                - Greet them in a natural, friendly way.
-                - Ask how you can assist them today.
-                If the input is a farewell like "bye":
-                - Respond with a polite farewell and encourage returning for help.
-                If the input asks about capabilities or features:
-                - Briefly mention that you can help with laptop issues, device listing, or troubleshooting.
-                - Encourage the user to describe their issue or list devices.
-                ---
-                Guidelines:
-                - Keep the tone conversational, friendly, and concise (1–2 lines, max 20 words per line).
-                - Vary phrasing to avoid repetition across responses.
-                - Use clear, casual language that invites engagement.
-                """
-            )
-            response = chat_model.generate_content(prompt)
-            state["response"] = response.text.strip() if hasattr(response, "text") else str(response)
+            state["response"] = self._greeting_text(state["message"])
             state["awaiting_laptop_selection"] = False
             return state
         except Exception as e:
@@ -181,154 +452,119 @@ class TicketingChatbot:
 
     def _list_devices(self, state: State) -> State:
         try:
-            laptops = state["laptops"]
             logger.info(f"Listing devices for user: {state['username']}")
-            valid_laptops = [
-                laptop for laptop in laptops
-                if isinstance(laptop, dict) and "name" in laptop and "model" in laptop
-                and isinstance(laptop.get("name"), str) and isinstance(laptop.get("model"), str)
-            ]
-            if valid_laptops:
-                laptop_list = sorted(set(f"{laptop['name']} ({laptop['model']})" for laptop in valid_laptops))
-                state["response"] = (
-                    f"Your registered devices:<br><ul>" +
-                    "".join(f"<li>{laptop}</li>" for laptop in laptop_list) +
-                    "</ul>Please select a device or describe an issue."
-                )
-                state["awaiting_laptop_selection"] = True
-                state["last_query"] = ""
+            laptops = valid_laptops(state["laptops"])
+            if laptops:
+                state["response"] = device_list_html(laptops, "Your registered devices:<br>", "Please select a device or describe an issue.")
             else:
-                prompt = (
-                    """You are a friendly AI assistant on an AI ticketing platform that supports users with laptop-related issues.
-                    ---
-                    Your task is to inform users that no devices are registered and suggest visiting the registration page.
-                    Respond warmly in 1–2 lines, each under 20 words.
-                    ---
-                    Use simple, clear language without jargon.
-                    Vary phrasing for a fresh, engaging response.
-                    """
-                )
-                response = chat_model.generate_content(prompt)
-                state["response"] = response.text.strip() if hasattr(response, "text") else str(response)
-                state["awaiting_laptop_selection"] = True
-                state["last_query"] = ""
+                state["response"] = self._pooled_text("no_devices", NO_DEVICES_PROMPT)
+            state["awaiting_laptop_selection"] = True
+            state["last_query"] = ""
             return state
         except Exception as e:
             logger.error(f"Error listing devices: {e}")
             state["response"] = "Error listing your devices. Please try again."
             return state
 
+    def _route_query(self, state: State) -> str:
+        """Decide how `_process_query` answers the message; returns a QUERY_ACTIONS key."""
+        message = state["message"].lower().strip()
+        laptops = valid_laptops(state["laptops"])
+        logger.info(f"Processing query: {message}, laptops: {len(state['laptops'])}")
+        laptop_names = [laptop["name"].lower() for laptop in laptops]
+        laptop_models = [f"{laptop['name']} {laptop['model']}".lower() for laptop in laptops]
+        mentioned_brand = next((brand.lower() for brand in AVAILABLE_BRANDS if brand.lower() in message), None)
+
+        # Check for irrelevant topics
+        if any(keyword in message for keyword in IRRELEVANT_KEYWORDS):
+            return "irrelevant"
+        if mentioned_brand or any(name in message for name in laptop_names) or any(model in message for model in laptop_models):
+            return "retrieve"
+        if "laptop" in message:
+            return "devices" if laptops else "no_devices"
+        return "details"
+
+    def _apply_query_action(self, state: State, action: str, response: str = None) -> State:
+        if action == "irrelevant":
+            response = "Sorry, I focus on laptop issues. How can I assist with your device?"
+        elif action == "devices":
+            response = device_list_html(
+                valid_laptops(state["laptops"]),
+                "Your registered devices:<br>",
+                "Please specify a device, e.g., 'HP Pavilion x360', or describe an issue."
+            )
+        awaiting, keep_query = QUERY_ACTIONS[action]
+        state["response"] = response
+        state["awaiting_laptop_selection"] = awaiting
+        state["last_query"] = state["message"].lower().strip() if keep_query else ""
+        logger.info(f"Query response: {state['response']}, awaiting_selection: {state['awaiting_laptop_selection']}")
+        return state
+
     def _process_query(self, state: State) -> State:
         try:
-            message = state["message"].lower().strip()
-            laptops = state["laptops"]
-            logger.info(f"Processing query: {message}, laptops: {len(laptops)}")
-
-            valid_laptops = [
-                laptop for laptop in laptops
-                if isinstance(laptop, dict) and "name" in laptop and "model" in laptop
-                and isinstance(laptop.get("name"), str) and isinstance(laptop.get("model"), str)
-            ]
-            laptop_names = [laptop["name"].lower() for laptop in valid_laptops]
-            laptop_models = [f"{laptop['name']} {laptop['model']}".lower() for laptop in valid_laptops]
-
-            available_brands = ["Apple", "HP", "Dell", "Lenovo", "Asus", "Acer", "Microsoft", "Samsung", "MSI"]
-            mentioned_brand = next((brand.lower() for brand in available_brands if brand.lower() in message), None)
-
-            # Check for irrelevant topics
-            irrelevant_keywords = ["cow", "car", "weather", "milk", "animal", "vehicle", "gift", "baby", "child"]
-            is_irrelevant = any(keyword in message for keyword in irrelevant_keywords)
-
-            if is_irrelevant:
-                state["response"] = "Sorry, I focus on laptop issues. How can I assist with your device?"
-                state["awaiting_laptop_selection"] = False
-                state["last_query"] = ""
-            elif mentioned_brand or any(name in message for name in laptop_names) or any(model in message for model in laptop_models):
-                result = self.rag.retrieve_answers(message, state["chat_history"])
-                state["response"] = result["formatted_response"]
-                state["awaiting_laptop_selection"] = False
-                state["last_query"] = message
-            elif "laptop" in message or any(brand.lower() in message for brand in available_brands):
-                if valid_laptops:
-                    laptop_list = sorted(set(f"{laptop['name']} ({laptop['model']})" for laptop in valid_laptops))
-                    state["response"] = (
-                        f"Your registered devices:<br><ul>" +
-                        "".join(f"<li>{laptop}</li>" for laptop in laptop_list) +
-                        "</ul>Please specify a device, e.g., 'HP Pavilion x360', or describe an issue."
-                    )
-                    state["awaiting_laptop_selection"] = True
-                    state["last_query"] = message
-                else:
-                    prompt = (
-                        """You are a friendly AI assistant for an AI ticketing platform focused on supporting laptop-related issues.
-                        ---
-                        Your task is to let users know that no devices are registered and suggest visiting the registration page.
-                        Respond in a warm, natural tone using 1–2 lines, each under 20 words.
-                        ---
-                        Vary phrasing to keep responses fresh and engaging.
-                        Use simple, clear language without jargon.
-                        """
-                    )
-                    response = chat_model.generate_content(prompt)
-                    state["response"] = response.text.strip() if hasattr(response, "text") else str(response)
-                    state["awaiting_laptop_selection"] = True
-                    state["last_query"] = ""
-            else:
-                prompt = (
-                    """You are a friendly AI assistant for an AI ticketing platform that supports users with laptop-related issues.
-                    ---
-                    Your task is to ask users for more details about their request, encouraging them to specify the device or issue.
-                    Respond in a warm, natural tone using 1–2 lines, each under 20 words.
-                    ---
-                    Vary phrasing to keep responses conversational and engaging.
-                    Avoid jargon and ensure clarity.
-                    """
-                )
-                response = chat_model.generate_content(prompt)
-                state["response"] = response.text.strip() if hasattr(response, "text") else str(response)
-                state["awaiting_laptop_selection"] = False
-                state["last_query"] = ""
-
-            logger.info(f"Query response: {state['response']}, awaiting_selection: {state['awaiting_laptop_selection']}")
-            return state
+            action = self._route_query(state)
+            response = None
+            if action == "retrieve":
+                response = self.rag.retrieve_answers(state["message"].lower().strip(), state["chat_history"])["formatted_response"]
+            elif action == "no_devices":
+                response = self._pooled_text("no_devices_query", NO_DEVICES_QUERY_PROMPT)
+            elif action == "details":
+                response = self._pooled_text("more_details", MORE_DETAILS_PROMPT)
+            return self._apply_query_action(state, action, response)
         except Exception as e:
             logger.error(f"Error processing query: {e}")
             state["response"] = "Error processing your query. Please try again."
             return state
 
+    @staticmethod
+    def _selected_laptop(state: State) -> Optional[str]:
+        """The registered laptop ("name model", lowercase) the message picks, if any."""
+        message = state["message"].lower().strip()
+        laptop_models = [f"{laptop['name']} {laptop['model']}".lower() for laptop in valid_laptops(state["laptops"])]
+        return next((model for model in laptop_models if model in message or message in model or message in ["yes that", "that one", "yes"]), None)
+
+    @staticmethod
+    def _names_laptop(state: State) -> bool:
+        """Whether the message contains a registered laptop's full name or model as whole tokens.
+
+        Stricter than `_selected_laptop`, which also accepts fragments ("no" is in
+        "lenovo"); only this is trusted to skip intent classification.
+        """
+        message = f" {' '.join(tokenize(state['message']))} "
+        for laptop in valid_laptops(state["laptops"]):
+            for phrase in (laptop["name"], laptop["model"]):
+                tokens = tokenize(phrase or "")
+                if tokens and f" {' '.join(tokens)} " in message:
+                    return True
+        return False
+
+    def _selected_query(self, state: State) -> Optional[str]:
+        """The retrieval query for a laptop selection, or None if the message selects no registered laptop."""
+        message = state["message"].lower().strip()
+        logger.info(f"Handling laptop selection: {message}, last_query: {state['last_query']}")
+        selected_laptop = self._selected_laptop(state)
+        if not selected_laptop:
+            return None
+        query = f"{state['last_query']} {selected_laptop}" if state['last_query'] else message
+        logger.info(f"Reconstructed query: {query}")
+        return query
+
+    def _apply_selection(self, state: State, query: Optional[str], response: str = None) -> State:
+        if query:
+            state["response"] = response
+            state["awaiting_laptop_selection"] = False
+            state["last_query"] = query
+        else:
+            state["response"] = device_list_html(valid_laptops(state["laptops"]), "Invalid selection. Please choose from your devices:<br>", "")
+            state["awaiting_laptop_selection"] = True
+        logger.info(f"Laptop selection response: {state['response']}, awaiting_selection: {state['awaiting_laptop_selection']}")
+        return state
+
     def _handle_laptop_selection(self, state: State) -> State:
         try:
-            message = state["message"].lower().strip()
-            laptops = state["laptops"]
-            logger.info(f"Handling laptop selection: {message}, last_query: {state['last_query']}")
-
-            valid_laptops = [
-                laptop for laptop in laptops
-                if isinstance(laptop, dict) and "name" in laptop and "model" in laptop
-                and isinstance(laptop["name"], str) and isinstance(laptop["model"], str)
-            ]
-            laptop_models = [f"{laptop['name']} {laptop['model']}".lower() for laptop in valid_laptops]
-            
-            selected_laptop = next((model for model in laptop_models if model in message or message in model or message in ["yes that", "that one", "yes"]), None)
-            
-            if selected_laptop:
-                query = f"{state['last_query']} {selected_laptop}" if state['last_query'] else message
-                logger.info(f"Reconstructed query: {query}")
-                result = self.rag.retrieve_answers(query, state["chat_history"])
-                state["response"] = result["formatted_response"]
-                state["awaiting_laptop_selection"] = False
-                state["last_query"] = query
-            else:
-                laptop_list = sorted(set(f"{laptop['name']} ({laptop['model']})" for laptop in valid_laptops))
-                state["response"] = (
-                    f"Invalid selection. Please choose from your devices:<br><ul>" +
-                    "".join(f"<li>{laptop}</li>" for laptop in laptop_list) +
-                    "</ul>"
-                )
-                state["awaiting_laptop_selection"] = True
-            
-            logger.info(f"Laptop selection response: {state['response']}, awaiting_selection: {state['awaiting_laptop_selection']}")
-            return state
+            query = self._selected_query(state)
+            response = self.rag.retrieve_answers(query, state["chat_history"])["formatted_response"] if query else None
+            return self._apply_selection(state, query, response)
         except Exception as e:
             logger.error(f"Error handling laptop selection: {e}")
             state["response"] = "Error processing laptop selection. Please try again."
@@ -363,19 +599,7 @@ class TicketingChatbot:
     def _handle_identity(self, state: State) -> State:
         try:
             logger.info(f"Handling identity query for user: {state['username']}")
-            prompt = (
-                """You are a friendly AI assistant for an AI ticketing platform focused on laptop support.
-                ---
-                Your task is to respond to queries about the chatbot's or user's identity.
-                Explain you are an AI for laptop support and redirect to a laptop-related task.
-                Respond in 1–2 lines, each under 20 words.
-                ---
-                Vary phrasing to keep responses fresh and conversational.
-                Use simple, clear language without jargon.
-                """
-            )
-            response = chat_model.generate_content(prompt)
-            state["response"] = response.text.strip() if hasattr(response, "text") else str(response)
+            state["response"] = self._pooled_text("identity", IDENTITY_PROMPT)
             state["awaiting_laptop_selection"] = False
             state["last_query"] = ""
             logger.info(f"Identity response: {state['response']}")
@@ -385,32 +609,155 @@ class TicketingChatbot:
             state["response"] = "I'm an AI for laptop support. How can I help with your device?"
             return state
 
+    # Async graph nodes: same behaviour as the nodes above, awaiting Gemini, RAG and Mongo calls
+
+    async def _aclassify_intent(self, state: State) -> State:
+        try:
+            intent = self._local_intent(state)
+            if intent:
+                state["intent"] = intent
+                return state
+            message = state["message"].lower().strip()
+            logger.info(f"Classifying intent for message: {message}")
+            prompt = prompt_builder.fit("classify_intent", classify_intent_prompt, "message", message=message)
+            text = await acomplete_text(self.backend, prompt)
+            state["intent"] = self._llm_intent(text)
+            logger.info(f"Intent classified as: {state['intent']}")
+            return state
+        except Exception as e:
+            logger.error(f"Error classifying intent: {e}")
+            state["intent"] = "unknown"
+            return state
+
+    async def _afetch_user_data(self, state: State) -> State:
+        try:
+            logger.info(f"Fetching user data for {state['username']}")
+            self._set_user_data(state, await self.afind_customer(state["username"]))
+            if not state["chat_history"]:
+                # Not carried over from the previous turn
+                try:
+                    state["chat_history"] = await self.history.arecent(state["username"])
+                except Exception as e:
+                    logger.warning(f"Failed to load chat history for {state['username']}: {e}")
+                    state["chat_history"] = []
+            logger.info(f"User data and history fetched for {state['username']}")
+            return state
+        except Exception as e:
+            logger.error(f"Error fetching user data for {state['username']}: {e}")
+            state["response"] = "Error fetching user data. Please try again."
+            return state
+
+    async def _aprocess_greeting(self, state: State) -> State:
+        try:
+            logger.info(f"Processing greeting: {state['message'].lower().strip()}")
+            state["response"] = await self._agreeting_text(state["message"])
+            state["awaiting_laptop_selection"] = False
+            return state
+        except Exception as e:
+            logger.error(f"Error processing greeting: {e}")
+            state["response"] = "Error processing your message. Please try again."
+            return state
+
+    async def _alist_devices(self, state: State) -> State:
+        try:
+            logger.info(f"Listing devices for user: {state['username']}")
+            laptops = valid_laptops(state["laptops"])
+            if laptops:
+                state["response"] = device_list_html(laptops, "Your registered devices:<br>", "Please select a device or describe an issue.")
+            else:
+                state["response"] = await self._apooled_text("no_devices", NO_DEVICES_PROMPT)
+            state["awaiting_laptop_selection"] = True
+            state["last_query"] = ""
+            return state
+        except Exception as e:
+            logger.error(f"Error listing devices: {e}")
+            state["response"] = "Error listing your devices. Please try again."
+            return state
+
+    async def _aprocess_query(self, state: State) -> State:
+        try:
+            action = self._route_query(state)
+            response = None
+            if action == "retrieve":
+                result = await self.rag.aretrieve_answers(state["message"].lower().strip(), state["chat_history"])
+                response = result["formatted_response"]
+            elif action == "no_devices":
+                response = await self._apooled_text("no_devices_query", NO_DEVICES_QUERY_PROMPT)
+            elif action == "details":
+                response = await self._apooled_text("more_details", MORE_DETAILS_PROMPT)
+            return self._apply_query_action(state, action, response)
+        except Exception as e:
+            logger.error(f"Error processing query: {e}")
+            state["response"] = "Error processing your query. Please try again."
+            return state
+
+    async def _ahandle_laptop_selection(self, state: State) -> State:
+        try:
+            query = self._selected_query(state)
+            response = (await self.rag.aretrieve_answers(query, state["chat_history"]))["formatted_response"] if query else None
+            return self._apply_selection(state, query, response)
+        except Exception as e:
+            logger.error(f"Error handling laptop selection: {e}")
+            state["response"] = "Error processing laptop selection. Please try again."
+            return state
+
+    async def _ashow_chat_history(self, state: State) -> State:
+        return self._show_chat_history(state)
+
+    async def _ahandle_identity(self, state: State) -> State:
+        try:
+            logger.info(f"Handling identity query for user: {state['username']}")
+            state["response"] = await self._apooled_text("identity", IDENTITY_PROMPT)
+            state["awaiting_laptop_selection"] = False
+            state["last_query"] = ""
+            logger.info(f"Identity response: {state['response']}")
+            return state
+        except Exception as e:
+            logger.error(f"Error handling identity query: {e}")
+            state["response"] = "I'm an AI for laptop support. How can I help with your device?"
+            return state
+
+    @staticmethod
+    def _initial_state(username: str, message: str, previous: Optional[dict] = None) -> State:
+        """Fresh state for a turn, resuming the selection flow and history from `previous` (a saved snapshot)."""
+        previous = previous or {}
+        return {
+            "username": username,
+            "message": message,
+            "response": "",
+            "user_data": {},
+            "laptops": [],
+            "awaiting_laptop_selection": bool(previous.get("awaiting_laptop_selection", False)),
+            "last_query": previous.get("last_query") or "",
+            "chat_history": previous.get("chat_history") or [],
+            "intent": "unknown"
+        }
+
+    def _save_conversation(self, username: str, result: State, message: str, response: str):
+        turn = [{"role": "human", "content": message}, {"role": "ai", "content": response}]
+        chat_history = (list(result.get("chat_history") or []) + turn)[-self.history.limit:]
+        self.conversations.save(username, dict(result, chat_history=chat_history))
+
+    def handle_message_stream(self, username: str, message: str):
+        """Like `handle_message`, but yields StreamEvents as the response is produced."""
+        return stream_call(lambda: self.handle_message(username, message))
+
+    def ahandle_message_stream(self, username: str, message: str):
+        """Async iterator of StreamEvents for `ahandle_message`."""
+        return astream_call(lambda: self.ahandle_message(username, message))
+
     def handle_message(self, username: str, message: str) -> str:
         try:
             logger.info(f"Handling message for {username}: {message}")
-            state = {
-                "username": username,
-                "message": message,
-                "response": "",
-                "user_data": {},
-                "laptops": [],
-                "awaiting_laptop_selection": False,
-                "last_query": "",
-                "chat_history": [],
-                "intent": "unknown"
-            }
-            result = self.graph.invoke(state, config={"recursion_limit": 50})
+            with CHAT_MESSAGE_SECONDS.time(mode="sync"):
+                initial_state = self._initial_state(username, message, self.conversations.load(username))
+                result = self.graph.invoke(initial_state, config={"recursion_limit": 50})
+            CHAT_MESSAGES.inc(mode="sync")
             response = result["response"] or "No response generated. Please try again."
+            self._save_conversation(username, result, message, response)
             
             try:
-                history = MongoDBChatMessageHistory(
-                    connection_string="mongodb://localhost:27017",
-                    database_name="Ticketing_Platform",
-                    collection_name="chat_history",
-                    session_id=username
-                )
-                history.add_user_message(message)
-                history.add_ai_message(response)
+                self.history.add_turn(username, message, response)
             except Exception as e:
                 logger.warning(f"Failed to save chat history for {username}: {e}")
 
@@ -419,4 +766,29 @@ class TicketingChatbot:
             return response
         except Exception as e:
             logger.error(f"Error in handle_message: {e}")
-            return "An error occurred while processing your message. Please try again."
\ No newline at end of file
+            CHAT_MESSAGE_ERRORS.inc(mode="sync")
+            return "An error occurred while processing your message. Please try again."
+
+    async def ahandle_message(self, username: str, message: str) -> str:
+        """Async counterpart of `handle_message`, run through the async graph on the caller's event loop."""
+        try:
+            logger.info(f"Handling message for {username}: {message}")
+            with CHAT_MESSAGE_SECONDS.time(mode="async"):
+                initial_state = self._initial_state(username, message, await self.conversations.aload(username))
+                result = await self.async_graph.ainvoke(initial_state, config={"recursion_limit": 50})
+            CHAT_MESSAGES.inc(mode="async")
+            response = result["response"] or "No response generated. Please try again."
+            self._save_conversation(username, result, message, response)
+
+            try:
+                self.history.add_turn(username, message, response)
+            except Exception as e:
+                logger.warning(f"Failed to save chat history for {username}: {e}")
+
+            logger.info(f"Final response for {username}: {response}")
+            logger.debug(f"Final state: {result}")
+            return response
+        except Exception as e:
+            logger.error(f"Error in ahandle_message: {e}")
+            CHAT_MESSAGE_ERRORS.inc(mode="async")
+            return "An error occurred while processing your message. Please try again."
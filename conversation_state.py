@@ -0,0 +1,127 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from metrics import CONVERSATION_STATE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# Graph state fields carried from one turn to the next
+PERSISTED_FIELDS = ("awaiting_laptop_selection", "last_query", "chat_history")
+
+
+class ConversationStateStore:
+    """Per-username snapshot of the conversation state left by the previous turn.
+
+    Snapshots live in an in-process LRU (`max_size` users) and expire `ttl`
+    seconds after the turn that wrote them, so a stale "which laptop?" question
+    is not answered a day later. With `collection` (a callable returning the
+    MongoDB collection) snapshots are also written through to MongoDB, keyed by
+    username, off the request path, and a process that has no snapshot in memory
+    (after a restart, or on another worker) resumes from there. Each process
+    trusts its own LRU, so with several workers route a user to the same one.
+    """
+
+    def __init__(self, collection: Callable[[], Any] = None, async_collection: Callable[[], Any] = None,
+                 max_size: int = 10000, ttl: float = 1800):
+        self.collection = collection
+        self.async_collection = async_collection
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._writer_pid != os.getpid():
+                # Created per process (an executor inherited through fork has no worker thread);
+                # a single worker keeps each user's snapshots in order
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-state")
+                self._writer_pid = os.getpid()
+            writer = self._writer
+        writer.submit(fn, *args)
+
+    def _live(self, snapshot: Optional[dict]) -> Optional[dict]:
+        if snapshot is None or time.time() - snapshot.get("updated_at", 0) > self.ttl:
+            return None
+        return snapshot
+
+    def _cached(self, username: str) -> Optional[dict]:
+        with self._lock:
+            snapshot = self._live(self._entries.get(username))
+            if snapshot is None:
+                self._entries.pop(username, None)
+                return None
+            self._entries.move_to_end(username)
+            return copy.deepcopy(snapshot)
+
+    def _remember(self, username: str, snapshot: dict):
+        with self._lock:
+            self._entries[username] = copy.deepcopy(snapshot)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _from_document(self, username: str, document: Optional[dict]) -> Optional[dict]:
+        snapshot = self._live({key: value for key, value in document.items() if key != "_id"} if document else None)
+        if snapshot is None:
+            CONVERSATION_STATE_LOOKUPS.inc(outcome="miss")
+            return None
+        CONVERSATION_STATE_LOOKUPS.inc(outcome="mongo")
+        self._remember(username, snapshot)
+        return snapshot
+
+    def load(self, username: str) -> Optional[dict]:
+        """The previous turn's snapshot for `username`, or None."""
+        snapshot = self._cached(username)
+        if snapshot is not None:
+            CONVERSATION_STATE_LOOKUPS.inc(outcome="memory")
+            return snapshot
+        if self.collection is None:
+            CONVERSATION_STATE_LOOKUPS.inc(outcome="miss")
+            return None
+        try:
+            return self._from_document(username, self.collection().find_one({"_id": username}))
+        except Exception as e:
+            logger.warning(f"Failed to load conversation state for {username}: {e}")
+            return None
+
+    async def aload(self, username: str) -> Optional[dict]:
+        snapshot = self._cached(username)
+        if snapshot is not None:
+            CONVERSATION_STATE_LOOKUPS.inc(outcome="memory")
+            return snapshot
+        if self.async_collection is None:
+            CONVERSATION_STATE_LOOKUPS.inc(outcome="miss")
+            return None
+        try:
+            return self._from_document(username, await self.async_collection().find_one({"_id": username}))
+        except Exception as e:
+            logger.warning(f"Failed to load conversation state for {username}: {e}")
+            return None
+
+    def save(self, username: str, state: dict):
+        snapshot = {field: state.get(field) for field in PERSISTED_FIELDS}
+        snapshot["updated_at"] = time.time()
+        self._remember(username, snapshot)
+        if self.collection is not None:
+            self._submit(self._write, username, snapshot)
+
+    def _write(self, username: str, snapshot: dict):
+        try:
+            self.collection().replace_one({"_id": username}, snapshot, upsert=True)
+        except Exception as e:
+            logger.warning(f"Failed to save conversation state for {username}: {e}")
+
+    def clear(self, username: str):
+        with self._lock:
+            self._entries.pop(username, None)
+        if self.collection is not None:
+            self._submit(lambda: self.collection().delete_one({"_id": username}))
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """True for rate-limit / quota errors (HTTP 429, ResourceExhausted)."""
+    if type(error).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return "429" in message or "quota" in message or "rate limit" in message
+
+
+class AdaptiveRateLimiter:
+    """Spaces out requests across threads and backs off when the API reports quota errors.
+
+    The delay between requests doubles on every quota error (up to `max_interval`)
+    and decays back towards `min_interval` as requests succeed.
+    """
+
+    def __init__(self, min_interval: float = 0.0, max_interval: float = 30.0, backoff: float = 2.0, recovery: float = 0.75):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.recovery = recovery
+        self.interval = min_interval
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next_slot - now)
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait:
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.interval *= self.recovery
+            if self.interval < max(self.min_interval, 0.01):
+                self.interval = self.min_interval
+
+    def on_quota_error(self):
+        with self._lock:
+            self.interval = min(self.max_interval, max(self.interval * self.backoff, 0.5))
+            self._next_slot = time.monotonic() + self.interval
+            logger.warning(f"Embedding quota exceeded, backing off to {self.interval:.2f}s between requests")
+
+
+class EmbeddingBatcher:
+    """Embed many texts with multi-text requests on a bounded thread pool.
+
+    `embed_batch` takes a list of texts and returns one embedding per text; it is
+    the only thing that talks to the embedding service, so any local fake with the
+    same signature can be plugged in. Identical texts are embedded once (keyed by
+    content hash). Texts whose batch ultimately fails get an empty embedding.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[list]], batch_size: int = 100, max_workers: int = 4,
+                 max_retries: int = 5, rate_limiter: AdaptiveRateLimiter = None):
+        self.embed_batch = embed_batch
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+
+    def embed(self, texts: List[str]) -> List[list]:
+        unique: Dict[str, str] = {}
+        keys = []
+        for text in texts:
+            key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            unique.setdefault(key, text)
+            keys.append(key)
+        unique_keys = list(unique)
+        chunks = [unique_keys[i:i + self.batch_size] for i in range(0, len(unique_keys), self.batch_size)]
+        logger.info(f"Embedding {len(texts)} texts ({len(unique_keys)} unique) in {len(chunks)} batches")
+
+        embeddings: Dict[str, list] = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chunks) or 1)) as pool:
+            results = pool.map(lambda chunk: self._embed_chunk([unique[key] for key in chunk]), chunks)
+            for chunk, vectors in zip(chunks, results):
+                embeddings.update(zip(chunk, vectors))
+        return [embeddings.get(key, []) for key in keys]
+
+    def _embed_chunk(self, chunk: List[str]) -> List[list]:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                vectors = self.embed_batch(chunk)
+                if len(vectors) != len(chunk):
+                    raise ValueError(f"Expected {len(chunk)} embeddings, got {len(vectors)}")
+                self.rate_limiter.on_success()
+                return vectors
+            except Exception as e:
+                if is_quota_error(e) and attempt < self.max_retries:
+                    self.rate_limiter.on_quota_error()
+                    continue
+                logger.error(f"Failed to embed batch of {len(chunk)} texts: {e}")
+                return [[] for _ in chunk]
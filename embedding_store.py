@@ -0,0 +1,273 @@
+import argparse
+import json
+import logging
+import os
+import struct
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 2
+HEADER_BYTES = 128
+WRITE_CHUNK = 65536
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    """A .npy (format 1.0) header for a float32 (rows, dim) array, padded to HEADER_BYTES."""
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    header = header.ljust(HEADER_BYTES - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _fsync_replace(tmp_path: str, path: str):
+    with open(tmp_path, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class EmbeddingStore:
+    """Binary on-disk embedding store.
+
+    Vectors are kept in a raw float32 `.npy` file (pre-normalized, one row per
+    ticket) that is memory-mapped on load, so startup does not parse floats and
+    pages are shared between worker processes. Ticket metadata (id, brand, query,
+    answers) is kept one JSON line per row, in row order, next to it.
+
+    `metadata_path` is a small manifest naming the current vectors and tickets
+    files (`<vectors stem>.<generation>.npy` / `.tickets.jsonl`), their row count,
+    the embedding model and the dimension. A save writes a new generation and then
+    replaces the manifest, so a crash at any point leaves the previous, matching
+    pair in place; `append` adds rows to the end of the current pair and then
+    replaces the manifest. `load` only trusts the first `rows` rows of either
+    file and rejects a store written for another model or dimension.
+    """
+
+    def __init__(self, vectors_path: str = "ticket_embeddings.npy", metadata_path: str = "ticket_embeddings.meta.json"):
+        self.vectors_path = vectors_path
+        self.metadata_path = metadata_path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.metadata_path)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(os.path.dirname(self.metadata_path), name)
+
+    def _generation_names(self, generation: int) -> Tuple[str, str]:
+        stem = os.path.splitext(os.path.basename(self.vectors_path))[0]
+        return f"{stem}.{generation}.npy", f"{stem}.{generation}.tickets.jsonl"
+
+    def manifest(self) -> dict:
+        with open(self.metadata_path, "r") as f:
+            return json.load(f)
+
+    def _load_v1(self, manifest: dict, mmap: bool):
+        """Stores written before the manifest format: ids and metadata inline, vectors at `vectors_path`."""
+        ids = manifest["ids"]
+        vectors = np.load(self.vectors_path, mmap_mode="r" if mmap else None)
+        if vectors.shape[0] != len(ids):
+            raise ValueError(f"Vector file has {vectors.shape[0]} rows but metadata lists {len(ids)} ids")
+        return {"by_brand": manifest.get("by_brand", {}), "by_id": manifest.get("by_id", {})}, ids, vectors
+
+    def _read_tickets(self, path: str, rows: int) -> Tuple[Dict[str, dict], List[str]]:
+        by_id, by_brand, ids = {}, {}, []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if len(ids) == rows:
+                    break
+                ticket = json.loads(line)
+                ticket_id = ticket.pop("id")
+                ids.append(ticket_id)
+                by_id[ticket_id] = ticket
+                by_brand.setdefault(ticket.get("brand", "Unknown"), []).append(ticket_id)
+        if len(ids) != rows:
+            raise ValueError(f"Tickets file {path} has {len(ids)} rows but the manifest lists {rows}")
+        return {"by_brand": by_brand, "by_id": by_id}, ids
+
+    def _open_vectors(self, manifest: dict, mmap: bool = True) -> np.ndarray:
+        rows = manifest["rows"]
+        vectors = np.load(self._path(manifest["vectors_file"]), mmap_mode="r" if mmap else None)
+        if vectors.ndim != 2 or vectors.shape[0] < rows or (rows and vectors.shape[1] != manifest["dim"]):
+            raise ValueError(f"Vector file has shape {vectors.shape} but the manifest lists {rows} rows of {manifest['dim']}")
+        # Rows past the manifest's count were never committed
+        return vectors[:rows]
+
+    def open_vectors(self) -> np.ndarray:
+        """Memory-map the current vectors without re-reading the ticket metadata."""
+        return self._open_vectors(self.manifest())
+
+    def load(self, mmap: bool = True, model: str = "", dim: int = 0) -> Tuple[Dict[str, dict], List[str], np.ndarray]:
+        """Return (embeddings metadata, row ids, vectors) from disk.
+
+        Raises ValueError when the files do not match each other, or when `model`
+        or `dim` is given and the store was written with a different one.
+        """
+        manifest = self.manifest()
+        version = manifest.get("version")
+        if version not in (1, STORE_VERSION):
+            raise ValueError(f"Unsupported embedding store version: {version}")
+        if model and manifest.get("model") and manifest["model"] != model:
+            raise ValueError(f"Embedding store was written with model '{manifest['model']}', expected '{model}'")
+        if version == 1:
+            embeddings, ids, vectors = self._load_v1(manifest, mmap)
+        else:
+            vectors = self._open_vectors(manifest, mmap)
+            embeddings, ids = self._read_tickets(self._path(manifest["tickets_file"]), manifest["rows"])
+        if dim and len(ids) and vectors.shape[1] != dim:
+            raise ValueError(f"Embedding store has dimension {vectors.shape[1]}, expected {dim}")
+        logger.info(f"Loaded {len(ids)} embeddings from {self.metadata_path} (mmap={mmap})")
+        return embeddings, ids, vectors
+
+    def _write_manifest(self, manifest: dict):
+        tmp_path = f"{self.metadata_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        _fsync_replace(tmp_path, self.metadata_path)
+
+    def _remove_old_generations(self, keep: set):
+        """Delete generation files other than `keep`; open memory maps of them stay valid."""
+        stem = os.path.splitext(os.path.basename(self.vectors_path))[0]
+        directory = os.path.dirname(self.metadata_path) or "."
+        for name in os.listdir(directory):
+            if name.startswith(f"{stem}.") and name not in keep and name.endswith((".npy", ".tickets.jsonl")) \
+                    and name[len(stem) + 1:].split(".")[0].isdigit():
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError as e:
+                    logger.warning(f"Could not remove old embedding store file {name}: {e}")
+
+    @staticmethod
+    def _write_tickets(f, by_id: Dict[str, dict], ids: List[str]) -> int:
+        """Write one JSON line per id at the current position of binary file `f`; returns the end offset."""
+        for ticket_id in ids:
+            ticket = {key: value for key, value in by_id.get(ticket_id, {}).items() if key != "embedding"}
+            f.write((json.dumps(dict(ticket, id=ticket_id), separators=(",", ":")) + "\n").encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+    def save(self, embeddings: Dict[str, dict], ids: List[str], vectors: np.ndarray, model: str = ""):
+        """Write a new generation of the store and switch the manifest to it; rows are L2-normalized."""
+        # No copy for a float32 memory map
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(len(ids), -1 if ids else 0)
+        rows, dim = len(ids), int(vectors.shape[1])
+        previous = self.manifest() if self.exists() else {}
+        generation = previous.get("generation", 0) + 1
+        vectors_file, tickets_file = self._generation_names(generation)
+        with open(self._path(vectors_file), "wb") as f:
+            f.write(_npy_header(rows, dim))
+            # Chunked so that saving from a memory map never holds the whole matrix in memory
+            for start in range(0, rows, WRITE_CHUNK):
+                f.write(normalize_rows(vectors[start:start + WRITE_CHUNK]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._path(tickets_file), "wb") as f:
+            tickets_bytes = self._write_tickets(f, embeddings.get("by_id", {}), ids)
+        self._write_manifest({
+            "version": STORE_VERSION,
+            "generation": generation,
+            "model": model,
+            "dim": dim,
+            "normalized": True,
+            "rows": rows,
+            "vectors_file": vectors_file,
+            "tickets_file": tickets_file,
+            "tickets_bytes": tickets_bytes
+        })
+        # Keep the previous generation for processes that read the old manifest just before the switch
+        self._remove_old_generations({vectors_file, tickets_file, previous.get("vectors_file"), previous.get("tickets_file")})
+        logger.info(f"Saved {rows} embeddings to {vectors_file}")
+
+    def append(self, by_id: Dict[str, dict], ids: List[str], vectors: np.ndarray, model: str = "", base_rows: int = 0) -> bool:
+        """Add rows for new tickets to the end of the current generation; rows are L2-normalized.
+
+        Costs O(new rows): nothing already stored is read or rewritten. `base_rows`
+        is the row count the caller's view of the store has; ValueError is raised
+        if the store has changed since (or was written for another model or
+        dimension). Returns False, writing nothing, when the store predates
+        appendable files, in which case the caller should `save` instead.
+        """
+        if not self.exists():
+            return False
+        manifest = self.manifest()
+        if manifest.get("version") != STORE_VERSION or "tickets_bytes" not in manifest:
+            return False
+        rows = manifest["rows"]
+        if rows != base_rows:
+            raise ValueError(f"Embedding store has {rows} rows, expected {base_rows}; it was changed by another writer")
+        if model and manifest.get("model") and manifest["model"] != model:
+            raise ValueError(f"Embedding store was written with model '{manifest['model']}', not '{model}'")
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        dim = manifest["dim"] if rows else int(vectors.shape[1])
+        if vectors.shape[1] != dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {dim}")
+        with open(self._path(manifest["vectors_file"]), "r+b") as f:
+            np.lib.format.read_magic(f)
+            np.lib.format.read_array_header_1_0(f)
+            if f.tell() != HEADER_BYTES:
+                return False
+            # The header never claims rows the file does not have: committed count first, then the data,
+            # then the grown count. Rows left by an interrupted append are overwritten.
+            f.seek(0)
+            f.write(_npy_header(rows, dim))
+            end = HEADER_BYTES + rows * dim * vectors.itemsize
+            f.truncate(end)
+            f.seek(end)
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+            f.seek(0)
+            f.write(_npy_header(rows + len(ids), dim))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._path(manifest["tickets_file"]), "r+b") as f:
+            f.truncate(manifest["tickets_bytes"])
+            f.seek(manifest["tickets_bytes"])
+            tickets_bytes = self._write_tickets(f, by_id, ids)
+        self._write_manifest(dict(manifest, rows=rows + len(ids), dim=dim, tickets_bytes=tickets_bytes))
+        logger.info(f"Appended {len(ids)} embeddings to {manifest['vectors_file']}")
+        return True
+
+
+def convert_json_store(json_path: str, store: EmbeddingStore, model: str = "") -> int:
+    """Convert a legacy `by_brand`/`by_id` JSON embedding file into the binary store."""
+    with open(json_path, "r") as f:
+        embeddings = json.load(f)
+    ids, rows = [], []
+    dim = 0
+    for ticket_id, ticket in embeddings.get("by_id", {}).items():
+        embedding = ticket.get("embedding") or []
+        if not dim:
+            dim = len(embedding)
+        if not embedding or len(embedding) != dim:
+            logger.warning(f"Skipping ticket {ticket_id} with invalid embedding of length {len(embedding)}")
+            continue
+        ids.append(ticket_id)
+        rows.append(embedding)
+    skipped = set(embeddings.get("by_id", {})) - set(ids)
+    for ticket_id in skipped:
+        embeddings["by_id"].pop(ticket_id, None)
+    embeddings["by_brand"] = {
+        brand: [ticket_id for ticket_id in ticket_ids if ticket_id not in skipped]
+        for brand, ticket_ids in embeddings.get("by_brand", {}).items()
+    }
+    vectors = np.asarray(rows, dtype=np.float32).reshape(len(rows), dim)
+    store.save(embeddings, ids, vectors, model=model)
+    logger.info(f"Converted {len(ids)} embeddings from {json_path}")
+    return len(ids)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert ticket_embeddings.json into the binary embedding store.")
+    parser.add_argument("json_path", nargs="?", default="ticket_embeddings.json")
+    parser.add_argument("--vectors", default="ticket_embeddings.npy")
+    parser.add_argument("--metadata", default="ticket_embeddings.meta.json")
+    parser.add_argument("--model", default="models/embedding-001")
+    args = parser.parse_args()
+    convert_json_store(args.json_path, EmbeddingStore(args.vectors, args.metadata), model=args.model)
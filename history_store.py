@@ -0,0 +1,233 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, List
+
+from bson import ObjectId
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from pymongo.errors import BulkWriteError
+
+from metrics import HISTORY_QUEUE_DEPTH, HISTORY_WRITE_ERRORS, HISTORY_WRITTEN
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def history_document(session_id: str, message: BaseMessage) -> dict:
+    """A `chat_history` document in the format MongoDBChatMessageHistory stores.
+
+    The _id is assigned here, when the message is produced, so that the order
+    on _id is the conversation order however late the document is written.
+    """
+    return {"_id": ObjectId(), "SessionId": session_id, "History": json.dumps(message_to_dict(message))}
+
+
+def to_chat_history(documents: List[dict]) -> List[dict]:
+    """Newest-first `chat_history` documents -> oldest-first [{"role", "content"}], skipping undecodable ones."""
+    history = []
+    for document in reversed(documents):
+        try:
+            message = messages_from_dict([json.loads(document["History"])])[0]
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping malformed chat history entry: {e}")
+            continue
+        history.append({"role": message.type, "content": message.content})
+    return history
+
+
+class HistoryWriter:
+    """Write-behind queue for `chat_history` documents.
+
+    `append` only enqueues; a background thread writes the queue with
+    `insert_many` once `batch_size` documents are waiting or `flush_seconds`
+    after the oldest one arrived. Failed batches are retried with backoff
+    (documents carry their _id, so a retry cannot duplicate them) and dropped
+    after `max_attempts`. `close` drains the queue; it runs at interpreter exit.
+    `collection` returns the collection to write to, borrowed at write time. The
+    thread starts on the first `append`, and again in a forked child process,
+    which also drops the queue it inherited (the parent writes those documents).
+    """
+
+    def __init__(self, collection: Callable[[], Any], batch_size: int = None, flush_seconds: float = None, max_attempts: int = 5):
+        self.collection = collection
+        self.batch_size = batch_size or int(os.getenv("HISTORY_BATCH_SIZE", "100"))
+        self.flush_seconds = flush_seconds if flush_seconds is not None else float(os.getenv("HISTORY_FLUSH_SECONDS", "0.5"))
+        self.max_attempts = max_attempts
+        self._queue = deque()
+        self._in_flight: List[dict] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        # When the oldest queued document arrived (monotonic clock)
+        self._oldest = 0.0
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        if self._pid is not None:
+            self._queue = deque()
+            self._in_flight = []
+            self._condition = threading.Condition()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def depth(self) -> int:
+        with self._condition:
+            return len(self._queue) + len(self._in_flight)
+
+    def append(self, documents: List[dict]):
+        self._ensure_thread()
+        with self._condition:
+            closed = self._closed
+            if not closed:
+                if not self._queue:
+                    self._oldest = time.monotonic()
+                self._queue.extend(documents)
+                HISTORY_QUEUE_DEPTH.set(len(self._queue) + len(self._in_flight))
+                # Wake the writer so the flush_seconds deadline of a new batch starts now
+                self._condition.notify()
+        if closed:
+            # Too late for the background thread; write inline instead of losing the messages
+            self._write(list(documents))
+
+    def pending(self, session_id: str) -> List[dict]:
+        """Documents of `session_id` not yet confirmed written, oldest first."""
+        with self._condition:
+            return [document for document in list(self._in_flight) + list(self._queue) if document["SessionId"] == session_id]
+
+    def _write(self, batch: List[dict]) -> bool:
+        try:
+            self.collection().insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Documents already written by an earlier attempt come back as duplicate keys
+            if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+                logger.warning(f"Chat history batch partially failed: {e}")
+                HISTORY_WRITE_ERRORS.inc(outcome="retried")
+                return False
+        except Exception as e:
+            logger.warning(f"Chat history batch of {len(batch)} failed: {e}")
+            HISTORY_WRITE_ERRORS.inc(outcome="retried")
+            return False
+        HISTORY_WRITTEN.inc(len(batch))
+        return True
+
+    def _next_batch(self) -> List[dict]:
+        """Block until a batch is due (or the writer is closed) and move it in flight."""
+        with self._condition:
+            while not self._closed and not self._flush_requested and len(self._queue) < self.batch_size:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+                remaining = self._oldest + self.flush_seconds - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._in_flight = batch
+            self._oldest = time.monotonic()
+            if not self._queue:
+                self._flush_requested = False
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+            for attempt in range(1, self.max_attempts + 1):
+                if self._write(batch):
+                    break
+                if attempt == self.max_attempts:
+                    logger.error(f"Dropping {len(batch)} chat history messages after {attempt} attempts")
+                    HISTORY_WRITE_ERRORS.inc(outcome="dropped")
+                else:
+                    time.sleep(min(0.1 * 2 ** attempt, 5.0))
+            with self._condition:
+                self._in_flight = []
+                HISTORY_QUEUE_DEPTH.set(len(self._queue))
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until everything queued so far is written; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._queue or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self._flush_requested = False
+        return True
+
+    def close(self, timeout: float = 10.0):
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        with self._condition:
+            if self._queue:
+                # The background thread could not drain in time (e.g. MongoDB is down)
+                logger.error(f"Chat history writer closed with {len(self._queue)} unwritten messages")
+
+
+class ChatHistoryStore:
+    """Bounded reader and write-behind writer for the `chat_history` collection.
+
+    `recent` fetches only the newest `limit` messages of a session (filter on
+    SessionId, sort on _id descending, limit) through the (SessionId, _id) index
+    declared in indexes.py, so a read costs O(limit) however long the session
+    is. Messages still in the write-behind queue are merged in, so a user always
+    sees their last turn.
+    `collection` and `async_collection` return the MongoClient and AsyncMongoClient
+    collections; they are called on every use so connections come from the current pool.
+    """
+
+    def __init__(self, collection: Callable[[], Any], async_collection: Callable[[], Any] = None, limit: int = None,
+                 writer: HistoryWriter = None):
+        self.collection = collection
+        self.async_collection = async_collection
+        self.limit = limit or int(os.getenv("CHAT_HISTORY_LIMIT", "10"))
+        self.writer = writer or HistoryWriter(collection)
+
+    def add_turn(self, session_id: str, message: str, response: str):
+        """Queue a user message and the reply to it; returns without waiting for MongoDB."""
+        self.writer.append([
+            history_document(session_id, HumanMessage(content=message)),
+            history_document(session_id, AIMessage(content=response))
+        ])
+
+    def _find(self, collection, session_id: str, limit: int):
+        return collection.find({"SessionId": session_id}, {"History": 1}).sort("_id", -1).limit(limit)
+
+    def _merge(self, session_id: str, documents: List[dict], limit: int) -> List[dict]:
+        pending = self.writer.pending(session_id)
+        if pending:
+            # A document in flight may already be in `documents`; keep one copy of each _id
+            merged = {document["_id"]: document for document in documents + pending}
+            documents = sorted(merged.values(), key=lambda document: document["_id"], reverse=True)[:limit]
+        return to_chat_history(documents)
+
+    def recent(self, session_id: str, limit: int = None) -> List[dict]:
+        limit = limit or self.limit
+        return self._merge(session_id, list(self._find(self.collection(), session_id, limit)), limit)
+
+    async def arecent(self, session_id: str, limit: int = None) -> List[dict]:
+        limit = limit or self.limit
+        documents = await self._find(self.async_collection(), session_id, limit).to_list(length=limit)
+        return self._merge(session_id, documents, limit)
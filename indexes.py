@@ -0,0 +1,125 @@
+import argparse
+import logging
+import sys
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+
+class IndexSpec(NamedTuple):
+    collection: str
+    keys: List[Tuple[str, int]]
+    name: str
+
+
+class QueryCheck(NamedTuple):
+    name: str
+    collection: str
+    # Builds the cursor to explain from the collection
+    cursor: Callable
+
+
+# Indexes the application's hot queries need, in every Ticketing_Platform database
+INDEXES = [
+    IndexSpec("Customers", [("username", ASCENDING)], "username_1"),
+    IndexSpec("chat_history", [("SessionId", ASCENDING), ("_id", DESCENDING)], "SessionId_1__id_-1"),
+    IndexSpec("tickets", [("query", ASCENDING)], "query_1")
+]
+
+# Representative shapes of the hot queries; the values do not need to exist
+QUERY_CHECKS = [
+    QueryCheck("customer by username", "Customers", lambda c: c.find({"username": "index-check"})),
+    QueryCheck("recent chat history", "chat_history",
+               lambda c: c.find({"SessionId": "index-check"}, {"History": 1}).sort("_id", -1).limit(10)),
+    QueryCheck("ticket by query", "tickets", lambda c: c.find({"query": "index-check"}))
+]
+
+
+class QueryPlanError(RuntimeError):
+    """A hot query is answered with a collection scan."""
+
+
+def ensure_indexes(db) -> List[str]:
+    """Create the declared indexes that are missing; returns the names created.
+
+    An existing index on the same keys counts as present whatever its name or
+    options, so running this at every startup is cheap and never conflicts.
+    """
+    created = []
+    by_collection: Dict[str, List[IndexSpec]] = {}
+    for spec in INDEXES:
+        by_collection.setdefault(spec.collection, []).append(spec)
+    for collection_name, specs in by_collection.items():
+        collection = db[collection_name]
+        existing = {tuple((field, int(direction)) for field, direction in info["key"])
+                    for info in collection.index_information().values()}
+        for spec in specs:
+            if tuple(spec.keys) in existing:
+                continue
+            collection.create_index(spec.keys, name=spec.name)
+            created.append(f"{collection_name}.{spec.name}")
+    if created:
+        logger.info(f"Created indexes: {', '.join(created)}")
+    return created
+
+
+def _plan_stages(plan) -> List[str]:
+    """Every stage name in an explain() plan tree (classic and slot-based engine formats)."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+def check_query_plans(db, raise_on_collscan: bool = True) -> Dict[str, List[str]]:
+    """explain() every hot query; returns {check name: winning plan stages}.
+
+    Raises QueryPlanError naming every query whose winning plan contains a
+    COLLSCAN, unless `raise_on_collscan` is False.
+    """
+    plans, scans = {}, []
+    for check in QUERY_CHECKS:
+        explained = check.cursor(db[check.collection]).explain()
+        stages = _plan_stages(explained.get("queryPlanner", {}).get("winningPlan", {}))
+        plans[check.name] = stages
+        if "COLLSCAN" in stages:
+            scans.append(f"{check.name} ({check.collection}: {' <- '.join(stages)})")
+        logger.info(f"Query plan for {check.name}: {' <- '.join(stages)}")
+    if scans and raise_on_collscan:
+        raise QueryPlanError(f"Collection scan in hot queries: {'; '.join(scans)}")
+    return plans
+
+
+def main():
+    from mongo import connections
+
+    parser = argparse.ArgumentParser(description="Create the Ticketing_Platform indexes and check the hot query plans.")
+    parser.add_argument("--check", action="store_true", help="explain() the hot queries and exit 1 on a COLLSCAN")
+    parser.add_argument("--no-create", action="store_true", help="do not create missing indexes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = connections.database()
+    if not args.no_create:
+        created = ensure_indexes(db)
+        print(f"Created {len(created)} indexes" + (f": {', '.join(created)}" if created else ""))
+    if args.check:
+        try:
+            plans = check_query_plans(db)
+        except QueryPlanError as e:
+            print(f"FAILED: {e}")
+            sys.exit(1)
+        for name, stages in plans.items():
+            print(f"ok  {name}: {' <- '.join(stages)}")
+
+
+if __name__ == "__main__":
+    main()
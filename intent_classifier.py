@@ -0,0 +1,152 @@
+import heapq
+import math
+import random
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+INTENTS = ("greeting", "query", "list_devices", "selection", "chat_history", "identity", "unknown")
+
+# Trailing punctuation a whole-message rule tolerates
+END = r"[ .!?,>'\"]*$"
+
+# High-precision patterns for the most frequent short messages; a match is final, so the open-ended
+# ones must cover the whole message ("ok but the screen still flickers" is not a greeting)
+RULES = [
+    ("greeting", re.compile(
+        r"^(h+i+|h+e+l+o+|hey+|hola|good (morning|afternoon|evening|night)|bye( bye)?|goodbye|see you|thanks?( you)?"
+        r"( for (your|the)? ?help(ing)?( me)?)?|how are you|what can you do|what is your task)"
+        r"( *[,.!?]* *(h+i+|hello|good (morning|afternoon|evening)|how are you|there|bot))*" + END
+    )),
+    ("chat_history", re.compile(r"\b(chat history|past (chat|conversation)s?|previous (chat|conversation)s?|in previous we talk)\b")),
+    ("list_devices", re.compile(
+        r"\b(list (of )?(my |all )?(laptops?|devices?|machines?)|my (laptop|device|machine) list|"
+        r"(laptop|device|machine) list|how many (laptops?|devices?|machines?))\b"
+    )),
+    ("identity", re.compile(
+        r"^(who are you|what are you|what is your name|your name|my name is|why you are|are you (an? )?(ai|bot|llm|human)|"
+        r"(you are )?llm model( of)?)" + END
+    ))
+]
+
+# Confirms a device choice; only consulted when the previous turn asked the user to pick a laptop
+SELECTION_RULE = re.compile(r"^(yes|yes that( one)?|that one|this one|the (first|second|third|last) one)" + END)
+
+# Labelled phrases for the nearest-neighbour model (the classification prompt's examples and close variants)
+EXAMPLES = {
+    "greeting": [
+        "hi", "hii", "hello", "hey there", "bye", "good morning", "thanks for helping me", "how are you",
+        "what can you help me with", "what is your task", "thank you"
+    ],
+    "query": [
+        "my dell laptop screen is flickering", "my laptop was not working", "laptop battery drains fast",
+        "keyboard not working", "wifi keeps disconnecting", "laptop overheating while gaming", "blue screen error",
+        "touchpad not responding", "charging port was not working", "camera not working in video calls",
+        "i have a problem in my dell laptop", "dell laptop having some issues", "my macbook was not working",
+        "hp pavilion specification and price", "my laptop has bluetooth issue"
+    ],
+    "list_devices": [
+        "list my devices", "can you know how many machines was there", "my device list is", "give me the my machine list",
+        "show my registered laptops", "which laptops do i have"
+    ],
+    "selection": ["select HP Pavilion", "yes that", "that one", "the second one"],
+    "chat_history": [
+        "can you send the past chat", "in previous we talk about which laptop", "show chat history",
+        "what did we talk about before"
+    ],
+    "identity": ["my name is", "why you are", "you are llm model of", "who are you", "what is your name", "who made you"],
+    "unknown": [
+        "my cow was not working", "suggest a gift for my baby boy", "my car was not working", "what is the weather today",
+        "recommend a movie", "how to cook pasta",
+        "what is my car name", "suggest a gift for my friend", "my car engine has some issues"
+    ]
+}
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def _features(text: str) -> Dict[str, float]:
+    """L2-normalised word unigrams and character trigrams (which absorb typos such as 'keybord')."""
+    words = TOKEN.findall(text.lower())
+    counts = Counter(f"w:{word}" for word in words)
+    for word in words:
+        padded = f" {word} "
+        counts.update(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    norm = math.sqrt(sum(value * value for value in counts.values()))
+    return {key: value / norm for key, value in counts.items()} if norm else {}
+
+
+def _dot(a: Dict[str, float], b: Dict[str, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(key, 0.0) for key, value in a.items())
+
+
+class IntentClassifier:
+    """Local intent classifier: rules first, then nearest neighbours over n-gram features.
+
+    `predict` returns (intent, confidence). Rule matches have confidence 1.0;
+    otherwise each intent scores the mean cosine similarity of its `k` closest
+    examples, and the confidence is the softmax probability of the best score
+    (scaled by 1 / `temperature`), so callers can fall back to the LLM for
+    ambiguous messages. Intents in the same `groups` entry are handled alike by
+    the caller, so their probabilities are pooled into the confidence.
+    Confirmations such as "yes" or "that one" are only read as a selection when
+    `awaiting_selection` says the bot has just asked which laptop. Each intent
+    keeps at most `max_examples` examples (a uniform sample of everything added,
+    reproducible through `seed`), so `predict` costs the same however many
+    ticket queries are added.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]] = None, k: int = 3, temperature: float = 0.05,
+                 groups: Iterable[Iterable[str]] = (("query", "unknown"),), max_examples: int = 500, seed: int = 0):
+        self.k = k
+        self.temperature = temperature
+        self.groups = [set(group) for group in groups]
+        self.max_examples = max_examples
+        self._features: Dict[str, List[Dict[str, float]]] = {}
+        self._seen: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        for intent, texts in (examples or EXAMPLES).items():
+            self.add_examples(intent, texts)
+
+    def add_examples(self, intent: str, texts: Iterable[str]):
+        """Add labelled phrases, e.g. historical ticket queries for 'query'."""
+        features = [f for f in (_features(text) for text in texts if text and text.strip()) if f]
+        with self._lock:
+            kept = list(self._features.get(intent, []))
+            seen = self._seen.get(intent, 0)
+            for feature in features:
+                # Reservoir sampling: every example added so far is kept with the same probability
+                if len(kept) < self.max_examples:
+                    kept.append(feature)
+                else:
+                    slot = self._random.randrange(seen + 1)
+                    if slot < self.max_examples:
+                        kept[slot] = feature
+                seen += 1
+            self._features[intent] = kept
+            self._seen[intent] = seen
+
+    def predict(self, message: str, awaiting_selection: bool = False) -> Tuple[str, float]:
+        text = " ".join(message.lower().split())
+        if awaiting_selection and SELECTION_RULE.search(text):
+            return "selection", 1.0
+        for intent, pattern in RULES:
+            if pattern.search(text):
+                return intent, 1.0
+        features = _features(text)
+        with self._lock:
+            examples = {intent: vectors for intent, vectors in self._features.items() if vectors}
+        if not features or not examples:
+            return "unknown", 0.0
+        scores = {}
+        for intent, vectors in examples.items():
+            nearest = heapq.nlargest(self.k, (_dot(features, vector) for vector in vectors))
+            scores[intent] = sum(nearest) / len(nearest)
+        best = max(scores, key=scores.get)
+        weights = {intent: math.exp((score - scores[best]) / self.temperature) for intent, score in scores.items()}
+        group = next((group for group in self.groups if best in group), {best})
+        return best, round(sum(weights.get(intent, 0.0) for intent in group) / sum(weights.values()), 3)
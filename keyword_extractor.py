@@ -0,0 +1,150 @@
+import logging
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-.+][a-z0-9]+)*")
+
+STOPWORDS = {
+    "a", "about", "after", "again", "all", "also", "am", "an", "and", "any", "are", "as", "at", "be", "been",
+    "before", "being", "but", "by", "can", "cannot", "could", "did", "do", "does", "doing", "don't", "down",
+    "during", "each", "for", "from", "get", "gets", "getting", "got", "had", "has", "have", "having", "help",
+    "how", "i", "if", "in", "into", "is", "it", "its", "just", "keeps", "laptop", "me", "more", "my", "need",
+    "no", "not", "now", "of", "on", "once", "only", "or", "other", "our", "out", "please", "problem", "so",
+    "some", "still", "than", "that", "the", "their", "them", "then", "there", "these", "they", "this", "to",
+    "too", "up", "very", "was", "we", "were", "what", "when", "where", "which", "while", "why", "will", "with",
+    "won't", "would", "you", "your"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def content_terms(text: str) -> List[str]:
+    """Tokens of `text` with stopwords removed, in order of appearance."""
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+
+class KeywordExtractor:
+    """Deterministic brand/keyword extraction for support queries.
+
+    Brands come from the RAG `brand_keywords` table and from registered laptop
+    names/models; the technical vocabulary is mined from historical ticket
+    queries. `extract` also reports a confidence in [0, 1] so callers can fall
+    back to the LLM when the query is mostly outside the known vocabulary.
+    """
+
+    def __init__(self, brand_keywords: Dict[str, List[str]], ticket_queries: Iterable[str] = (), laptop_models: Iterable[Tuple[str, str]] = ()):
+        self.brand_keywords = brand_keywords
+        self._brand_patterns = [
+            (brand, re.compile(r"\b" + re.escape(keyword) + r"\b"))
+            for brand, keywords in brand_keywords.items()
+            for keyword in keywords
+        ]
+        self.vocabulary = Counter()
+        self.laptop_models: Dict[str, str] = {}
+        self._max_model_tokens = 0
+        self._lock = threading.Lock()
+        self.add_queries(ticket_queries)
+        self.set_laptop_models(laptop_models)
+
+    def add_queries(self, queries: Iterable[str]):
+        """Grow the technical vocabulary with terms from ticket queries."""
+        counts = Counter()
+        for query in queries:
+            counts.update(set(content_terms(query)))
+        brand_terms = {keyword for keywords in self.brand_keywords.values() for keyword in keywords}
+        for term in brand_terms:
+            counts.pop(term, None)
+        with self._lock:
+            self.vocabulary.update(counts)
+
+    def set_laptop_models(self, laptop_models: Iterable[Tuple[str, str]]):
+        """Replace the known laptops, given as (name, model) pairs.
+
+        Both the name and the model string are recognised on their own and map
+        to the brand detected in the laptop name (or 'Unknown'). They are matched
+        as whole token sequences by dictionary lookup, so `extract` costs the
+        same however many laptops are registered.
+        """
+        models = {}
+        for name, model in laptop_models:
+            name = " ".join(tokenize(name or ""))
+            model = " ".join(tokenize(model or ""))
+            brand = self._detect_brand(f"{name} {model}")
+            for phrase in (name, model):
+                if phrase:
+                    models[phrase] = brand
+        max_tokens = max((phrase.count(" ") + 1 for phrase in models), default=0)
+        with self._lock:
+            self.laptop_models = models
+            self._max_model_tokens = max_tokens
+
+    def ticket_keywords(self, query: str) -> List[str]:
+        """Keywords stored with a ticket at ingest time: its distinct content terms."""
+        return list(dict.fromkeys(content_terms(query)))
+
+    def _detect_brand(self, text: str) -> str:
+        for brand, pattern in self._brand_patterns:
+            if pattern.search(text):
+                return brand
+        return "Unknown"
+
+    def extract(self, query: str) -> Tuple[str, str, List[str], float]:
+        """Return (processed_query, brand, keywords, confidence) for a user query."""
+        normalized = " ".join(tokenize(query))
+        brand = self._detect_brand(normalized)
+
+        keywords = []
+        with self._lock:
+            models, max_tokens = self.laptop_models, self._max_model_tokens
+        tokens = normalized.split()
+        for size in range(1, min(max_tokens, len(tokens)) + 1):
+            for start in range(len(tokens) - size + 1):
+                model = " ".join(tokens[start:start + size])
+                if model in models and model not in keywords:
+                    keywords.append(model)
+        for model in keywords:
+            if brand == "Unknown":
+                brand = models[model]
+
+        processed_query = normalized
+        for _, pattern in self._brand_patterns:
+            processed_query = pattern.sub(" ", processed_query)
+        processed_query = " ".join(processed_query.split()) or query.lower()
+
+        terms = content_terms(processed_query)
+        known = [term for term in terms if term in self.vocabulary]
+        for term in known:
+            if term not in keywords:
+                keywords.append(term)
+
+        coverage = len(known) / len(terms) if terms else 0.0
+        confidence = 0.7 * coverage + (0.3 if brand != "Unknown" else 0.0)
+        return processed_query, brand, keywords, round(confidence, 3)
+
+
+class KeywordIndex:
+    """Inverted index from keyword term to the ids of tickets containing it."""
+
+    def __init__(self):
+        self._postings: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+    def add(self, ticket_id: str, keywords: Iterable[str]):
+        with self._lock:
+            for keyword in keywords:
+                self._postings.setdefault(keyword, set()).add(ticket_id)
+
+    def lookup(self, keywords: Iterable[str]) -> set:
+        """Ids of tickets sharing at least one term with `keywords`."""
+        terms = {term for keyword in keywords for term in content_terms(keyword)}
+        with self._lock:
+            return set().union(*(self._postings.get(term, ()) for term in terms))
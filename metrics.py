@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else f"{int(value)}"
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. a queue depth."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            for bound, count in zip(self.buckets, values):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {values[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+CHAT_MESSAGES = REGISTRY.register(Counter(
+    "chatbot_messages_total", "Chat messages handled.", ["mode"]))
+CHAT_MESSAGE_ERRORS = REGISTRY.register(Counter(
+    "chatbot_message_errors_total", "Chat messages that failed with an unhandled error.", ["mode"]))
+CHAT_MESSAGE_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_message_duration_seconds", "End-to-end time to handle a chat message.", ["mode"]))
+
+NODE_CALLS = REGISTRY.register(Counter(
+    "chatbot_node_calls_total", "LangGraph node executions.", ["node"]))
+NODE_ERRORS = REGISTRY.register(Counter(
+    "chatbot_node_errors_total", "LangGraph node executions that raised.", ["node"]))
+NODE_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_node_duration_seconds", "LangGraph node execution time.", ["node"]))
+INTENT_DECISIONS = REGISTRY.register(Counter(
+    "chatbot_intent_decisions_total", "Intent classifications by decision source (bypass, local or llm).", ["source"]))
+RESPONSE_POOL_LOOKUPS = REGISTRY.register(Counter(
+    "chatbot_response_pool_lookups_total", "Response pool lookups; a miss falls back to live generation.", ["key", "outcome"]))
+PROFILE_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "chatbot_profile_cache_lookups_total", "Customer profile cache lookups; a miss reads MongoDB.", ["outcome"]))
+CONVERSATION_STATE_LOOKUPS = REGISTRY.register(Counter(
+    "chatbot_conversation_state_lookups_total", "Previous-turn state lookups by source (memory, mongo, miss).", ["outcome"]))
+
+HISTORY_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "chat_history_queue_depth", "Chat history messages waiting to be written to MongoDB."))
+HISTORY_WRITTEN = REGISTRY.register(Counter(
+    "chat_history_written_total", "Chat history messages written by the write-behind queue."))
+HISTORY_WRITE_ERRORS = REGISTRY.register(Counter(
+    "chat_history_write_errors_total", "Failed chat history batch writes (retried) and dropped batches.", ["outcome"]))
+
+LLM_CALLS = REGISTRY.register(Counter(
+    "llm_requests_total", "Generation and embedding requests sent to the LLM backend.", ["backend", "operation"]))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "llm_request_errors_total", "LLM backend requests that failed.", ["backend", "operation"]))
+LLM_SECONDS = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds", "LLM backend request time (streams until the last chunk).", ["backend", "operation"]))
+LLM_PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "llm_prompt_tokens", "Estimated prompt size of generation requests.", ["backend"], buckets=TOKEN_BUCKETS))
+LLM_RESPONSE_TOKENS = REGISTRY.register(Histogram(
+    "llm_response_tokens", "Estimated response size of generation requests.", ["backend"], buckets=TOKEN_BUCKETS))
+LLM_EMBEDDED_TEXTS = REGISTRY.register(Counter(
+    "llm_embedded_texts_total", "Texts sent for embedding.", ["backend"]))
+
+MONGO_COMMANDS = REGISTRY.register(Counter(
+    "mongo_commands_total", "MongoDB commands sent.", ["command", "database"]))
+MONGO_ERRORS = REGISTRY.register(Counter(
+    "mongo_command_errors_total", "MongoDB commands that failed.", ["command", "database"]))
+MONGO_SECONDS = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round-trip time.", ["command", "database"]))
+MONGO_POOL_CONNECTIONS = REGISTRY.register(Gauge(
+    "mongo_pool_connections", "MongoDB pool connections, open and checked out.", ["client", "address", "state"]))
+MONGO_POOL_CHECKOUTS = REGISTRY.register(Counter(
+    "mongo_pool_checkouts_total", "MongoDB pool connection checkouts by outcome.", ["client", "outcome"]))
+MONGO_POOL_WAIT_SECONDS = REGISTRY.register(Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool.", ["client"]))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener feeding the mongo_* metrics; applies to sync and async clients."""
+
+    def started(self, event):
+        pass
+
+    def _finish(self, event, failed: bool):
+        labels = {"command": event.command_name, "database": event.database_name}
+        MONGO_COMMANDS.inc(**labels)
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, **labels)
+        if failed:
+            MONGO_ERRORS.inc(**labels)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+
+# Registered globally so every MongoClient created after this import reports commands
+monitoring.register(MongoCommandMetrics())
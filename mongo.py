@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict
+
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+
+from metrics import MONGO_POOL_CHECKOUTS, MONGO_POOL_CONNECTIONS, MONGO_POOL_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_URI = "mongodb://localhost:27017"
+DEFAULT_DATABASE = "Ticketing_Platform"
+
+
+def client_options() -> dict:
+    """Pool sizing and timeouts shared by the sync and async clients, overridable from the environment."""
+    return {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "2")),
+        "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+        # Fail fast instead of queueing requests behind an exhausted pool or an unreachable server
+        "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+        "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        "retryWrites": True,
+        "appname": "ticketing-chatbot"
+    }
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool utilisation per server, fed to the mongo_pool_* metrics."""
+
+    def __init__(self, client_name: str, max_pool_size: int):
+        self.client_name = client_name
+        self.max_pool_size = max_pool_size
+        self._pools: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, address) -> dict:
+        key = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = {"open": 0, "in_use": 0, "peak_in_use": 0, "checkouts": 0, "failed_checkouts": 0}
+        return pool
+
+    def _update(self, event, **deltas):
+        with self._lock:
+            pool = self._pool(event.address)
+            for field, delta in deltas.items():
+                pool[field] += delta
+            pool["peak_in_use"] = max(pool["peak_in_use"], pool["in_use"])
+            address = f"{event.address[0]}:{event.address[1]}"
+            MONGO_POOL_CONNECTIONS.set(pool["open"], client=self.client_name, address=address, state="open")
+            MONGO_POOL_CONNECTIONS.set(pool["in_use"], client=self.client_name, address=address, state="in_use")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._update(event, failed_checkouts=1)
+        MONGO_POOL_CHECKOUTS.inc(client=self.client_name, outcome=f"failed_{event.reason}")
+
+    def connection_checked_out(self, event):
+        self._update(event, in_use=1, checkouts=1)
+        MONGO_POOL_CHECKOUTS.inc(client=self.client_name, outcome="ok")
+        if getattr(event, "duration", None) is not None:
+            MONGO_POOL_WAIT_SECONDS.observe(event.duration, client=self.client_name)
+
+    def connection_checked_in(self, event):
+        self._update(event, in_use=-1)
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            return {
+                address: dict(pool, max_pool_size=self.max_pool_size,
+                              utilization=round(pool["in_use"] / self.max_pool_size, 3) if self.max_pool_size else 0.0)
+                for address, pool in self._pools.items()
+            }
+
+
+class MongoConnections:
+    """Process-wide MongoDB clients shared by the web app, the chatbot, RAG and the history store.
+
+    Clients are created on first use with the pool options from `client_options`
+    and re-created in a child process after a fork (pymongo clients are not
+    fork-safe), so pre-forking servers can import the app before forking. Callers
+    should borrow collections through `database()` at use time instead of
+    keeping collection objects from another process. `wrap` adapts existing
+    clients (e.g. mongomock in the benchmark) to the same interface; a wrapped
+    manager never opens connections of its own, so the async path needs its own
+    wrapped `async_client`.
+    """
+
+    def __init__(self, uri: str = None, database_name: str = None):
+        self.uri = uri or os.getenv("MONGO_URI", DEFAULT_URI)
+        self.database_name = database_name or os.getenv("MONGO_DATABASE", DEFAULT_DATABASE)
+        self._client = None
+        self._async_client = None
+        self._fixed_client = None
+        self._fixed_async_client = None
+        self._pool_stats: Dict[str, PoolStats] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def wrap(cls, client, async_client=None, database_name: str = None) -> "MongoConnections":
+        connections = cls(database_name=database_name)
+        connections._fixed_client = client
+        connections._fixed_async_client = async_client
+        return connections
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Sockets inherited from the parent must not be used (or closed) here; start over
+            self._pid = os.getpid()
+            self._client = None
+            self._async_client = None
+            self._pool_stats = {}
+            self._lock = threading.Lock()
+            logger.info("Fork detected, MongoDB clients will be re-created")
+
+    def _listener(self, name: str, options: dict) -> PoolStats:
+        self._pool_stats[name] = PoolStats(name, options["maxPoolSize"])
+        return self._pool_stats[name]
+
+    def client(self) -> MongoClient:
+        if self._fixed_client is not None:
+            return self._fixed_client
+        self._check_fork()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    options = client_options()
+                    self._client = MongoClient(self.uri, event_listeners=[self._listener("sync", options)], **options)
+                    logger.info(f"MongoDB client created (maxPoolSize={options['maxPoolSize']})")
+        return self._client
+
+    def async_client(self) -> AsyncMongoClient:
+        """The AsyncMongoClient; it binds to the event loop that first uses it."""
+        if self._fixed_async_client is not None:
+            return self._fixed_async_client
+        if self._fixed_client is not None:
+            # Connecting to `uri` here would split reads and writes across two databases
+            raise RuntimeError("No async client was wrapped with this MongoDB client; pass async_client to wrap()")
+        self._check_fork()
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    options = client_options()
+                    self._async_client = AsyncMongoClient(self.uri, event_listeners=[self._listener("async", options)], **options)
+        return self._async_client
+
+    def database(self):
+        return self.client()[self.database_name]
+
+    def async_database(self):
+        return self.async_client()[self.database_name]
+
+    def stats(self) -> Dict[str, Dict[str, dict]]:
+        """Pool utilisation per client ("sync"/"async") and server address."""
+        return {name: stats.stats() for name, stats in self._pool_stats.items()}
+
+    def _detach(self):
+        with self._lock:
+            client, async_client = self._client, self._async_client
+            self._client = None
+            self._async_client = None
+            self._pool_stats = {}
+        return client, async_client
+
+    def close(self):
+        """Close the clients this manager opened; inside an event loop the async client is closed in a task."""
+        client, async_client = self._detach()
+        if client is not None:
+            client.close()
+        if async_client is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            loop.create_task(async_client.close())
+            return
+        try:
+            asyncio.run(async_client.close())
+        except Exception as e:
+            logger.warning(f"Failed to close async MongoDB client: {e}")
+
+    async def aclose(self):
+        """Close the clients this manager opened, awaiting the async client on the loop it is bound to."""
+        client, async_client = self._detach()
+        if async_client is not None:
+            await async_client.close()
+        if client is not None:
+            client.close()
+
+
+connections = MongoConnections()
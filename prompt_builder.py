@@ -0,0 +1,139 @@
+import html
+import logging
+import os
+import re
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Characters per token for Gemini-style tokenizers on English text; good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+# Input budgets (prompt template included) per prompt, overridable with PROMPT_BUDGET_<NAME>
+DEFAULT_BUDGETS = {
+    "classify_intent": 600,
+    "greeting": 400,
+    "extract_keywords": 350,
+    "rag_response": 1000
+}
+
+MIN_TEXT_TOKENS = 32
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text or "") // CHARS_PER_TOKEN)
+
+
+def strip_html(text: str) -> str:
+    """Plain text of an HTML fragment: list items and breaks become separators, tags are dropped."""
+    text = re.sub(r"<\s*(br|/li|/p|/div|/ol|/ul)\s*/?>", "; ", text or "", flags=re.IGNORECASE)
+    text = html.unescape(TAG_PATTERN.sub(" ", text))
+    text = re.sub(r"\s*;\s*(;\s*)*", "; ", text)
+    return " ".join(text.split()).strip("; ")
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to about `max_tokens`, at a word boundary, marking the cut with an ellipsis."""
+    max_chars = max(0, max_tokens) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - 1)]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut + "…"
+
+
+class PromptBuilder:
+    """Fits prompts to per-prompt token budgets.
+
+    Context is cleaned first (HTML stripped, duplicates dropped, long answers and
+    history messages capped), then, while the rendered prompt is over budget,
+    the lowest-ranked tickets are dropped, then the chat history, and finally
+    the user text is truncated.
+    """
+
+    def __init__(self, budgets: Dict[str, int] = None, answer_tokens: int = 60, history_tokens: int = 100,
+                 history_messages: int = 2, max_keywords: int = 12):
+        self.budgets = dict(DEFAULT_BUDGETS)
+        self.budgets.update(budgets or {})
+        for name in self.budgets:
+            override = os.getenv(f"PROMPT_BUDGET_{name.upper()}")
+            if override:
+                self.budgets[name] = int(override)
+        self.answer_tokens = answer_tokens
+        self.history_tokens = history_tokens
+        self.history_messages = history_messages
+        self.max_keywords = max_keywords
+
+    def budget(self, name: str) -> int:
+        return self.budgets.get(name, int(os.getenv("PROMPT_TOKEN_BUDGET", "1500")))
+
+    def clean_tickets(self, similar_data: list) -> List[dict]:
+        tickets, seen_tickets = [], set()
+        for item in similar_data or []:
+            answers, seen_answers = [], set()
+            for answer in item.get("answers", []):
+                answer = truncate_tokens(strip_html(str(answer)), self.answer_tokens)
+                key = answer.lower().rstrip(".")
+                if answer and key not in seen_answers:
+                    seen_answers.add(key)
+                    answers.append(answer)
+            query = strip_html(str(item.get("query", "")))
+            key = (query.lower(), tuple(answer.lower() for answer in answers))
+            if key in seen_tickets:
+                continue
+            seen_tickets.add(key)
+            tickets.append({"ticket_id": item.get("ticket_id"), "query": query, "answers": answers})
+        return tickets
+
+    def clean_history(self, chat_history: list) -> List[dict]:
+        history = []
+        for message in (chat_history or [])[-self.history_messages:]:
+            content = message.get("content", "")
+            if "Found similar issues" in content:
+                # Earlier retrieval answers are ticket listings; the ticket context is rebuilt anyway
+                content = "Provided solutions for a laptop issue."
+            history.append({"role": message.get("role"), "content": truncate_tokens(strip_html(content), self.history_tokens)})
+        return history
+
+    def clean_keywords(self, keywords: list) -> List[str]:
+        return list(dict.fromkeys(str(keyword).lower() for keyword in keywords or []))[:self.max_keywords]
+
+    def fit(self, name: str, render: Callable[..., str], text_field: str, **context) -> str:
+        """Render a prompt with `render(**context)`, trimming `context` until it fits the budget for `name`.
+
+        Recognised context entries are `similar_data`, `chat_history` and `keywords`;
+        `text_field` names the free-text entry (query or message) truncated last.
+        """
+        budget = self.budget(name)
+        before = estimate_tokens(render(**context))
+        if "similar_data" in context:
+            context["similar_data"] = self.clean_tickets(context["similar_data"])
+        if "chat_history" in context:
+            context["chat_history"] = self.clean_history(context["chat_history"])
+        if "keywords" in context:
+            context["keywords"] = self.clean_keywords(context["keywords"])
+        prompt = render(**context)
+        while estimate_tokens(prompt) > budget and len(context.get("similar_data") or []) > 1:
+            context["similar_data"] = context["similar_data"][:-1]
+            prompt = render(**context)
+        if estimate_tokens(prompt) > budget and context.get("chat_history"):
+            context["chat_history"] = []
+            prompt = render(**context)
+        over = estimate_tokens(prompt) - budget
+        if over > 0:
+            # Never cut the user's own text below MIN_TEXT_TOKENS, even if that leaves the prompt over budget
+            text = context[text_field]
+            context[text_field] = truncate_tokens(text, max(MIN_TEXT_TOKENS, estimate_tokens(text) - over))
+            prompt = render(**context)
+        after = estimate_tokens(prompt)
+        if after < before:
+            logger.info(f"Prompt '{name}' trimmed from ~{before} to ~{after} tokens (budget {budget})")
+        else:
+            logger.debug(f"Prompt '{name}' is ~{after} tokens (budget {budget})")
+        return prompt
+
+
+prompt_builder = PromptBuilder()
@@ -1,28 +1,53 @@
+import asyncio
 import json
 import os
 import logging
-from pymongo import MongoClient
-import google.generativeai as genai
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from pymongo import MongoClient
 from typing import List, Tuple, Dict
+from vector_index import VectorIndex, normalize_rows
+from ann_index import IVFIndex
+from embedding_store import EmbeddingStore, convert_json_store
+from embedding_batcher import EmbeddingBatcher
+from cache import QueryEmbeddingCache, SemanticResponseCache
+from keyword_extractor import KeywordExtractor, KeywordIndex
+from bm25 import BM25Index, reciprocal_rank_fusion
+from streaming import emit, generate_text, agenerate_text, complete_text, acomplete_text
+from singleflight import upstream_calls, async_upstream_calls
+from prompt_builder import prompt_builder
+from backends import LLMBackend, get_backend, instrumented
+from mongo import MongoConnections, connections
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY", ""))
-chat_model = genai.GenerativeModel('gemini-2.5-flash-lite-preview-06-17')
+GENERATION_ERROR = "Error generating response. Please try again."
 
 class RAGSystem:
-    def __init__(self):
+    def __init__(self, client: MongoClient = None, backend: LLMBackend = None, mongo: MongoConnections = None):
         try:
-            self.client = MongoClient("localhost", 27017)
-            self.db = self.client["Ticketing_Platform"]
-            self.tickets_collection = self.db["tickets"]
-            self.embedding_file = "ticket_embeddings.json"
-            self.embedding_model = "models/embedding-001"
+            self.backend = instrumented(backend or get_backend())
+            self.mongo = mongo or (MongoConnections.wrap(client) if client is not None else connections)
+            self.embedding_file = "ticket_embeddings.json"  # Legacy format, converted on first start
+            self.embedding_store = EmbeddingStore("ticket_embeddings.npy", "ticket_embeddings.meta.json")
+            self.embedding_model = self.backend.embedding_model
+            self.embedding_batcher = EmbeddingBatcher(
+                self._embed_batch,
+                batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "100")),
+                max_workers=int(os.getenv("EMBEDDING_WORKERS", "4"))
+            )
+            self.query_embedding_cache = QueryEmbeddingCache(
+                max_size=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000")),
+                persist_path=os.getenv("QUERY_EMBEDDING_CACHE_FILE") or None
+            )
+            self.response_cache = SemanticResponseCache(
+                similarity_threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95")),
+                ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+                max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+            )
             self.brand_keywords = {
                 "Apple": ["macbook", "apple", "mac"],
                 "HP": ["hp", "pavilion"],
@@ -34,39 +59,114 @@ class RAGSystem:
                 "Samsung": ["samsung", "galaxy book"],
                 "MSI": ["msi", "prestige"]
             }
+            self._sync_lock = threading.Lock()
+            self._unindexable_ids = set()
+            self._sync_stop = threading.Event()
+            self._sync_thread = None
+            self.keyword_confidence_threshold = float(os.getenv("KEYWORD_CONFIDENCE_THRESHOLD", "0.5"))
+            self.keyword_extractor = KeywordExtractor(self.brand_keywords)
+            self.keyword_index = KeywordIndex()
+            self.bm25_index = BM25Index()
+            self.retrieval_mode = os.getenv("RAG_RETRIEVAL_MODE", "dense").lower()
+            if self.retrieval_mode not in ("dense", "hybrid", "lexical"):
+                logger.warning(f"Unknown retrieval mode '{self.retrieval_mode}', using dense")
+                self.retrieval_mode = "dense"
+            self.lexical_threshold = float(os.getenv("RAG_LEXICAL_THRESHOLD", "0.6"))
+            self.embedding_timeout = float(os.getenv("RAG_EMBEDDING_TIMEOUT", "2"))
+            self._embedding_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embedding")
+            self.vector_quantization = os.getenv("RAG_VECTOR_QUANTIZATION", "none").lower()
+            self.ann_engine = os.getenv("RAG_ANN_ENGINE", "").lower()
+            self.ann_index_file = "ticket_embeddings.ivf.npz"
+            self.ann_index = None
             self._load_or_generate_embeddings()
+            self._load_or_build_ann_index()
+            self.keyword_extractor.add_queries(ticket["query"] for ticket in self.embeddings["by_id"].values())
+            self._build_keyword_index()
+            self._build_lexical_index()
+            self._refresh_laptop_models()
+            self.sync_embeddings()
+            self.start_sync_scheduler(float(os.getenv("EMBEDDING_SYNC_INTERVAL", "300")))
             logger.info("RAGSystem initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize RAGSystem: {e}")
             raise
 
+    @property
+    def client(self) -> MongoClient:
+        return self.mongo.client()
+
+    @property
+    def db(self):
+        return self.mongo.database()
+
+    @property
+    def tickets_collection(self):
+        return self.db["tickets"]
+
+    @property
+    def customers_collection(self):
+        return self.db["Customers"]
+
+    def _refresh_laptop_models(self):
+        """Load registered laptop names and models from Customers into the keyword extractor."""
+        try:
+            models = set()
+            for customer in self.customers_collection.find({}, {"laptops.name": 1, "laptops.model": 1}):
+                for laptop in customer.get("laptops", []):
+                    if isinstance(laptop, dict) and isinstance(laptop.get("name"), str) and isinstance(laptop.get("model"), str):
+                        models.add((laptop["name"], laptop["model"]))
+            self.keyword_extractor.set_laptop_models(models)
+            logger.info(f"Loaded {len(models)} laptop models for keyword extraction")
+        except Exception as e:
+            logger.warning(f"Failed to load laptop models for keyword extraction: {e}")
+
     def _extract_keywords(self, query: str) -> Tuple[str, str, List[str]]:
+        """Extract keywords locally, consulting the LLM only when the local extractor has low confidence."""
+        processed_query, brand, keywords, confidence = self.keyword_extractor.extract(query)
+        if confidence >= self.keyword_confidence_threshold:
+            logger.debug(f"Local keyword extraction for '{query}' (confidence {confidence})")
+            return processed_query, brand, keywords
+        logger.info(f"Low keyword extraction confidence ({confidence}) for '{query}', falling back to LLM")
+        return self._extract_keywords_llm(query)
+
+    def _keyword_prompt(self, query: str) -> str:
+        return prompt_builder.fit("extract_keywords", self._render_keyword_prompt, "query", query=query)
+
+    @staticmethod
+    def _render_keyword_prompt(query: str) -> str:
+        return (
+            f"""You are an AI assistant for a laptop support platform. 
+            Given the query: '{query}'
+            Task: Extract key technical terms, brand names, and issue-related keywords.
+            Return a JSON object with:
+            - 'processed_query': cleaned query without brand keywords
+            - 'brand': detected brand name or 'Unknown'
+            - 'keywords': list of relevant technical terms and issues
+            Ensure no context is lost and keywords are specific to laptop issues.
+            Example output:
+            {{
+                "processed_query": "screen flickering issue",
+                "brand": "Dell",
+                "keywords": ["screen", "flickering", "display", "issue"]
+            }}
+            """
+        )
+
+    @staticmethod
+    def _parse_keywords(text: str, query: str) -> Tuple[str, str, List[str]]:
+        result = json.loads(text.strip())
+        return (
+            result.get("processed_query", query.lower()),
+            result.get("brand", "Unknown"),
+            result.get("keywords", [])
+        )
+
+    def _extract_keywords_llm(self, query: str) -> Tuple[str, str, List[str]]:
         """Extract keywords from query using LLM while preserving context."""
         try:
-            prompt = (
-                f"""You are an AI assistant for a laptop support platform. 
-                Given the query: '{query}'
-                Task: Extract key technical terms, brand names, and issue-related keywords.
-                Return a JSON object with:
-                - 'processed_query': cleaned query without brand keywords
-                - 'brand': detected brand name or 'Unknown'
-                - 'keywords': list of relevant technical terms and issues
-                Ensure no context is lost and keywords are specific to laptop issues.
-                Example output:
-                {
-                    "processed_query": "screen flickering issue",
-                    "brand": "Dell",
-                    "keywords": ["screen", "flickering", "display", "issue"]
-                }
-                """
-            )
-            response = chat_model.generate_content(prompt)
-            result = json.loads(response.text.strip())
-            return (
-                result.get("processed_query", query.lower()),
-                result.get("brand", "Unknown"),
-                result.get("keywords", [])
-            )
+            prompt = self._keyword_prompt(query)
+            text = complete_text(self.backend, prompt)
+            return self._parse_keywords(text, query)
         except Exception as e:
             logger.error(f"Failed to extract keywords for query '{query}': {e}")
             return query.lower(), "Unknown", []
@@ -74,91 +174,120 @@ class RAGSystem:
     def _generate_embedding(self, text: str) -> list:
         try:
             logger.debug(f"Generating embedding for text: {text[:50]}...")
-            result = genai.embed_content(model=self.embedding_model, content=text, task_type="retrieval_document")
-            return result["embedding"]
+            embedding, shared = upstream_calls.do(
+                ("embed", self.embedding_model, text),
+                lambda: self.backend.embed(text)
+            )
+            if shared:
+                logger.debug(f"Shared in-flight embedding for text: {text[:50]}...")
+            return embedding
         except Exception as e:
             logger.error(f"Failed to generate embedding for text '{text[:50]}...': {e}")
             return []
 
+    def _embed_query(self, query: str) -> list:
+        """Embed a search query, serving repeated phrasings from the query embedding cache."""
+        embedding = self.query_embedding_cache.get(query, self.embedding_model)
+        if embedding is not None:
+            logger.debug(f"Query embedding cache hit for: {query[:50]}")
+            return embedding
+        embedding = self._generate_embedding(query)
+        self.query_embedding_cache.put(query, self.embedding_model, embedding)
+        return embedding
+
+    def _embed_batch(self, texts: List[str]) -> List[list]:
+        """Embed several texts with one multi-text backend request."""
+        return self.backend.embed(texts)
+
     def _batch_generate_embeddings(self, texts: List[str]) -> List[list]:
         """Generate embeddings for multiple texts in batch."""
         try:
-            embeddings = []
-            for text in texts:
-                embedding = self._generate_embedding(text)
-                embeddings.append(embedding)
-            return embeddings
+            return self.embedding_batcher.embed(texts)
         except Exception as e:
             logger.error(f"Failed to generate batch embeddings: {e}")
             return [[] for _ in texts]
 
+    def _response_prompt(self, query: str, similar_data: list = None, chat_history: list = None, keywords: List[str] = None) -> str:
+        return prompt_builder.fit(
+            "rag_response", self._render_response_prompt, "query",
+            query=query, similar_data=similar_data, chat_history=chat_history, keywords=keywords
+        )
+
+    @staticmethod
+    def _render_response_prompt(query: str, similar_data: list = None, chat_history: list = None, keywords: List[str] = None) -> str:
+        if similar_data:
+            similar_text = "\n".join([
+                f"Ticket ID: {item['ticket_id']}\nQuery: {item['query']}\nAnswers: {', '.join(item['answers'])}"
+                for item in similar_data[:5]
+            ])
+            return (
+                f"""You are a helpful and neutral AI assistant for a laptop support ticketing platform. 
+                Your goal is to assist users by offering solutions based on these detail
+                - User query: '{query}'
+                - Keywords: {json.dumps(keywords)}
+                - Chat history: {json.dumps(chat_history[-2:] if chat_history else [])}
+                - Similar issues from past data: {similar_text}
+                Provide a step-by-step solution in a clear, ordered list, starting with the easiest steps and progressing to harder ones.
+                - Limit to 5–7 steps, each under 20 words.
+                - Use simple, non-technical language.
+                - Ensure steps are practical and ordered by complexity.
+                - Add a brief summary (1–2 lines, max 20 words each) explaining the approach.
+                ---
+                Do not use bold or italic text. Structure the output clearly with HTML <ol> tags for steps.
+                ---
+                If the user asks about something unrelated to laptop support, politely let them know it's beyond your scope.
+                ---
+                Vary phrasing across responses to avoid repetition. Keep the tone friendly and clear.
+                """
+            )
+        return (
+            f"""You are a friendly AI assistant on an AI ticketing platform that helps users with laptop-related problems.
+            ---
+            User query: '{query}'
+            Keywords: {json.dumps(keywords)}
+            Chat history: {json.dumps(chat_history[-2:] if chat_history else [])}
+            ---
+            No matching records found. Provide a basic step-by-step troubleshooting guide in a clear, ordered list.
+            - Start with the easiest steps, progressing to harder ones (3–5 steps, each under 20 words).
+            - Use plain, non-technical language.
+            - After the steps, encourage the user to upload a support ticket for further help.
+            - Add a brief summary (1–2 lines, max 20 words each) explaining the approach.
+            ---
+            Use HTML <ol> tags for steps.
+            ---
+            If the user's question is unrelated to laptop issues, politely explain that it's outside the platform's scope in 1–2 lines.
+            ---
+            Keep the tone calm, neutral, and conversational. Vary phrasing to prevent repetition.
+            """
+        )
+
     def _generate_response(self, query: str, similar_data: list = None, chat_history: list = None, keywords: List[str] = None) -> str:
         try:
-            if similar_data:
-                similar_text = "\n".join([
-                    f"Ticket ID: {item['ticket_id']}\nQuery: {item['query']}\nAnswers: {', '.join(item['answers'])}"
-                    for item in similar_data[:5]
-                ])
-                prompt = (
-                    f"""You are a helpful and neutral AI assistant for a laptop support ticketing platform. 
-                    Your goal is to assist users by offering solutions based on these detail
-                    - User query: '{query}'
-                    - Keywords: {json.dumps(keywords)}
-                    - Chat history: {json.dumps(chat_history[-2:] if chat_history else [])}
-                    - Similar issues from past data: {similar_text}
-                    Provide a step-by-step solution in a clear, ordered list, starting with the easiest steps and progressing to harder ones.
-                    - Limit to 5–7 steps, each under 20 words.
-                    - Use simple, non-technical language.
-                    - Ensure steps are practical and ordered by complexity.
-                    - Add a brief summary (1–2 lines, max 20 words each) explaining the approach.
-                    ---
-                    Do not use bold or italic text. Structure the output clearly with HTML <ol> tags for steps.
-                    ---
-                    If the user asks about something unrelated to laptop support, politely let them know it's beyond your scope.
-                    ---
-                    Vary phrasing across responses to avoid repetition. Keep the tone friendly and clear.
-                    """
-                )
-                response = chat_model.generate_content(prompt)
-                return response.text.strip()
-            else:
-                prompt = (
-                    f"""You are a friendly AI assistant on an AI ticketing platform that helps users with laptop-related problems.
-                    ---
-                    User query: '{query}'
-                    Keywords: {json.dumps(keywords)}
-                    Chat history: {json.dumps(chat_history[-2:] if chat_history else [])}
-                    ---
-                    No matching records found. Provide a basic step-by-step troubleshooting guide in a clear, ordered list.
-                    - Start with the easiest steps, progressing to harder ones (3–5 steps, each under 20 words).
-                    - Use plain, non-technical language.
-                    - After the steps, encourage the user to upload a support ticket for further help.
-                    - Add a brief summary (1–2 lines, max 20 words each) explaining the approach.
-                    ---
-                    Use HTML <ol> tags for steps.
-                    ---
-                    If the user's question is unrelated to laptop issues, politely explain that it's outside the platform's scope in 1–2 lines.
-                    ---
-                    Keep the tone calm, neutral, and conversational. Vary phrasing to prevent repetition.
-                    """
-                )
-                response = chat_model.generate_content(prompt)
-                return response.text.strip()
+            return generate_text(self.backend, self._response_prompt(query, similar_data, chat_history, keywords))
         except Exception as e:
             logger.error(f"Failed to generate response for query '{query}': {e}")
-            return "Error generating response. Please try again."
+            return GENERATION_ERROR
 
     def _load_or_generate_embeddings(self):
         try:
             # Initialize embeddings structure
             self.embeddings = {"by_brand": {}, "by_id": {}}
+            self.index = VectorIndex()
 
-            # Check if embedding file exists
-            if os.path.exists(self.embedding_file):
-                with open(self.embedding_file, 'r') as f:
-                    self.embeddings = json.load(f)
-                logger.info(f"Loaded embeddings from {self.embedding_file}")
-                return
+            # Convert a legacy JSON embedding file once, then load the binary store
+            if not self.embedding_store.exists() and os.path.exists(self.embedding_file):
+                logger.info(f"Converting {self.embedding_file} to binary embedding store")
+                convert_json_store(self.embedding_file, self.embedding_store, model=self.embedding_model)
+
+            # Prefer the memory-mapped binary store
+            if self.embedding_store.exists():
+                try:
+                    self._open_store()
+                    return
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Embedding store cannot be used ({e}), regenerating it from the tickets collection")
+                    self.embeddings = {"by_brand": {}, "by_id": {}}
+                    self.index = VectorIndex()
 
             # If no file exists, generate embeddings for all tickets
             logger.info("No embedding file found. Generating embeddings for all tickets.")
@@ -168,34 +297,21 @@ class RAGSystem:
 
             # Collect valid tickets and infer brand from query
             for ticket in tickets:
-                query = ticket.get("query", "")
-                ticket_id = str(ticket["_id"])
-                answers = ticket.get("answers", [])
-                if not isinstance(query, str) or not query.strip():
-                    logger.warning(f"Skipping ticket {ticket_id} with invalid query: {query}")
-                    continue
-
-                # Infer brand from query using brand_keywords
-                brand = "Unknown"
-                query_lower = query.lower()
-                for brand_name, keywords in self.brand_keywords.items():
-                    if any(keyword in query_lower for keyword in keywords):
-                        brand = brand_name
-                        break
-
-                queries.append(query)
-                ticket_data.append((ticket_id, query, answers, brand))
+                prepared = self._prepare_ticket(ticket)
+                if prepared:
+                    queries.append(prepared[1])
+                    ticket_data.append(prepared)
 
             if not queries:
                 logger.info("No valid tickets found to generate embeddings.")
-                with open(self.embedding_file, 'w') as f:
-                    json.dump(self.embeddings, f)
+                self._save_embeddings()
                 return
 
             # Generate embeddings for all queries
             embeddings = self._batch_generate_embeddings(queries)
 
             # Store embeddings and metadata
+            ids, vectors = [], []
             for (ticket_id, query, answers, brand), embedding in zip(ticket_data, embeddings):
                 if not embedding:
                     logger.warning(f"Skipping ticket {ticket_id} due to embedding failure")
@@ -203,27 +319,322 @@ class RAGSystem:
                 self.embeddings["by_id"][ticket_id] = {
                     "query": query,
                     "processed_query": query.lower(),
-                    "embedding": embedding,
                     "answers": answers,
                     "brand": brand,
-                    "keywords": []
+                    "keywords": self.keyword_extractor.ticket_keywords(query)
                 }
                 if brand not in self.embeddings["by_brand"]:
                     self.embeddings["by_brand"][brand] = []
                 self.embeddings["by_brand"][brand].append(ticket_id)
+                ids.append(ticket_id)
+                vectors.append(embedding)
 
-            # Save embeddings to file
-            with open(self.embedding_file, 'w') as f:
-                json.dump(self.embeddings, f)
-            logger.info(f"Generated and saved embeddings to {self.embedding_file}")
+            # Save embeddings to the binary store
+            self.index = VectorIndex(ids, vectors)
+            self._save_embeddings()
+            logger.info(f"Generated and saved embeddings to {self.embedding_store.metadata_path}")
+            self._open_store()
 
         except Exception as e:
             logger.error(f"Error loading or generating embeddings: {e}")
             # Save empty embeddings to prevent repeated failures
-            with open(self.embedding_file, 'w') as f:
-                json.dump(self.embeddings, f)
+            if not self.embedding_store.exists():
+                self.embeddings = {"by_brand": {}, "by_id": {}}
+                self.index = VectorIndex()
+                self._save_embeddings()
             raise
 
+    def _prepare_ticket(self, ticket: dict):
+        """Return (ticket_id, query, answers, brand) for a ticket document, or None if it cannot be embedded."""
+        query = ticket.get("query", "")
+        ticket_id = str(ticket["_id"])
+        answers = ticket.get("answers", [])
+        if not isinstance(query, str) or not query.strip():
+            logger.warning(f"Skipping ticket {ticket_id} with invalid query: {query}")
+            return None
+
+        # Infer brand from query using brand_keywords
+        brand = "Unknown"
+        query_lower = query.lower()
+        for brand_name, keywords in self.brand_keywords.items():
+            if any(keyword in query_lower for keyword in keywords):
+                brand = brand_name
+                break
+        return ticket_id, query, answers, brand
+
+    def _load_or_build_ann_index(self):
+        """Set up the optional approximate nearest-neighbour engine selected by RAG_ANN_ENGINE."""
+        if not self.ann_engine:
+            return
+        if self.ann_engine != "ivf":
+            logger.warning(f"Unknown ANN engine '{self.ann_engine}', using exact search")
+            return
+        nprobe = int(os.getenv("RAG_ANN_NPROBE", "8"))
+        try:
+            if os.path.exists(self.ann_index_file):
+                self.ann_index = IVFIndex.load(self.ann_index_file, self.index, nprobe=nprobe)
+                return
+        except Exception as e:
+            logger.warning(f"Failed to load IVF index from {self.ann_index_file}, rebuilding: {e}")
+        self.ann_index = IVFIndex(self.index, n_lists=int(os.getenv("RAG_ANN_LISTS", "0")), nprobe=nprobe)
+        self.ann_index.build()
+        self.ann_index.save(self.ann_index_file)
+
+    def _search(self, query_embedding: list, top_k: int, similarity_threshold: float,
+                candidate_ids: set = None) -> List[Tuple[str, float]]:
+        """Dense top-k over the whole corpus, exact or through the ANN index.
+
+        Exact search already scores every ticket, so `candidate_ids` only matter
+        with an ANN index: the brand/keyword candidates are scored exactly and
+        merged in, so a candidate in an unprobed list is not missed.
+        """
+        if not self.ann_index:
+            return self.index.search(query_embedding, top_k=top_k, similarity_threshold=similarity_threshold)
+        matches = self.ann_index.search(query_embedding, top_k=top_k, similarity_threshold=similarity_threshold)
+        if not candidate_ids:
+            return matches
+        merged = dict(matches)
+        merged.update(self.index.search(query_embedding, top_k=top_k, similarity_threshold=similarity_threshold,
+                                        candidate_ids=candidate_ids))
+        return sorted(merged.items(), key=lambda match: -match[1])[:top_k]
+
+    def _build_keyword_index(self):
+        """Index every ticket's keywords, extracting them for stores written before keywords were kept."""
+        for ticket_id, ticket in self.embeddings["by_id"].items():
+            if not ticket.get("keywords"):
+                ticket["keywords"] = self.keyword_extractor.ticket_keywords(ticket["query"])
+            self.keyword_index.add(ticket_id, ticket["keywords"])
+        logger.info(f"Built keyword index with {len(self.keyword_index)} terms")
+
+    def _build_lexical_index(self):
+        for ticket_id, ticket in self.embeddings["by_id"].items():
+            self.bm25_index.add(ticket_id, " ".join([ticket["query"]] + [str(answer) for answer in ticket["answers"]]))
+        logger.info(f"Built BM25 index over {len(self.bm25_index)} tickets")
+
+    def sync_embeddings(self) -> int:
+        """Embed tickets that are in the tickets collection but not yet in the store.
+
+        New tickets are found by diffing `_id`s against `by_id`, so only the new
+        tickets are fetched and embedded, and only their rows are appended to the
+        store. The updated index and metadata are swapped in atomically. Returns
+        the number of tickets added.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            logger.info("Embedding sync already running, skipping")
+            return 0
+        try:
+            known_ids = set(self.embeddings["by_id"]) | self._unindexable_ids
+            new_ids = [
+                doc["_id"] for doc in self.tickets_collection.find({}, {"_id": 1})
+                if str(doc["_id"]) not in known_ids
+            ]
+            if not new_ids:
+                logger.info("Embedding store is up to date")
+                return 0
+
+            ticket_data = []
+            for ticket in self.tickets_collection.find({"_id": {"$in": new_ids}}):
+                prepared = self._prepare_ticket(ticket)
+                if prepared:
+                    ticket_data.append(prepared)
+                else:
+                    self._unindexable_ids.add(str(ticket["_id"]))
+            if not ticket_data:
+                return 0
+
+            embeddings = self._batch_generate_embeddings([query for _, query, _, _ in ticket_data])
+            by_id = dict(self.embeddings["by_id"])
+            by_brand = {brand: list(ticket_ids) for brand, ticket_ids in self.embeddings["by_brand"].items()}
+            ids, vectors = [], []
+            for (ticket_id, query, answers, brand), embedding in zip(ticket_data, embeddings):
+                if not embedding or (len(self.index) and len(embedding) != self.index.dim):
+                    # Left out of the store so the next sync retries it
+                    logger.warning(f"Skipping ticket {ticket_id} due to embedding failure")
+                    continue
+                by_id[ticket_id] = {
+                    "query": query,
+                    "processed_query": query.lower(),
+                    "answers": answers,
+                    "brand": brand,
+                    "keywords": self.keyword_extractor.ticket_keywords(query)
+                }
+                by_brand.setdefault(brand, []).append(ticket_id)
+                ids.append(ticket_id)
+                vectors.append(embedding)
+            if not ids:
+                return 0
+
+            # Append only the new rows, then map the grown file; in-flight queries keep the index they started with
+            new_vectors = np.asarray(vectors, dtype=np.float32)
+            try:
+                appended = self.embedding_store.append({ticket_id: by_id[ticket_id] for ticket_id in ids}, ids, new_vectors,
+                                                       model=self.embedding_model, base_rows=len(self.index))
+            except ValueError as e:
+                # Another process synced first; pick up its rows, the next sync adds whatever is still missing
+                logger.warning(f"Embedding store changed during sync, reloading it: {e}")
+                known_ids = self.embeddings["by_id"]
+                self._open_store()
+                self._index_new_tickets([ticket_id for ticket_id in self.index.ids if ticket_id not in known_ids])
+                return 0
+            if appended:
+                index = VectorIndex(self.index.ids + ids, self.embedding_store.open_vectors(), normalized=True,
+                                    quantization=self.vector_quantization)
+                self.embeddings = {"by_brand": by_brand, "by_id": by_id}
+                self.index = index
+            else:
+                # Stores in the older format are rewritten once into an appendable generation
+                grown = np.vstack([np.asarray(self.index.vectors), normalize_rows(new_vectors)]) if len(self.index) else new_vectors
+                self.embedding_store.save({"by_brand": by_brand, "by_id": by_id}, self.index.ids + ids, grown, model=self.embedding_model)
+                del grown
+                self._open_store()
+            self._index_new_tickets(ids)
+            logger.info(f"Synced {len(ids)} new tickets into the embedding store")
+            return len(ids)
+        except Exception as e:
+            logger.error(f"Failed to sync embeddings: {e}")
+            return 0
+        finally:
+            self._sync_lock.release()
+
+    def _index_new_tickets(self, ticket_ids: List[str]):
+        """Bring the ANN, keyword and BM25 indexes up to date with tickets just added to `self.index`."""
+        if self.ann_index:
+            self.ann_index.rebase(self.index)
+            self.ann_index.save(self.ann_index_file)
+        tickets = [self.embeddings["by_id"][ticket_id] for ticket_id in ticket_ids]
+        self.keyword_extractor.add_queries(ticket["query"] for ticket in tickets)
+        for ticket_id, ticket in zip(ticket_ids, tickets):
+            self.keyword_index.add(ticket_id, ticket["keywords"])
+            self.bm25_index.add(ticket_id, " ".join([ticket["query"]] + [str(answer) for answer in ticket["answers"]]))
+
+    def start_sync_scheduler(self, interval: float):
+        """Run `sync_embeddings` every `interval` seconds on a daemon thread (0 disables)."""
+        if interval <= 0 or (self._sync_thread and self._sync_thread.is_alive()):
+            return
+
+        def run():
+            while not self._sync_stop.wait(interval):
+                self.sync_embeddings()
+                self._refresh_laptop_models()
+
+        self._sync_stop.clear()
+        self._sync_thread = threading.Thread(target=run, name="embedding-sync", daemon=True)
+        self._sync_thread.start()
+        logger.info(f"Embedding sync scheduled every {interval:.0f}s")
+
+    def stop_sync_scheduler(self):
+        self._sync_stop.set()
+
+    def _open_store(self):
+        """(Re)load metadata and memory-mapped vectors from the binary store and swap them in."""
+        embeddings, ids, vectors = self.embedding_store.load(model=self.embedding_model, dim=self.backend.embedding_dim)
+        index = VectorIndex(ids, vectors, normalized=True, quantization=self.vector_quantization)
+        self.embeddings = embeddings
+        self.index = index
+
+    def _save_embeddings(self):
+        self.embedding_store.save(self.embeddings, self.index.ids, self.index.vectors, model=self.embedding_model)
+
+    def _embed_query_with_timeout(self, query: str) -> list:
+        """Embed the query, giving up after `embedding_timeout` seconds (the call still finishes and fills the cache)."""
+        future = self._embedding_executor.submit(self._embed_query, query)
+        try:
+            return future.result(timeout=self.embedding_timeout)
+        except FuturesTimeoutError:
+            logger.warning(f"Query embedding took longer than {self.embedding_timeout}s, answering lexically")
+            return []
+
+    def _rank_tickets(self, query: str, processed_query: str, top_k: int, similarity_threshold: float,
+                      candidate_ids: set = None):
+        """Rank tickets for a query according to `retrieval_mode`.
+
+        Returns ((ticket_id, similarity) pairs, query embedding); the pairs are None in
+        dense mode when the query could not be embedded. In hybrid mode dense and BM25 rankings are fused with
+        reciprocal rank fusion; if the embedding is slow or fails, hybrid degrades to
+        lexical-only. Lexical matches report the share of query terms (IDF-weighted)
+        they cover as their similarity.
+        """
+        query_embedding = []
+        if self.retrieval_mode != "lexical":
+            if self.retrieval_mode == "hybrid" and self.embedding_timeout > 0:
+                query_embedding = self._embed_query_with_timeout(processed_query)
+            else:
+                query_embedding = self._embed_query(processed_query)
+        return self._fuse_rankings(query, query_embedding, top_k, similarity_threshold, candidate_ids), query_embedding
+
+    def _fuse_rankings(self, query: str, query_embedding: list, top_k: int, similarity_threshold: float,
+                       candidate_ids: set = None):
+        """Dense and/or BM25 (ticket_id, similarity) pairs for a query whose embedding is already known (or empty)."""
+        dense, lexical = [], []
+        if self.retrieval_mode != "lexical":
+            if query_embedding:
+                dense = self._search(query_embedding, top_k, similarity_threshold, candidate_ids)
+            elif self.retrieval_mode == "dense":
+                return None
+        if self.retrieval_mode != "dense":
+            lexical = [
+                (ticket_id, coverage)
+                for ticket_id, _, coverage in self.bm25_index.search(query, top_k, min_coverage=self.lexical_threshold)
+            ]
+        if not lexical:
+            return dense
+        if not dense:
+            return lexical
+        similarities = dict(lexical)
+        similarities.update(dense)
+        fused = reciprocal_rank_fusion([[ticket_id for ticket_id, _ in dense], [ticket_id for ticket_id, _ in lexical]])
+        return [(ticket_id, similarities[ticket_id]) for ticket_id, _ in fused[:top_k]]
+
+    def _cached_generate_response(self, query: str, query_embedding: list, brand: str, similar_data: list = None,
+                                  chat_history: list = None, keywords: List[str] = None) -> str:
+        """Serve `_generate_response` from the semantic response cache when a close enough query was answered."""
+        if not query_embedding:
+            return self._generate_response(query, similar_data, chat_history, keywords)
+        ticket_ids = [item["ticket_id"] for item in similar_data or []]
+        response = self.response_cache.lookup(query_embedding, brand, ticket_ids)
+        if response is not None:
+            logger.info(f"Semantic response cache hit for query '{query}'")
+            emit(response)
+            return response
+        response = self._generate_response(query, similar_data, chat_history, keywords)
+        if response != GENERATION_ERROR:
+            self.response_cache.store(query, query_embedding, brand, ticket_ids, response)
+        return response
+
+    def _candidate_ids(self, brand: str, keywords: List[str]) -> set:
+        """Tickets of the query's brand or sharing a keyword with it, merged into approximate (ANN) search results."""
+        if self.retrieval_mode == "lexical" or not self.ann_index:
+            return set()
+        candidate_ids = set()
+        if brand != "Unknown":
+            candidate_ids.update(self.embeddings["by_brand"].get(brand, []))
+        return candidate_ids | self.keyword_index.lookup(keywords)
+
+    def _format_matches(self, top_matches: List[Tuple[str, float]]) -> Tuple[list, str]:
+        """Prompt context and HTML listing for matched tickets."""
+        similar_data = [
+            {
+                "ticket_id": ticket_id,
+                "query": self.embeddings["by_id"][ticket_id]["query"],
+                "answers": self.embeddings["by_id"][ticket_id]["answers"],
+                "similarity": similarity
+            }
+            for ticket_id, similarity in top_matches
+        ]
+        result_html = "<div>Found similar issues:<br>"
+        for ticket_id, similarity in top_matches:
+            ticket = self.embeddings["by_id"][ticket_id]
+            result_html += (
+                "<div class='ticket-result'>"
+                f"<strong>Ticket ID:</strong> {ticket_id}<br>"
+                f"<strong>Query:</strong> {ticket['query']}<br>"
+                f"<strong>Answers:</strong><ul>" +
+                "".join(f"<li>{answer}</li>" for answer in ticket["answers"]) +
+                f"</ul><strong>Similarity:</strong> {similarity:.2%}<br>"
+                "</div>"
+            )
+        return similar_data, result_html
+
     def retrieve_answers(self, query: str, chat_history: list = None, top_k: int = 5, similarity_threshold: float = 0.9) -> dict:
         try:
             if not isinstance(query, str) or not query.strip():
@@ -231,65 +642,135 @@ class RAGSystem:
                 return {"formatted_response": "Invalid query provided."}
             
             processed_query, brand, keywords = self._extract_keywords(query)
-            query_embedding = self._generate_embedding(processed_query)
-            if not query_embedding:
+            logger.info(f"Query brand: {brand}, Processed query: {processed_query}, Keywords: {keywords}")
+
+            # Prioritize brand and keyword matches
+            candidate_ids = self._candidate_ids(brand, keywords)
+            logger.info(f"Found {len(candidate_ids)} brand/keyword candidates")
+
+            top_matches, query_embedding = self._rank_tickets(query, processed_query, top_k, similarity_threshold, candidate_ids)
+            if top_matches is None:
                 logger.warning(f"No embedding for query: {query}")
                 return {"formatted_response": self._generate_response(query, chat_history=chat_history, keywords=keywords)}
+
+            if not top_matches:
+                logger.info(f"No tickets with similarity >= {similarity_threshold} for query: {query}")
+                return {"formatted_response": self._cached_generate_response(query, query_embedding, brand, chat_history=chat_history, keywords=keywords)}
             
-            logger.info(f"Query brand: {brand}, Processed query: {processed_query}, Keywords: {keywords}")
-            
-            # Prioritize brand and keyword matches
-            candidate_ids = set()
-            if brand != "Unknown":
-                candidate_ids.update(self.embeddings["by_brand"].get(brand, []))
-            for keyword in keywords:
-                for ticket_id, ticket in self.embeddings["by_id"].items():
-                    if any(kw in ticket["keywords"] for kw in keywords):
-                        candidate_ids.add(ticket_id)
-            candidate_ids.update(self.embeddings["by_id"].keys())  # Fallback to all tickets
-
-            similarities = []
-            for ticket_id in candidate_ids:
-                ticket = self.embeddings["by_id"][ticket_id]
+            similar_data, result_html = self._format_matches(top_matches)
+            result_html += "<strong>Solution:</strong><br>"
+            # Streaming clients see the matched tickets before generation starts
+            emit(result_html)
+            response = self._cached_generate_response(query, query_embedding, brand, similar_data, chat_history, keywords)
+            result_html += response
+            logger.info(f"Retrieved answers for query '{query}' with {len(top_matches)} matches")
+            return {"formatted_response": result_html}
+        except Exception as e:
+            logger.error(f"Error retrieving answers for query '{query}': {e}")
+            return {"formatted_response": self._generate_response(query, chat_history=chat_history, keywords=keywords)}
+    # Async request path: same retrieval as above, with Gemini calls awaited instead of holding a thread
+
+    async def _aextract_keywords(self, query: str) -> Tuple[str, str, List[str]]:
+        processed_query, brand, keywords, confidence = self.keyword_extractor.extract(query)
+        if confidence >= self.keyword_confidence_threshold:
+            logger.debug(f"Local keyword extraction for '{query}' (confidence {confidence})")
+            return processed_query, brand, keywords
+        logger.info(f"Low keyword extraction confidence ({confidence}) for '{query}', falling back to LLM")
+        try:
+            prompt = self._keyword_prompt(query)
+            text = await acomplete_text(self.backend, prompt)
+            return self._parse_keywords(text, query)
+        except Exception as e:
+            logger.error(f"Failed to extract keywords for query '{query}': {e}")
+            return query.lower(), "Unknown", []
+
+    async def _agenerate_embedding(self, text: str) -> list:
+        try:
+            logger.debug(f"Generating embedding for text: {text[:50]}...")
+            embedding, shared = await async_upstream_calls.do(
+                ("embed", self.embedding_model, text),
+                lambda: self.backend.aembed(text)
+            )
+            if shared:
+                logger.debug(f"Shared in-flight embedding for text: {text[:50]}...")
+            return embedding
+        except Exception as e:
+            logger.error(f"Failed to generate embedding for text '{text[:50]}...': {e}")
+            return []
+
+    async def _aembed_query(self, query: str) -> list:
+        embedding = self.query_embedding_cache.get(query, self.embedding_model)
+        if embedding is not None:
+            logger.debug(f"Query embedding cache hit for: {query[:50]}")
+            return embedding
+        embedding = await self._agenerate_embedding(query)
+        self.query_embedding_cache.put(query, self.embedding_model, embedding)
+        return embedding
+
+    async def _arank_tickets(self, query: str, processed_query: str, top_k: int, similarity_threshold: float,
+                             candidate_ids: set = None):
+        query_embedding = []
+        if self.retrieval_mode != "lexical":
+            if self.retrieval_mode == "hybrid" and self.embedding_timeout > 0:
                 try:
-                    similarity = cosine_similarity([query_embedding], [ticket["embedding"]])[0][0]
-                    if similarity >= similarity_threshold:
-                        similarities.append((ticket_id, similarity))
-                except Exception as e:
-                    logger.error(f"Error computing similarity for ticket {ticket_id}: {e}")
-                    continue
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            top_matches = similarities[:top_k]
-            
+                    # Shielded so a slow embedding still completes and fills the cache
+                    query_embedding = await asyncio.wait_for(asyncio.shield(self._aembed_query(processed_query)), self.embedding_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Query embedding took longer than {self.embedding_timeout}s, answering lexically")
+            else:
+                query_embedding = await self._aembed_query(processed_query)
+        return self._fuse_rankings(query, query_embedding, top_k, similarity_threshold, candidate_ids), query_embedding
+
+    async def _agenerate_response(self, query: str, similar_data: list = None, chat_history: list = None, keywords: List[str] = None) -> str:
+        try:
+            return await agenerate_text(self.backend, self._response_prompt(query, similar_data, chat_history, keywords))
+        except Exception as e:
+            logger.error(f"Failed to generate response for query '{query}': {e}")
+            return GENERATION_ERROR
+
+    async def _acached_generate_response(self, query: str, query_embedding: list, brand: str, similar_data: list = None,
+                                         chat_history: list = None, keywords: List[str] = None) -> str:
+        if not query_embedding:
+            return await self._agenerate_response(query, similar_data, chat_history, keywords)
+        ticket_ids = [item["ticket_id"] for item in similar_data or []]
+        response = self.response_cache.lookup(query_embedding, brand, ticket_ids)
+        if response is not None:
+            logger.info(f"Semantic response cache hit for query '{query}'")
+            emit(response)
+            return response
+        response = await self._agenerate_response(query, similar_data, chat_history, keywords)
+        if response != GENERATION_ERROR:
+            self.response_cache.store(query, query_embedding, brand, ticket_ids, response)
+        return response
+
+    async def aretrieve_answers(self, query: str, chat_history: list = None, top_k: int = 5, similarity_threshold: float = 0.9) -> dict:
+        """Async counterpart of `retrieve_answers`; index lookups stay in-process, model calls are awaited."""
+        keywords = []
+        try:
+            if not isinstance(query, str) or not query.strip():
+                logger.error(f"Invalid query: {query}")
+                return {"formatted_response": "Invalid query provided."}
+
+            processed_query, brand, keywords = await self._aextract_keywords(query)
+            logger.info(f"Query brand: {brand}, Processed query: {processed_query}, Keywords: {keywords}")
+            candidate_ids = self._candidate_ids(brand, keywords)
+            logger.info(f"Found {len(candidate_ids)} brand/keyword candidates")
+
+            top_matches, query_embedding = await self._arank_tickets(query, processed_query, top_k, similarity_threshold, candidate_ids)
+            if top_matches is None:
+                logger.warning(f"No embedding for query: {query}")
+                return {"formatted_response": await self._agenerate_response(query, chat_history=chat_history, keywords=keywords)}
+
             if not top_matches:
                 logger.info(f"No tickets with similarity >= {similarity_threshold} for query: {query}")
-                return {"formatted_response": self._generate_response(query, chat_history=chat_history, keywords=keywords)}
-            
-            similar_data = [
-                {
-                    "ticket_id": ticket_id,
-                    "query": self.embeddings["by_id"][ticket_id]["query"],
-                    "answers": self.embeddings["by_id"][ticket_id]["answers"],
-                    "similarity": similarity
-                }
-                for ticket_id, similarity in top_matches
-            ]
-            result_html = "<div>Found similar issues:<br>"
-            for ticket_id, similarity in top_matches:
-                ticket = self.embeddings["by_id"][ticket_id]
-                result_html += (
-                    "<div class='ticket-result'>"
-                    f"<strong>Ticket ID:</strong> {ticket_id}<br>"
-                    f"<strong>Query:</strong> {ticket['query']}<br>"
-                    f"<strong>Answers:</strong><ul>" +
-                    "".join(f"<li>{answer}</li>" for answer in ticket["answers"]) +
-                    f"</ul><strong>Similarity:</strong> {similarity:.2%}<br>"
-                    "</div>"
-                )
-            response = self._generate_response(query, similar_data, chat_history, keywords)
-            result_html += f"<strong>Solution:</strong><br>{response}"
+                return {"formatted_response": await self._acached_generate_response(query, query_embedding, brand, chat_history=chat_history, keywords=keywords)}
+
+            similar_data, result_html = self._format_matches(top_matches)
+            result_html += "<strong>Solution:</strong><br>"
+            emit(result_html)
+            result_html += await self._acached_generate_response(query, query_embedding, brand, similar_data, chat_history, keywords)
             logger.info(f"Retrieved answers for query '{query}' with {len(top_matches)} matches")
             return {"formatted_response": result_html}
         except Exception as e:
             logger.error(f"Error retrieving answers for query '{query}': {e}")
-            return {"formatted_response": self._generate_response(query, chat_history=chat_history, keywords=keywords)}
\ No newline at end of file
+            return {"formatted_response": await self._agenerate_response(query, chat_history=chat_history, keywords=keywords)}
@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from backends import LLMBackend
+from metrics import RESPONSE_POOL_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_FILE = "response_pool.json"
+
+
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+class ResponsePool:
+    """Pre-generated reply variants for fixed prompts, served at random from memory.
+
+    Each registered prompt is sent to the backend `size` times and the distinct
+    replies are kept. Pools are saved to `path` and reloaded at startup; a
+    background thread refills pools older than `refresh_seconds` (or whose prompt
+    changed) and keeps serving the previous variants until the new ones are in.
+    `get` returns None for an empty pool so the caller can generate live.
+    """
+
+    def __init__(self, backend: LLMBackend, size: int = None, refresh_seconds: float = None, path: str = None):
+        self.backend = backend
+        self.size = size if size is not None else int(os.getenv("RESPONSE_POOL_SIZE", "5"))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(os.getenv("RESPONSE_POOL_REFRESH_SECONDS", "21600"))
+        self.path = path or os.getenv("RESPONSE_POOL_FILE", DEFAULT_POOL_FILE)
+        self.prompts: Dict[str, str] = {}
+        self._pools: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # Set once every registered prompt has had its first fill attempt
+        self.ready = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def register(self, key: str, prompt: str):
+        self.prompts[key] = prompt
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            pool = self._pools.get(key)
+            variants = pool["variants"] if pool else []
+        RESPONSE_POOL_LOOKUPS.inc(key=key, outcome="hit" if variants else "miss")
+        return random.choice(variants) if variants else None
+
+    def _stale(self, key: str) -> bool:
+        with self._lock:
+            pool = self._pools.get(key)
+        return (pool is None or pool["prompt_hash"] != _prompt_hash(self.prompts[key])
+                or time.time() - pool["generated_at"] >= self.refresh_seconds)
+
+    def fill(self, key: str) -> int:
+        """Generate a fresh set of variants for `key`; returns how many distinct variants were kept."""
+        prompt = self.prompts[key]
+        variants: List[str] = []
+        for _ in range(self.size):
+            try:
+                text = self.backend.generate(prompt).strip()
+            except Exception as e:
+                logger.error(f"Error generating response pool variant for '{key}': {e}")
+                continue
+            if text and text not in variants:
+                variants.append(text)
+        if not variants:
+            # Keep serving the previous variants (if any) rather than emptying the pool
+            return 0
+        with self._lock:
+            self._pools[key] = {"prompt_hash": _prompt_hash(prompt), "generated_at": time.time(), "variants": variants}
+        logger.info(f"Response pool '{key}' filled with {len(variants)} variants")
+        return len(variants)
+
+    def refresh(self, force: bool = False) -> int:
+        """Refill stale pools (all pools with `force`) and save them; returns the number refilled."""
+        refilled = 0
+        for key in list(self.prompts):
+            if self._stop.is_set():
+                break
+            if (force or self._stale(key)) and self.fill(key):
+                refilled += 1
+        if refilled:
+            self.save()
+        return refilled
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading response pool from {self.path}: {e}")
+            return
+        with self._lock:
+            for key, pool in stored.items():
+                if key in self.prompts and pool.get("prompt_hash") == _prompt_hash(self.prompts[key]) and pool.get("variants"):
+                    self._pools[key] = pool
+        logger.info(f"Loaded {len(self._pools)} response pools from {self.path}")
+
+    def save(self):
+        with self._lock:
+            stored = dict(self._pools)
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stored, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving response pool to {self.path}: {e}")
+
+    def start(self):
+        """Load saved pools and start the background refresh thread."""
+        if not self.enabled:
+            self.ready.set()
+            return
+        self.load()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="response-pool", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing response pools: {e}")
+            self.ready.set()
+            # Re-check often enough that no pool outlives refresh_seconds by much
+            self._stop.wait(min(self.refresh_seconds, 600))
+
+
+def main():
+    from backends import get_backend
+    from chatbot import POOLED_PROMPTS
+
+    parser = argparse.ArgumentParser(description="Pre-generate the chatbot's response pools.")
+    parser.add_argument("--size", type=int, default=None, help="variants per prompt (default RESPONSE_POOL_SIZE or 5)")
+    parser.add_argument("--path", default=None, help=f"output file (default RESPONSE_POOL_FILE or {DEFAULT_POOL_FILE})")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    pool = ResponsePool(get_backend(), size=args.size, path=args.path)
+    for key, prompt in POOLED_PROMPTS.items():
+        pool.register(key, prompt)
+    refilled = pool.refresh(force=True)
+    print(f"Generated {refilled}/{len(POOLED_PROMPTS)} pools into {pool.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+from singleflight import upstream_calls, async_upstream_calls
+
+logger = logging.getLogger(__name__)
+
+_sink: ContextVar[Optional[Callable[[str], None]]] = ContextVar("stream_sink", default=None)
+
+
+def is_streaming() -> bool:
+    return _sink.get() is not None
+
+
+def emit(chunk: str):
+    """Send a piece of the user-facing response to the active stream, if any."""
+    sink = _sink.get()
+    if sink is not None and chunk:
+        sink(chunk)
+
+
+@contextmanager
+def stream_to(sink: Callable[[str], None]):
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def generation_key(backend, prompt: str) -> tuple:
+    return "generate", backend.model_name, prompt
+
+
+def complete_text(backend, prompt: str) -> str:
+    """Generate text for internal use (never streamed), sharing identical in-flight prompts."""
+    text, _ = upstream_calls.do(generation_key(backend, prompt), lambda: backend.generate(prompt).strip())
+    return text
+
+
+async def acomplete_text(backend, prompt: str) -> str:
+    """Async counterpart of `complete_text`."""
+    async def run():
+        return (await backend.agenerate(prompt)).strip()
+
+    text, _ = await async_upstream_calls.do(generation_key(backend, prompt), run)
+    return text
+
+
+def _generate(backend, prompt: str) -> str:
+    if not is_streaming():
+        return backend.generate(prompt).strip()
+    parts = []
+    for text in backend.generate_stream(prompt):
+        parts.append(text)
+        emit(text)
+    return "".join(parts).strip()
+
+
+def generate_text(backend, prompt: str) -> str:
+    """Generate a user-facing reply, streaming chunks to the active stream when there is one.
+
+    Identical prompts already in flight are shared; a caller joining another's
+    call receives the finished reply as a single chunk.
+    """
+    text, shared = upstream_calls.do(generation_key(backend, prompt), lambda: _generate(backend, prompt))
+    if shared:
+        emit(text)
+    return text
+
+
+async def _agenerate(backend, prompt: str) -> str:
+    if not is_streaming():
+        return (await backend.agenerate(prompt)).strip()
+    parts = []
+    async for text in backend.agenerate_stream(prompt):
+        parts.append(text)
+        emit(text)
+    return "".join(parts).strip()
+
+
+async def agenerate_text(backend, prompt: str) -> str:
+    """Async counterpart of `generate_text` for the asyncio request path."""
+    text, shared = await async_upstream_calls.do(generation_key(backend, prompt), lambda: _agenerate(backend, prompt))
+    if shared:
+        emit(text)
+    return text
+
+
+class StreamEvent:
+    def __init__(self, kind: str, data: str):
+        self.kind = kind
+        self.data = data
+
+
+def stream_call(fn: Callable[[], str]) -> Iterator[StreamEvent]:
+    """Run `fn` on a worker thread and yield its emitted chunks as they arrive.
+
+    Yields StreamEvent("chunk", text) for each emitted piece and finally
+    StreamEvent("done", result) with `fn`'s return value. If `fn` produced its
+    result without emitting anything, the result is sent as a single chunk first.
+    """
+    events: "queue.Queue[StreamEvent]" = queue.Queue()
+    emitted = []
+
+    def sink(chunk: str):
+        emitted.append(True)
+        events.put(StreamEvent("chunk", chunk))
+
+    def run():
+        try:
+            with stream_to(sink):
+                result = fn()
+        except Exception as e:
+            logger.error(f"Error while streaming response: {e}")
+            result = "An error occurred. Please try again."
+        if not emitted:
+            events.put(StreamEvent("chunk", result))
+        events.put(StreamEvent("done", result))
+
+    threading.Thread(target=run, name="response-stream", daemon=True).start()
+    while True:
+        event = events.get()
+        yield event
+        if event.kind == "done":
+            return
+
+
+async def astream_call(make_coro: Callable[[], Awaitable[str]]) -> AsyncIterator[StreamEvent]:
+    """Async counterpart of `stream_call`: runs the coroutine as a task on the current loop."""
+    events: "asyncio.Queue[StreamEvent]" = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    emitted = []
+
+    def put(event: StreamEvent):
+        # Thread-safe and ordered, in case a sync helper emits from an executor thread
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def sink(chunk: str):
+        emitted.append(True)
+        put(StreamEvent("chunk", chunk))
+
+    async def run():
+        try:
+            result = await make_coro()
+        except Exception as e:
+            logger.error(f"Error while streaming response: {e}")
+            result = "An error occurred. Please try again."
+        if not emitted:
+            put(StreamEvent("chunk", result))
+        put(StreamEvent("done", result))
+
+    with stream_to(sink):
+        # The task copies the current context, so the sink is visible to everything it awaits
+        task = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            yield event
+            if event.kind == "done":
+                return
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,35 @@
+import time
+
+from langchain_core.messages import HumanMessage
+
+from history_store import HistoryWriter, history_document
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(documents)
+
+
+def test_partial_batch_is_written_within_flush_interval():
+    collection = FakeCollection()
+    writer = HistoryWriter(lambda: collection, batch_size=100, flush_seconds=0.2)
+    try:
+        writer.append([history_document("alice", HumanMessage(content=f"message {i}")) for i in range(3)])
+        deadline = time.monotonic() + 2.0
+        while len(collection.documents) < 3 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert len(collection.documents) == 3
+        assert writer.depth() == 0
+    finally:
+        writer.close()
+
+
+def test_append_after_close_writes_inline():
+    collection = FakeCollection()
+    writer = HistoryWriter(lambda: collection, batch_size=100, flush_seconds=0.2)
+    writer.close()
+    writer.append([history_document("alice", HumanMessage(content="late"))])
+    assert len(collection.documents) == 1
@@ -0,0 +1,10 @@
+from intent_classifier import IntentClassifier
+
+
+def test_examples_are_capped_per_intent():
+    classifier = IntentClassifier(max_examples=50)
+    classifier.add_examples("query", (f"laptop {i} screen flickers after update {i}" for i in range(1000)))
+    classifier.add_examples("query", ["keyboard stopped working"])
+
+    assert len(classifier._features["query"]) == 50
+    assert classifier.predict("my laptop screen flickers")[0] == "query"
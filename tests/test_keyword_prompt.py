@@ -0,0 +1,17 @@
+import json
+
+from rag import RAGSystem
+
+
+def test_keyword_prompt_renders_example_output():
+    prompt = RAGSystem._render_keyword_prompt("Dell screen flickers")
+
+    assert "Given the query: 'Dell screen flickers'" in prompt
+    example = prompt[prompt.index("{"):prompt.rindex("}") + 1]
+    assert json.loads(example)["brand"] == "Dell"
+
+
+def test_parse_keywords_reads_llm_json():
+    text = '{"processed_query": "screen flickers", "brand": "Dell", "keywords": ["screen", "flicker"]}'
+
+    assert RAGSystem._parse_keywords(text, "Dell screen flickers") == ("screen flickers", "Dell", ["screen", "flicker"])
@@ -0,0 +1,45 @@
+import asyncio
+
+import mongo
+from mongo import MongoConnections
+
+
+class Client:
+    def __init__(self, uri, **options):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncClient(Client):
+    async def close(self):
+        self.closed = True
+
+
+def connections(monkeypatch) -> MongoConnections:
+    monkeypatch.setattr(mongo, "MongoClient", Client)
+    monkeypatch.setattr(mongo, "AsyncMongoClient", AsyncClient)
+    return MongoConnections("mongodb://localhost:27017")
+
+
+def test_close_closes_sync_and_async_clients(monkeypatch):
+    manager = connections(monkeypatch)
+    client, async_client = manager.client(), manager.async_client()
+
+    manager.close()
+
+    assert client.closed and async_client.closed
+    assert manager.client() is not client and manager.async_client() is not async_client
+
+
+def test_aclose_closes_sync_and_async_clients(monkeypatch):
+    manager = connections(monkeypatch)
+
+    async def run():
+        client, async_client = manager.client(), manager.async_client()
+        await manager.aclose()
+        return client, async_client
+
+    client, async_client = asyncio.run(run())
+    assert client.closed and async_client.closed
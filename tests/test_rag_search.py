@@ -0,0 +1,40 @@
+import numpy as np
+
+from ann_index import IVFIndex
+from rag import RAGSystem
+from vector_index import VectorIndex
+
+
+def make_rag(index: VectorIndex, ann_index: IVFIndex = None) -> RAGSystem:
+    rag = RAGSystem.__new__(RAGSystem)
+    rag.index = index
+    rag.ann_index = ann_index
+    return rag
+
+
+def corpus(n: int = 500, dim: int = 16):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    return [f"t{i}" for i in range(n)], vectors
+
+
+def test_top_k_unchanged_when_best_match_is_not_a_candidate():
+    ids, vectors = corpus()
+    index = VectorIndex(ids, vectors)
+    query = vectors[42]
+    expected = index.search(query, top_k=5, similarity_threshold=0.0)
+    assert expected[0][0] == "t42"
+    # Plenty of candidates, some above the threshold, but not the best match
+    candidates = {ticket_id for ticket_id in ids[100:300]}
+    assert make_rag(index)._search(query, 5, 0.0, candidates) == expected
+
+
+def test_ann_search_merges_candidates_scored_exactly():
+    ids, vectors = corpus()
+    index = VectorIndex(ids, vectors)
+    ann_index = IVFIndex(index, n_lists=20, nprobe=1)
+    ann_index.build()
+    query = vectors[42]
+    exact = index.search(query, top_k=5, similarity_threshold=0.0)
+    matches = make_rag(index, ann_index)._search(query, 5, 0.0, {ticket_id for ticket_id, _ in exact})
+    assert matches == exact
@@ -0,0 +1,64 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+from ann_index import IVFIndex
+from bm25 import BM25Index
+from embedding_store import EmbeddingStore
+from keyword_extractor import KeywordExtractor, KeywordIndex
+from rag import RAGSystem
+
+DIM = 8
+
+
+class Tickets:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        wanted = query.get("_id", {}).get("$in")
+        return [doc for doc in self.docs if wanted is None or doc["_id"] in wanted]
+
+
+def ticket(i):
+    return {"query": f"issue number {i}", "processed_query": f"issue number {i}", "answers": [f"answer {i}"],
+            "brand": "Unknown", "keywords": ["issue"]}
+
+
+def test_sync_after_concurrent_append_rebases_ann_index(tmp_path):
+    vectors = np.random.default_rng(0).normal(size=(151, DIM)).astype(np.float32)
+    ids = [f"t{i}" for i in range(151)]
+    store = EmbeddingStore(str(tmp_path / "emb.npy"), str(tmp_path / "emb.meta.json"))
+    store.save({"by_brand": {}, "by_id": {ticket_id: ticket(i) for i, ticket_id in enumerate(ids[:100])}},
+               ids[:100], vectors[:100], model="m")
+
+    rag = RAGSystem.__new__(RAGSystem)
+    rag.embedding_store, rag.embedding_model, rag.vector_quantization = store, "m", "none"
+    rag.backend = SimpleNamespace(embedding_dim=DIM)
+    rag._open_store()
+    rag.ann_index = IVFIndex(rag.index, n_lists=10, nprobe=10)
+    rag.ann_index.build()
+    rag.ann_index_file = str(tmp_path / "ann.npz")
+    rag.keyword_extractor, rag.keyword_index, rag.bm25_index = KeywordExtractor({}), KeywordIndex(), BM25Index()
+    rag.brand_keywords, rag._unindexable_ids, rag._sync_lock = {}, set(), threading.Lock()
+    rag._build_keyword_index()
+    rag._build_lexical_index()
+    tickets = Tickets([{"_id": ticket_id, "query": f"issue number {i}", "answers": []} for i, ticket_id in enumerate(ids)])
+    rag.mongo = SimpleNamespace(database=lambda: {"tickets": tickets})
+    rag._batch_generate_embeddings = lambda texts: [vectors[int(text.split()[-1])].tolist() for text in texts]
+
+    # Another process appends t100..t149 before this one writes
+    EmbeddingStore(store.vectors_path, store.metadata_path).append(
+        {ticket_id: ticket(i) for i, ticket_id in enumerate(ids[100:150], 100)}, ids[100:150], vectors[100:150],
+        model="m", base_rows=100)
+
+    assert rag.sync_embeddings() == 0
+    assert len(rag.index) == 150
+    assert rag.ann_index.n_assigned == 150
+    assert rag.ann_index.search(vectors[120], top_k=1)[0][0] == "t120"
+    assert IVFIndex.load(rag.ann_index_file, rag.index).n_assigned == 150
+    assert len(rag.bm25_index) == 150
+
+    assert rag.sync_embeddings() == 1
+    assert rag.ann_index.search(vectors[150], top_k=1)[0][0] == "t150"
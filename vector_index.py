@@ -0,0 +1,209 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("none", "float16", "int8")
+SCORE_CHUNK = 8192
+RESCORE_CANDIDATES = 64
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row of a float32 matrix; zero rows are left as zeros."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_positions(rows: np.ndarray, scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Positions of the `top_k` best scores, best first; ties are broken by row so results are deterministic."""
+    if scores.size > top_k:
+        kth = np.partition(scores, scores.size - top_k)[scores.size - top_k]
+        selected = np.flatnonzero(scores >= kth)
+    else:
+        selected = np.arange(scores.size)
+    return selected[np.lexsort((rows[selected], -scores[selected]))][:top_k]
+
+
+class VectorIndex:
+    """In-memory exact cosine-similarity index over ticket embeddings.
+
+    All vectors live in one contiguous, pre-normalized float32 matrix so a query
+    is a single matrix-vector product followed by an argpartition top-k. Pass
+    `normalized=True` to use an already-normalized matrix (e.g. a read-only
+    memory map) without copying it.
+
+    With `quantization="float16"` or `"int8"` (per-dimension scalar quantization)
+    the first pass runs over a compact copy of the vectors and only a shortlist is
+    re-scored at full precision from `vectors`. The shortlist is widened using a
+    per-query bound on the quantization error, so results match exact search; when
+    `vectors` is a memory map only the re-scored rows are ever paged in.
+    """
+
+    def __init__(self, ids: List[str] = None, vectors: np.ndarray = None, dim: int = 0, normalized: bool = False,
+                 quantization: str = "none"):
+        self.ids: List[str] = list(ids or [])
+        if vectors is None:
+            vectors = np.zeros((0, dim), dtype=np.float32)
+        elif np.ndim(vectors) != 2:
+            vectors = np.asarray(vectors, dtype=np.float32).reshape(len(self.ids), -1 if self.ids else dim)
+        self.vectors = vectors if normalized else np.ascontiguousarray(normalize_rows(vectors))
+        self.dim = self.vectors.shape[1]
+        self._positions: Dict[str, int] = {ticket_id: i for i, ticket_id in enumerate(self.ids)}
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode '{quantization}', expected one of {QUANTIZATION_MODES}")
+        self.quantization = quantization
+        self._quantize()
+
+    def _quantize(self):
+        self._codes = None
+        if self.quantization == "float16":
+            self._codes = np.asarray(self.vectors, dtype=np.float16)
+        elif self.quantization == "int8" and len(self.ids):
+            low = np.asarray(self.vectors.min(axis=0), dtype=np.float32)
+            high = np.asarray(self.vectors.max(axis=0), dtype=np.float32)
+            scale = (high - low) / 255.0
+            scale[scale == 0] = 1.0
+            codes = np.empty(self.vectors.shape, dtype=np.int8)
+            for start in range(0, len(self.ids), SCORE_CHUNK):
+                block = np.asarray(self.vectors[start:start + SCORE_CHUNK], dtype=np.float32)
+                codes[start:start + len(block)] = np.clip(np.rint((block - low) / scale) - 128, -128, 127)
+            self._codes, self._low, self._scale = codes, low, scale
+        if self._codes is not None:
+            logger.info(f"Quantized {len(self.ids)} vectors to {self.quantization} ({self._codes.nbytes / 1e6:.1f} MB resident)")
+
+    @classmethod
+    def from_embeddings(cls, by_id: Dict[str, dict]) -> "VectorIndex":
+        """Build an index from the `by_id` section of the embeddings store."""
+        ids, rows = [], []
+        dim = 0
+        for ticket_id, ticket in by_id.items():
+            embedding = ticket.get("embedding") or []
+            if not dim:
+                dim = len(embedding)
+            if not embedding or len(embedding) != dim:
+                logger.warning(f"Skipping ticket {ticket_id} with invalid embedding of length {len(embedding)}")
+                continue
+            ids.append(ticket_id)
+            rows.append(embedding)
+        vectors = np.asarray(rows, dtype=np.float32).reshape(len(rows), dim)
+        logger.info(f"Built vector index with {len(ids)} tickets (dim={dim})")
+        return cls(ids, vectors, dim)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, ticket_id: str) -> bool:
+        return ticket_id in self._positions
+
+    def add(self, ids: Iterable[str], vectors: np.ndarray):
+        """Append vectors for new tickets; ids already in the index are replaced."""
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        if len(self.ids) and vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+        if not self.vectors.flags.writeable:
+            self.vectors = np.array(self.vectors)
+        new_ids, new_rows = [], []
+        for ticket_id, row in zip(ids, vectors):
+            if ticket_id in self._positions:
+                self.vectors[self._positions[ticket_id]] = row
+            else:
+                new_ids.append(ticket_id)
+                new_rows.append(row)
+        if new_ids:
+            start = len(self.ids)
+            stacked = np.vstack([self.vectors.reshape(-1, vectors.shape[1]), np.asarray(new_rows, dtype=np.float32)])
+            self.vectors = np.ascontiguousarray(stacked, dtype=np.float32)
+            self.dim = self.vectors.shape[1]
+            self.ids.extend(new_ids)
+            self._positions.update({ticket_id: start + i for i, ticket_id in enumerate(new_ids)})
+        self._quantize()
+
+    def _normalize_query(self, query_embedding) -> np.ndarray:
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32).reshape(1, -1))[0]
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match index dimension {self.dim}")
+        return query
+
+    def scores(self, query_embedding) -> np.ndarray:
+        """Cosine similarity of the query against every indexed vector."""
+        return self.vectors @ self._normalize_query(query_embedding)
+
+    def _approximate_scores(self, query: np.ndarray, rows: np.ndarray = None) -> Tuple[np.ndarray, float]:
+        """Scores of `rows` (all rows by default) from the quantized vectors plus an upper bound on their absolute error."""
+        n_rows = len(self.ids) if rows is None else len(rows)
+        if self.quantization == "float16":
+            weights, offset = query, 0.0
+            # |q.x - q.fp16(x)| <= 2^-11 * sum|q_i x_i| <= 2^-11 for unit vectors
+            margin = 1e-3
+        else:
+            weights = query * self._scale
+            offset = float(query @ self._low + 128.0 * weights.sum())
+            # Each coordinate is off by at most half a quantization step
+            margin = float(0.5 * np.abs(weights).sum()) + 1e-4
+        scores = np.empty(n_rows, dtype=np.float32)
+        for start in range(0, n_rows, SCORE_CHUNK):
+            codes = self._codes[start:start + SCORE_CHUNK] if rows is None else self._codes[rows[start:start + SCORE_CHUNK]]
+            scores[start:start + SCORE_CHUNK] = codes.astype(np.float32) @ weights
+        scores += offset
+        return scores, margin
+
+    def _quantized_search(self, query: np.ndarray, top_k: int, similarity_threshold: float,
+                          rows: np.ndarray = None) -> List[Tuple[str, float]]:
+        approx, margin = self._approximate_scores(query, rows)
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        keep = np.flatnonzero(approx >= similarity_threshold - margin)
+        rows, approx = rows[keep], approx[keep]
+        shortlist_size = max(top_k * 4, RESCORE_CANDIDATES)
+        if rows.size > shortlist_size:
+            top = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+            exact = np.asarray(self.vectors[np.sort(rows[top])], dtype=np.float32) @ query
+            kth_best = np.partition(exact, exact.size - top_k)[exact.size - top_k]
+            # Anything outside the shortlist scores at most its approx score + margin; widen if that could beat the k-th best
+            if approx[top].min() + margin >= kth_best:
+                rows = rows[approx >= kth_best - margin]
+            else:
+                rows = rows[top]
+        return self._exact_search(query, rows, top_k, similarity_threshold)
+
+    def _exact_search(self, query: np.ndarray, rows: np.ndarray, top_k: int, similarity_threshold: float) -> List[Tuple[str, float]]:
+        """Full-precision search restricted to `rows`."""
+        rows = np.sort(rows)
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        above = np.flatnonzero(scores >= similarity_threshold)
+        best = above[top_k_positions(rows[above], scores[above], top_k)]
+        return [(self.ids[rows[i]], float(scores[i])) for i in best]
+
+    def search_rows(self, query: np.ndarray, rows: np.ndarray, top_k: int, similarity_threshold: float) -> List[Tuple[str, float]]:
+        """Search restricted to `rows` for a normalized query, through the quantized vectors when there are any."""
+        if self._codes is not None:
+            return self._quantized_search(query, top_k, similarity_threshold, rows)
+        return self._exact_search(query, rows, top_k, similarity_threshold)
+
+    def search(self, query_embedding, top_k: int = 5, similarity_threshold: float = 0.0,
+               candidate_ids: Iterable[str] = None) -> List[Tuple[str, float]]:
+        """Return up to `top_k` (ticket_id, similarity) pairs above the threshold, best first.
+
+        With `candidate_ids` only those tickets are scored (unknown ids are ignored).
+        """
+        if not len(self.ids) or top_k <= 0:
+            return []
+        if candidate_ids is not None:
+            rows = np.fromiter((self._positions[ticket_id] for ticket_id in candidate_ids if ticket_id in self._positions),
+                               dtype=np.int64)
+            if not rows.size:
+                return []
+            return self.search_rows(self._normalize_query(query_embedding), rows, top_k, similarity_threshold)
+        if self._codes is not None:
+            return self._quantized_search(self._normalize_query(query_embedding), top_k, similarity_threshold)
+        scores = self.scores(query_embedding)
+        above = np.flatnonzero(scores >= similarity_threshold)
+        best = above[top_k_positions(above, scores[above], top_k)]
+        return [(self.ids[i], float(scores[i])) for i in best]